@@ -0,0 +1,166 @@
+"""
+Fork server for mcp_pipe.py: import heavy modules once, fork Python MCP servers from them.
+
+Started by mcp_pipe.py when MCP_FORKSERVER=1, with one end of a Unix
+SOCK_SEQPACKET socketpair:
+    python mcp_forkserver.py <fd> [module,module,...]
+
+Every message is one JSON object. Requests carry the child's stdin, stdout
+and stderr pipe ends as SCM_RIGHTS file descriptors:
+    {"id": 1, "kind": "module" | "path", "name": "calculator", "argv": [...], "env": {...}, "cwd": "..."}
+Replies and exit events:
+    {"id": 1, "pid": 1234}      or  {"id": 1, "error": "..."}
+    {"pid": 1234, "returncode": 0}
+
+Each child runs the module or script as __main__ (like `python -m name` or
+`python script.py`) with the requested argv, environment and working
+directory. Modules imported before the fork are shared copy-on-write, so
+the child skips importing fastmcp, pydantic, requests, bs4, ...
+"""
+
+import gc
+import importlib
+import json
+import os
+import runpy
+import selectors
+import signal
+import socket
+import sys
+import traceback
+
+# Imported once in the template; missing ones are skipped. fastmcp imports its
+# server, context, providers and console banner lazily (on first use or first
+# request), so those are named explicitly.
+DEFAULT_PRELOAD = (
+    "fastmcp", "fastmcp.server.server", "fastmcp.server.context", "fastmcp.server.providers",
+    "fastmcp.server.middleware", "fastmcp.utilities.cli", "fastmcp.tools", "fastmcp.prompts",
+    "fastmcp.resources", "key_value.aio", "griffe", "beartype.door",
+    "mcp.server.fastmcp", "mcp.server.stdio", "anyio._backends._asyncio", "rich.panel", "rich.table",
+    "pydantic", "requests", "bs4", "dotenv",
+)
+
+
+def preload(modules):
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+        except Exception as e:
+            print(f"[forkserver] Failed to preload {name}: {e}", file=sys.stderr)
+
+
+def send(control, message):
+    control.send(json.dumps(message).encode("utf-8"))
+
+
+def run_child(request, fds):
+    """Become the requested server (never returns)."""
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    for target, fd in zip((0, 1, 2), fds):
+        os.dup2(fd, target)
+    for fd in fds:
+        os.close(fd)
+    code = 0
+    try:
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        sys.argv = list(request["argv"])
+        if request["kind"] == "module":
+            sys.path[0] = request["cwd"]
+            runpy.run_module(request["name"], run_name="__main__", alter_sys=True)
+        else:
+            sys.path[0] = os.path.dirname(os.path.abspath(request["name"]))
+            runpy.run_path(request["name"], run_name="__main__")
+    except SystemExit as e:
+        if isinstance(e.code, int) or e.code is None:
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+    os._exit(code)
+
+
+def reap(control):
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        send(control, {"pid": pid, "returncode": os.waitstatus_to_exitcode(status)})
+
+
+def serve(control):
+    """Fork a child per request until mcp_pipe closes its end of the socket."""
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    # Ctrl-C reaches the whole process group; mcp_pipe stops the children, then us
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    selector = selectors.DefaultSelector()
+    selector.register(control, selectors.EVENT_READ, "control")
+    selector.register(wake_r, selectors.EVENT_READ, "wake")
+    while True:
+        for key, _ in selector.select():
+            if key.data == "wake":
+                while True:
+                    try:
+                        if not os.read(wake_r, 4096):
+                            break
+                    except BlockingIOError:
+                        break
+                reap(control)
+                continue
+            data, fds, _, _ = socket.recv_fds(control, 1024 * 1024, 3)
+            if not data:
+                return
+            request = json.loads(data)
+            try:
+                if len(fds) != 3:
+                    raise RuntimeError(f"expected 3 file descriptors, got {len(fds)}")
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if pid == 0:
+                    selector.close()
+                    control.close()
+                    os.close(wake_r)
+                    os.close(wake_w)
+                    run_child(request, fds)
+                send(control, {"id": request["id"], "pid": pid})
+            except Exception as e:
+                send(control, {"id": request["id"], "error": str(e)})
+            finally:
+                for fd in fds:
+                    os.close(fd)
+
+
+def main():
+    control = socket.socket(fileno=int(sys.argv[1]))
+    modules = sys.argv[2].split(",") if len(sys.argv) > 2 else DEFAULT_PRELOAD
+    preload(m.strip() for m in modules if m.strip())
+    # Keep the collector from touching (and so copying) every preloaded object in each child
+    gc.freeze()
+    serve(control)
+
+
+if __name__ == "__main__":
+    main()
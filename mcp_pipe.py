@@ -10,25 +10,65 @@ Start server process(es) from config:
 Run all configured servers (default)
     python mcp_pipe.py
 
+Run all configured servers behind one WebSocket (tools exposed as <server>__<tool>)
+    python mcp_pipe.py --gateway
+
 Run a single local server script (back-compat)
     python mcp_pipe.py path/to/server.py
 
+WebSocket options (top-level "websocket" object, overridden by a server entry's own):
+    compression, compression_threshold, compression_level, max_size, max_queue,
+    write_limit, ping_interval, ping_timeout, open_timeout, close_timeout
+
 Config discovery order:
     $MCP_CONFIG, then ./mcp_config.json
 
 Env overrides:
-    (none for proxy; uses current Python: python -m mcp_proxy)
+    MCP_GATEWAY=1 is equivalent to --gateway
+    MCP_INPROCESS=1 hosts Python script targets in-process (per server: "inprocess": true)
+    MCP_METRICS_PORT=9464 serves Prometheus metrics on http://127.0.0.1:9464/metrics
+    MCP_METRICS_HOST=0.0.0.0 binds the metrics endpoint elsewhere (default 127.0.0.1)
+    MCP_METRICS_LOG_INTERVAL=300 seconds between traffic summary log lines (0 disables)
+    MCP_CONFIG_WATCH_INTERVAL=2 seconds between config reload checks (0 disables)
+    MCP_RECONNECT_STABLE_AFTER=60 seconds of healthy connection that reset the reconnect backoff
+    MCP_RECONNECT_MAX_ATTEMPTS=10 consecutive failures before backing off to CIRCUIT_OPEN_BACKOFF
+    MCP_FORKSERVER=1 forks Python servers from a template with preloaded modules (per server: "forkserver": false)
+    MCP_FORKSERVER_PRELOAD=fastmcp,requests,bs4 overrides the modules the template imports
+    MCP_LIST_CACHE=1 answers tools/list, prompts/list, resources/list from memory (per server: "cache": true)
+    MCP_REQUEST_TIMEOUT=120 seconds before an unanswered request fails (per server: "request_timeout", "tool_timeouts")
+    MCP_CAPTURE=captures/ records every WebSocket frame to captures/<target>.jsonl (replay: pipe_bench.py --replay)
+    MCP_STDERR_RATE=50 child stderr lines/s per server shown before the rest are only counted (0: no limit)
+    MCP_STDERR_LOG=stderr.jsonl writes child stderr as JSON lines instead of to the terminal (tail: /stderr)
+    (none for sse/http: spoken natively with httpx; per server "proxy": true runs python -m mcp_proxy)
 """
 
 import asyncio
 import websockets
-import subprocess
 import logging
 import os
 import signal
+import socket
+import shutil
 import sys
 import json
+import time
+import itertools
+import collections
+import bisect
+import re
+import threading
+import importlib
+import importlib.util
+import contextlib
+import random
+import hashlib
+import functools
+from urllib.parse import parse_qs
 from dotenv import load_dotenv
+from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory, PerMessageDeflate
+from websockets.frames import Opcode
+from websockets.asyncio.client import ClientConnection
+from mcp_remote import RemoteServer
 
 # Auto-load environment variables from a .env file if present
 load_dotenv()
@@ -42,145 +82,3101 @@ logger = logging.getLogger('MCP_PIPE')
 
 # Reconnection settings
 INITIAL_BACKOFF = 1  # Initial wait time in seconds
-MAX_BACKOFF = 600  # Maximum wait time in seconds
+MAX_BACKOFF = 600  # Maximum jittered wait time in seconds
+STABLE_SESSION = 60  # a session at least this long resets the backoff (seconds)
+MAX_RECONNECT_ATTEMPTS = 10  # consecutive failures before the circuit opens (0 never opens)
+CIRCUIT_OPEN_BACKOFF = 600  # wait between probes while the circuit is open (seconds)
+
+# Max size of a single line read from a child (large tool results, e.g. article lists)
+STREAM_LIMIT = 16 * 1024 * 1024
+
+# Per-child stdin queue: pause reading the WebSocket above HIGH, resume below LOW (bytes)
+STDIN_HIGH_WATER = 1024 * 1024
+STDIN_LOW_WATER = 256 * 1024
+
+# Messages that skip ahead of queued tool calls into the child's stdin (as do responses
+# to the child's own requests); they are also never held back by the high-water mark
+CONTROL_METHODS = frozenset({"ping", "initialize", "notifications/initialized", "notifications/cancelled"})
+
+VERSION = "0.2.0"
+
+# Gateway mode settings
+GATEWAY_SEPARATOR = "__"  # tools are exposed as <target>__<tool>
+GATEWAY_REQUEST_TIMEOUT = 60  # seconds to wait for a child's handshake / tools/list
+DEFAULT_PROTOCOL_VERSION = "2025-06-18"
+
+# Metrics settings
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PEEK_PARSE_LIMIT = 64 * 1024  # larger messages are scanned, not parsed, for ids
+PEEK_HEAD_BYTES = 512
+DEFAULT_METRICS_LOG_INTERVAL = 300  # seconds; 0 disables the summary log line
+CAPTURE_FLUSH_INTERVAL = 1  # seconds between flushes of MCP_CAPTURE files
+
+# Child stderr: lines kept per target for /stderr, lines/s (and burst) shipped to the sink, batching
+STDERR_TAIL_LINES = 200
+DEFAULT_STDERR_RATE = 50  # 0 ships every line
+STDERR_BURST = 200  # a crash traceback fits in the burst
+STDERR_MAX_LINE = 4096  # bytes; longer lines are truncated
+STDERR_READ_SIZE = 64 * 1024
+STDERR_FLUSH_INTERVAL = 0.5  # seconds between batched writes to the terminal / MCP_STDERR_LOG
+
+# Request deadlines ("request_timeout" / "tool_timeouts" / "max_stalls" per server)
+REQUEST_TIMEOUT_CODE = -32001  # JSON-RPC error code of a request the pipe timed out
+DEFAULT_MAX_STALLS = 3  # consecutive timeouts with no output from the child before it is restarted
+TIMED_OUT_MEMORY = 1024  # timed-out ids remembered so the child's late replies are dropped
+
+# Admission control ("max_inflight" / "max_queue" per server)
+SERVER_BUSY_CODE = -32000  # JSON-RPC error code of a request rejected by admission control
+
+# In-process hosting: attribute holding the FastMCP object, max messages queued to its loop
+INPROCESS_ATTRIBUTE = "mcp"
+INPROCESS_MAX_PENDING = 64
+
+# Config hot reload: seconds between mtime checks (0 disables), max wait for in-flight requests
+DEFAULT_CONFIG_WATCH_INTERVAL = 2
+DRAIN_TIMEOUT = 30
+TERMINATE_TIMEOUT = 5  # seconds a stopped child gets between SIGTERM and SIGKILL
+
+# Fork server: template process that preloads heavy modules and forks Python servers
+FORKSERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mcp_forkserver.py")
+FORKSERVER_SPAWN_TIMEOUT = 60  # seconds for the template to answer a spawn (includes its preload)
+
+# Idempotent methods the list cache may answer; list_changed notifications invalidate them
+CACHEABLE_METHODS = ("tools/list", "prompts/list", "resources/list")
+LIST_CHANGED = {
+    "notifications/tools/list_changed": "tools/list",
+    "notifications/prompts/list_changed": "prompts/list",
+    "notifications/resources/list_changed": "resources/list",
+}
+
+# Batch elements are sent to the child with ids "<prefix><n>" and mapped back on reply
+BATCH_ID_PREFIX = "mcp_pipe-batch-"
+# A respawned child is re-initialized with the endpoint's initialize under the id "<prefix><n>"
+INIT_ID_PREFIX = "mcp_pipe-init-"
+# Requests made by a replica get ids "<prefix><n>" towards the endpoint (replica ids may collide)
+REPLICA_ID_PREFIX = "mcp_pipe-replica-"
+
+# "websocket" config keys passed straight through to websockets.connect()
+WEBSOCKET_OPTIONS = (
+    "max_size",       # largest incoming message in bytes (null: unlimited)
+    "max_queue",      # incoming messages buffered before reading pauses
+    "write_limit",    # outgoing bytes buffered before send() waits
+    "ping_interval",  # seconds between keepalive pings (null: off)
+    "ping_timeout",   # seconds to wait for a pong before closing
+    "open_timeout",
+    "close_timeout",
+)
+
+# All ServerProcess instances by target, for the metrics endpoint
+registry = {}
+# ReconnectPolicy of every connect_with_retry loop by target, for the metrics endpoint
+policies = {}
+
+class ReconnectPolicy:
+    """When to reconnect after a connection attempt or session ends.
+
+    Delays use decorrelated jitter (uniform between INITIAL_BACKOFF and three
+    times the previous delay or INITIAL_BACKOFF, whichever is larger, capped
+    at MAX_BACKOFF), so servers dropped by the same endpoint restart do not
+    retry in lockstep, not even on their first attempt. A session that stayed
+    up for `stable_after` seconds resets the backoff. After `max_attempts`
+    consecutive failures the circuit opens and attempts are spaced
+    `open_backoff` apart until one connects again.
+
+    Subclass and pass to connect_with_retry() to change the policy.
+    """
+
+    def __init__(self, base=INITIAL_BACKOFF, cap=MAX_BACKOFF, stable_after=STABLE_SESSION,
+                 max_attempts=MAX_RECONNECT_ATTEMPTS, open_backoff=CIRCUIT_OPEN_BACKOFF):
+        self.base = base
+        self.cap = cap
+        self.stable_after = stable_after
+        self.max_attempts = max_attempts
+        self.open_backoff = open_backoff
+        self.failures = 0         # consecutive attempts without a stable session
+        self.delay = 0.0          # last wait returned by next_delay()
+        self.reconnects = 0       # attempts after the first connection
+        self.connected_at = None  # monotonic time the current session started
+        self.circuit_open = False
+
+    @classmethod
+    def from_env(cls):
+        return cls(stable_after=float(os.environ.get("MCP_RECONNECT_STABLE_AFTER", STABLE_SESSION)),
+                   max_attempts=int(os.environ.get("MCP_RECONNECT_MAX_ATTEMPTS", MAX_RECONNECT_ATTEMPTS)))
+
+    def connected(self):
+        self.connected_at = time.monotonic()
+        self.circuit_open = False  # half-open probe succeeded
+
+    def next_delay(self):
+        """Record a failed attempt or ended session and return seconds to wait."""
+        if self.connected_at is not None and time.monotonic() - self.connected_at >= self.stable_after:
+            self.failures = 0
+            self.delay = 0.0
+        self.connected_at = None
+        self.failures += 1
+        self.reconnects += 1
+        if self.max_attempts and self.failures > self.max_attempts:
+            self.circuit_open = True
+            self.delay = self.open_backoff * random.uniform(0.5, 1)
+        else:
+            self.delay = min(self.cap, random.uniform(self.base, max(self.base, self.delay) * 3))
+        return self.delay
+
+async def connect_with_retry(uri, server, policy=None):
+    """Connect to WebSocket server with retry mechanism for a given server (or gateway)."""
+    target = server.target
+    policy = policy or ReconnectPolicy.from_env()
+    policies[target] = policy
+    # Children outlive individual connections; they are only stopped when retrying ends
+    backoff = 0
+    cancelled = False
+    try:
+        while True:  # Infinite reconnection
+            try:
+                if backoff:
+                    if policy.circuit_open:
+                        logger.warning(f"[{target}] {policy.failures} consecutive failures, circuit open; "
+                                       f"next attempt in {backoff:.0f}s")
+                    else:
+                        logger.info(f"[{target}] Waiting {backoff:.1f}s before reconnection attempt {policy.failures}...")
+                    await asyncio.sleep(backoff)
+
+                # Attempt to connect
+                await connect_to_server(uri, server, policy.connected)
+
+            except Exception as e:
+                if server.removed:
+                    return
+                backoff = policy.next_delay()
+                logger.warning(f"[{target}] Connection closed (attempt {policy.failures}): {e}")
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        if policies.get(target) is policy:
+            del policies[target]
+        # Cancelled means shutting down (a removed server is stopped before it is cancelled):
+        # the loop closes after this, leaving nothing to reap the child, so wait for it
+        await server.stop(wait=cancelled)
+
+def log_frame(target, direction, data):
+    """Debug-log the start of a frame; bytes are only decoded when DEBUG is enabled."""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"[{target}] {direction} {bytes(data[:120]).decode('utf-8', errors='replace')}...")
+
+class Capture:
+    """Append each target's WebSocket frames to <directory>/<target>.jsonl.
+
+    One JSON object per line, "in" being endpoint -> pipe:
+        {"t": 1760000000.123456, "dir": "in" | "out", "frame": "<JSON-RPC text>"}
+        {"t": 1760000000.123456, "event": "connect"}
+    Frames are stored verbatim, tool arguments and results included.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.files = {}
+
+    def _file(self, target):
+        file = self.files.get(target)
+        if file is None:
+            name = re.sub(r'[^A-Za-z0-9_.-]', '_', target) + ".jsonl"
+            file = self.files[target] = open(os.path.join(self.directory, name), "a", encoding="utf-8")
+        return file
+
+    def record(self, target, direction, data):
+        if not isinstance(data, str):
+            data = bytes(data).decode('utf-8', errors='replace')
+        self._file(target).write(json.dumps({"t": round(time.time(), 6), "dir": direction, "frame": data}) + "\n")
+
+    def event(self, target, name):
+        self._file(target).write(json.dumps({"t": round(time.time(), 6), "event": name}) + "\n")
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+
+    async def flush_periodically(self):
+        try:
+            while True:
+                await asyncio.sleep(CAPTURE_FLUSH_INTERVAL)
+                self.flush()
+        finally:
+            self.flush()
+
+capture = None  # a Capture when MCP_CAPTURE is set
+
+class StderrLog:
+    """One target's child stderr: a bounded tail for /stderr and a rate-limited feed to the sink.
+
+    Every line lands in the tail. Runs of an identical line are shipped once
+    and then summarised as a repeat count; above `rate` lines/s (token bucket
+    of STDERR_BURST) lines are only counted and reported as suppressed.
+    """
+
+    def __init__(self, target, rate):
+        self.target = target
+        self.rate = rate
+        self.tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+        self.lines = 0
+        self.repeated = 0
+        self.suppressed = 0
+        self._last = None
+        self._shipped = False
+        self._repeats = 0
+        self._dropped = 0
+        self._tokens = STDERR_BURST
+        self._refilled = time.time()
+
+    def add(self, lines):
+        """Record lines (bytes, without newline) read in one chunk."""
+        now = time.time()
+        if self.rate:
+            self._tokens = min(STDERR_BURST, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+        for line in lines:
+            line = line.rstrip(b'\r')[:STDERR_MAX_LINE]
+            self.lines += 1
+            self.tail.append((now, line))
+            if line == self._last and self._shipped:
+                self._repeats += 1
+                self.repeated += 1
+                continue
+            self._last = line
+            if self._repeats:
+                stderr_sink.emit(self.target, None, repeated=self._repeats)
+                self._repeats = 0
+            self._shipped = not self.rate or self._tokens >= 1
+            if self._shipped:
+                self._tokens -= 1
+                self.settle()
+                stderr_sink.emit(self.target, line, now)
+            else:
+                self._dropped += 1
+                self.suppressed += 1
+
+    def settle(self):
+        """Ship the pending repeat and suppression counts."""
+        if self._repeats:
+            stderr_sink.emit(self.target, None, repeated=self._repeats)
+            self._repeats = 0
+        if self._dropped:
+            stderr_sink.emit(self.target, None, suppressed=self._dropped)
+            self._dropped = 0
+
+    def render(self, lines):
+        """The last `lines` lines, one per line with a local timestamp."""
+        out = []
+        for t, line in list(self.tail)[-lines:] if lines else ():
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)) + f".{int(t % 1 * 1000):03d}"
+            out.append(f"{stamp} {line.decode('utf-8', errors='replace')}\n")
+        return "".join(out)
+
+class StderrSink:
+    """Batches shipped stderr lines to the terminal, or to a JSONL file (MCP_STDERR_LOG).
+
+    File records, one per line:
+        {"t": 1760000000.123456, "target": "calc", "line": "..."}
+        {"t": 1760000000.123456, "target": "calc", "repeated": 41}     previous line, 41 more times
+        {"t": 1760000000.123456, "target": "calc", "suppressed": 950}  over the rate limit
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8") if path else None
+        self.pending = []
+
+    def emit(self, target, line, t=None, **summary):
+        self.pending.append((t or time.time(), target, line, summary))
+
+    def flush(self):
+        for log in stderr_logs.values():
+            log.settle()
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        out = []
+        for t, target, line, summary in pending:
+            if self.file is not None:
+                record = {"t": round(t, 6), "target": target}
+                if line is not None:
+                    record["line"] = line.decode('utf-8', errors='replace')
+                record.update(summary)
+                out.append(json.dumps(record) + "\n")
+            elif line is not None:
+                out.append(line.decode('utf-8', errors='replace') + "\n")
+            elif "repeated" in summary:
+                out.append(f"[{target}] (previous stderr line repeated {summary['repeated']} more times)\n")
+            else:
+                out.append(f"[{target}] ({summary['suppressed']} stderr lines suppressed, "
+                           f"over {stderr_logs[target].rate:g} lines/s; see /stderr)\n")
+        stream = self.file if self.file is not None else sys.stderr
+        try:
+            stream.write("".join(out))
+            stream.flush()
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to write child stderr: {e}")
+
+    async def flush_periodically(self):
+        try:
+            while True:
+                await asyncio.sleep(STDERR_FLUSH_INTERVAL)
+                self.flush()
+        finally:
+            self.flush()
+
+stderr_logs = {}  # target -> StderrLog, kept across restarts for crash diagnosis
+stderr_sink = StderrSink()  # replaced by a file sink when MCP_STDERR_LOG is set
+
+def stderr_log(target):
+    log = stderr_logs.get(target)
+    if log is None:
+        log = stderr_logs[target] = StderrLog(target, float(os.environ.get("MCP_STDERR_RATE", DEFAULT_STDERR_RATE)))
+    return log
+
+def jsonrpc_error(request_id, code, message):
+    """Build a JSON-RPC error response."""
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+class BatchReply:
+    """Collects the responses to one JSON-RPC batch and sends them as one array.
+
+    Every element that expects a response reserves a position with expect();
+    the array goes out in request order once seal() was called and every
+    position has been filled. A batch of only notifications sends nothing.
+    """
+
+    def __init__(self, send):
+        self.send = send
+        self.responses = []
+        self.missing = 0
+        self.sealed = False
+        self.sent = False
+
+    def expect(self):
+        self.responses.append(None)
+        self.missing += 1
+        return len(self.responses) - 1
+
+    async def add(self, position, response):
+        self.responses[position] = response
+        self.missing -= 1
+        await self._flush()
+
+    async def seal(self):
+        self.sealed = True
+        await self._flush()
+
+    async def _flush(self):
+        if self.sealed and not self.missing and self.responses and not self.sent:
+            self.sent = True
+            await self.send(self.responses)
+
+def is_batch(message):
+    return message[:1] == b'[' or message.lstrip()[:1] == b'['
+
+# JSON-RPC envelope fields near the start of a message (used for large messages only)
+_ID_RE = re.compile(rb'"id"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+)')
+_METHOD_RE = re.compile(rb'"method"\s*:\s*"([^"]+)"')
+_NAME_RE = re.compile(rb'"name"\s*:\s*"([^"]+)"')
+
+def jsonrpc_id(value):
+    """`value` if it is usable as a JSON-RPC id (string or integer), else None."""
+    if isinstance(value, str) or (isinstance(value, int) and not isinstance(value, bool)):
+        return value
+    return None
+
+def request_params(msg):
+    """A message's params if they are an object (by-name), else {}."""
+    params = msg.get("params")
+    return params if isinstance(params, dict) else {}
+
+def has_id(message):
+    """True if message parses to an object with an "id" member (of any type)."""
+    try:
+        return "id" in json.loads(message)
+    except (ValueError, TypeError):
+        return False
+
+def peek_jsonrpc(data):
+    """Return (id, method, tool, is_error) for one JSON-RPC message, or None.
+
+    Messages up to PEEK_PARSE_LIMIT bytes are parsed. Larger ones (tool
+    results) are only scanned near the start, where the envelope fields are
+    serialized, so a 1 MB result is never decoded just for bookkeeping.
+    Malformed fields (object ids, positional params, ...) read as None; such
+    messages are still forwarded, the child answers them.
+    """
+    if len(data) <= PEEK_PARSE_LIMIT:
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            return None
+        if not isinstance(msg, dict):
+            return None
+        method = msg.get("method")
+        if not isinstance(method, str):
+            method = None
+        tool = request_params(msg).get("name") if method == "tools/call" else None
+        return jsonrpc_id(msg.get("id")), method, tool if isinstance(tool, str) else None, "error" in msg
+    head = bytes(data[:PEEK_HEAD_BYTES])
+    match = _ID_RE.search(head)
+    request_id = json.loads(match.group(1)) if match else None
+    match = _METHOD_RE.search(head)
+    method = match.group(1).decode('utf-8') if match else None
+    tool = None
+    if method == "tools/call":
+        match = _NAME_RE.search(head)
+        tool = match.group(1).decode('utf-8') if match else None
+    return request_id, method, tool, b'"error"' in head
+
+def message_lane(message):
+    """Stdin lane for a message from the endpoint: "control" or "data".
+
+    Only the head is scanned; anything without a method (a response) is control.
+    """
+    match = _METHOD_RE.search(message[:PEEK_HEAD_BYTES])
+    if match is None or match.group(1).decode('utf-8') in CONTROL_METHODS:
+        return "control"
+    return "data"
+
+class Histogram:
+    """Cumulative latency histogram with Prometheus-style buckets (seconds)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+
+    def quantile(self, q, counts=None):
+        """Estimate a quantile by interpolating inside its bucket."""
+        counts = counts or self.counts
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+class ServerMetrics:
+    """Traffic and latency counters for one target.
+
+    Requests are matched to responses by JSON-RPC id. Ids are scoped to a
+    connection, so in-flight entries are abandoned when a new one attaches.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.requests = collections.Counter()   # (method, tool) -> count
+        self.responses = collections.Counter()  # (method, tool, outcome) -> count
+        self.latency = {}                       # (method, tool) -> Histogram
+        self.in_flight = {}                     # id -> (started, method, tool)
+        self.bytes_in = 0   # endpoint -> child
+        self.bytes_out = 0  # child -> endpoint
+        self.messages_in = 0
+        self.messages_out = 0
+        self.abandoned = 0
+        self._last_summary = None
+
+    def request_started(self, request_id, method, tool, nbytes):
+        self.messages_in += 1
+        self.bytes_in += nbytes
+        if method is None:
+            return
+        self.requests[(method, tool or "")] += 1
+        if jsonrpc_id(request_id) is not None:
+            self.in_flight[request_id] = (time.perf_counter(), method, tool or "")
+
+    def response_sent(self, request_id, is_error, nbytes):
+        self.messages_out += 1
+        self.bytes_out += nbytes
+        entry = self.in_flight.pop(request_id, None) if request_id is not None else None
+        if entry is None:
+            return
+        started, method, tool = entry
+        key = (method, tool)
+        self.responses[(method, tool, "error" if is_error else "ok")] += 1
+        if key not in self.latency:
+            self.latency[key] = Histogram()
+        self.latency[key].observe(time.perf_counter() - started)
+
+    def observe_inbound(self, message):
+        """Record a raw message from the endpoint to the child. Returns its peek_jsonrpc()."""
+        peeked = peek_jsonrpc(message)
+        request_id, method, tool, _ = peeked or (None, None, None, False)
+        self.request_started(request_id, method, tool, len(message))
+        return peeked
+
+    def observe_outbound(self, data, peeked=None):
+        """Record a raw line from the child to the endpoint (`peeked`: its peek_jsonrpc(), if known)."""
+        if not self.in_flight:
+            self.messages_out += 1
+            self.bytes_out += len(data)
+            return
+        if peeked is None:
+            peeked = peek_jsonrpc(data)
+        if peeked is None or peeked[1] is not None:
+            # Notification or child-initiated request, not a response
+            self.messages_out += 1
+            self.bytes_out += len(data)
+            return
+        self.response_sent(peeked[0], peeked[3], len(data))
+
+    def abandon_in_flight(self):
+        self.abandoned += len(self.in_flight)
+        self.in_flight.clear()
+
+    def total_latency(self):
+        """All methods merged into one histogram."""
+        merged = Histogram()
+        for hist in self.latency.values():
+            merged.count += hist.count
+            merged.sum += hist.sum
+            merged.counts = [a + b for a, b in zip(merged.counts, hist.counts)]
+        return merged
+
+    def summary(self):
+        """One-line summary of traffic since the previous call."""
+        merged = self.total_latency()
+        now = (time.perf_counter(), sum(self.requests.values()), self.bytes_in, self.bytes_out, merged.counts)
+        if self._last_summary is None:
+            last = (now[0], 0, 0, 0, [0] * len(merged.counts))
+        else:
+            last = self._last_summary
+        self._last_summary = now
+        window = [a - b for a, b in zip(now[4], last[4])]
+        return (f"[{self.target}] {now[1] - last[1]} requests, "
+                f"in {now[2] - last[2]} B, out {now[3] - last[3]} B, "
+                f"in-flight {len(self.in_flight)}, "
+                f"p50 {merged.quantile(0.5, window) * 1000:.1f} ms "
+                f"p95 {merged.quantile(0.95, window) * 1000:.1f} ms "
+                f"p99 {merged.quantile(0.99, window) * 1000:.1f} ms")
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ",".join(f'{k}="{escape(v)}"' for k, v in labels.items())
+
+def render_prometheus():
+    """Render metrics of all registered servers in Prometheus text format."""
+    out = []
+
+    def family(name, kind, help_text):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+
+    servers = list(registry.values())
+    family("mcp_pipe_requests_total", "counter", "JSON-RPC requests forwarded to the child")
+    for s in servers:
+        for (method, tool), n in s.metrics.requests.items():
+            out.append(f"mcp_pipe_requests_total{{{_labels(target=s.target, method=method, tool=tool)}}} {n}")
+    family("mcp_pipe_responses_total", "counter", "JSON-RPC responses matched to a request")
+    for s in servers:
+        for (method, tool, outcome), n in s.metrics.responses.items():
+            out.append(f"mcp_pipe_responses_total{{{_labels(target=s.target, method=method, tool=tool, outcome=outcome)}}} {n}")
+    family("mcp_pipe_bytes_total", "counter", "Payload bytes through the pipe")
+    for s in servers:
+        out.append(f"mcp_pipe_bytes_total{{{_labels(target=s.target, direction='in')}}} {s.metrics.bytes_in}")
+        out.append(f"mcp_pipe_bytes_total{{{_labels(target=s.target, direction='out')}}} {s.metrics.bytes_out}")
+    family("mcp_pipe_in_flight", "gauge", "Requests awaiting a response")
+    for s in servers:
+        out.append(f"mcp_pipe_in_flight{{{_labels(target=s.target)}}} {len(s.metrics.in_flight)}")
+    family("mcp_pipe_abandoned_total", "counter", "Requests whose connection closed before the response")
+    for s in servers:
+        out.append(f"mcp_pipe_abandoned_total{{{_labels(target=s.target)}}} {s.metrics.abandoned}")
+    family("mcp_pipe_stdin_queue_bytes", "gauge", "Bytes queued for the child's stdin")
+    for s in servers:
+        out.append(f"mcp_pipe_stdin_queue_bytes{{{_labels(target=s.target)}}} {s.outbound_bytes}")
+    family("mcp_pipe_stdin_queue_pauses_total", "counter", "Times WebSocket reads paused on a full stdin queue")
+    for s in servers:
+        out.append(f"mcp_pipe_stdin_queue_pauses_total{{{_labels(target=s.target)}}} {s.queue_stats['pauses']}")
+    pools = [s for s in servers if isinstance(s, ReplicaPool)]
+    family("mcp_pipe_replica_outstanding", "gauge", "Requests routed to a replica and not answered yet")
+    for s in pools:
+        for r in s.replicas:
+            out.append(f"mcp_pipe_replica_outstanding{{{_labels(target=s.target, replica=r.index)}}} {len(r.outstanding)}")
+    family("mcp_pipe_replica_requests_total", "counter", "Requests routed to a replica")
+    for s in pools:
+        for r in s.replicas:
+            out.append(f"mcp_pipe_replica_requests_total{{{_labels(target=s.target, replica=r.index)}}} {r.dispatched}")
+    family("mcp_pipe_replica_steals_total", "counter",
+           "Requests a less busy replica took over from the one round-robin would have picked")
+    for s in pools:
+        for r in s.replicas:
+            out.append(f"mcp_pipe_replica_steals_total{{{_labels(target=s.target, replica=r.index)}}} {r.steals}")
+    family("mcp_pipe_stdin_queue_wait_seconds", "histogram", "Time messages waited in the child's stdin queue, by lane")
+    for s in servers:
+        children = s.replicas if isinstance(s, ReplicaPool) else [s]
+        for lane in ("control", "data"):
+            labels = _labels(target=s.target, lane=lane)
+            hists = [child.queue_wait[lane] for child in children]
+            cumulative = 0
+            for i, bound in enumerate(list(LATENCY_BUCKETS) + ["+Inf"]):
+                cumulative += sum(hist.counts[i] for hist in hists)
+                out.append(f"mcp_pipe_stdin_queue_wait_seconds_bucket{{{labels},le=\"{bound}\"}} {cumulative}")
+            out.append(f"mcp_pipe_stdin_queue_wait_seconds_sum{{{labels}}} {sum(hist.sum for hist in hists)}")
+            out.append(f"mcp_pipe_stdin_queue_wait_seconds_count{{{labels}}} {sum(hist.count for hist in hists)}")
+    family("mcp_pipe_local_pings_total", "counter", "Pings answered by the pipe because the child was busy")
+    for s in servers:
+        out.append(f"mcp_pipe_local_pings_total{{{_labels(target=s.target)}}} {s.queue_stats['local_pings']}")
+    family("mcp_pipe_child_restarts_total", "counter", "Children respawned after exiting on their own")
+    for s in servers:
+        children = s.replicas if isinstance(s, ReplicaPool) else [s]
+        out.append(f"mcp_pipe_child_restarts_total{{{_labels(target=s.target)}}} {sum(c.restarts for c in children)}")
+    family("mcp_pipe_request_timeouts_total", "counter", "Requests answered with a timeout error by the pipe")
+    for s in servers:
+        for (method, tool), count in sorted(s.timeouts.items()):
+            out.append(f"mcp_pipe_request_timeouts_total{{{_labels(target=s.target, method=method, tool=tool)}}} {count}")
+    family("mcp_pipe_stall_restarts_total", "counter", "Children killed after max_stalls timeouts in a row")
+    for s in servers:
+        out.append(f"mcp_pipe_stall_restarts_total{{{_labels(target=s.target)}}} {s.stall_restarts}")
+    family("mcp_pipe_requests_held", "gauge", "Requests waiting in the pipe for a max_inflight slot")
+    for s in servers:
+        out.append(f"mcp_pipe_requests_held{{{_labels(target=s.target)}}} {len(s.held)}")
+    family("mcp_pipe_requests_rejected_total", "counter", "Requests rejected as retryable because max_queue was full")
+    for s in servers:
+        out.append(f"mcp_pipe_requests_rejected_total{{{_labels(target=s.target)}}} {s.rejected}")
+    family("mcp_pipe_child_hibernating", "gauge", "1 while the child is stopped for idleness")
+    for s in servers:
+        out.append(f"mcp_pipe_child_hibernating{{{_labels(target=s.target)}}} {int(s.hibernated is not None)}")
+    family("mcp_pipe_child_hibernations_total", "counter", "Children stopped after idle_timeout")
+    for s in servers:
+        out.append(f"mcp_pipe_child_hibernations_total{{{_labels(target=s.target)}}} {s.hibernations}")
+    family("mcp_pipe_child_wakes_total", "counter", "Hibernating children respawned by a request")
+    for s in servers:
+        out.append(f"mcp_pipe_child_wakes_total{{{_labels(target=s.target)}}} {s.wakes}")
+    family("mcp_pipe_children_exiting", "gauge", "Stopped children that have not exited yet")
+    out.append(f"mcp_pipe_children_exiting {len(supervisor.exiting)}")
+    family("mcp_pipe_children_killed_total", "counter", "Stopped children that had to be sent SIGKILL")
+    out.append(f"mcp_pipe_children_killed_total {supervisor.killed}")
+    family("mcp_pipe_request_duration_seconds", "histogram", "Request to response latency")
+    for s in servers:
+        for (method, tool), hist in s.metrics.latency.items():
+            labels = _labels(target=s.target, method=method, tool=tool)
+            cumulative = 0
+            for bound, n in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+                cumulative += n
+                out.append(f"mcp_pipe_request_duration_seconds_bucket{{{labels},le=\"{bound}\"}} {cumulative}")
+            out.append(f"mcp_pipe_request_duration_seconds_sum{{{labels}}} {hist.sum}")
+            out.append(f"mcp_pipe_request_duration_seconds_count{{{labels}}} {hist.count}")
+    family("mcp_pipe_request_latency_seconds", "gauge", "Estimated latency quantiles over all methods")
+    for s in servers:
+        merged = s.metrics.total_latency()
+        for q in (0.5, 0.95, 0.99):
+            out.append(f"mcp_pipe_request_latency_seconds{{{_labels(target=s.target, quantile=q)}}} {merged.quantile(q):.6f}")
+    family("mcp_pipe_list_cache_requests_total", "counter", "List requests answered from the cache (hit) or the child (miss)")
+    for s in servers:
+        for result, counts in (("hit", s.list_cache.hits), ("miss", s.list_cache.misses)):
+            for method, n in counts.items():
+                out.append(f"mcp_pipe_list_cache_requests_total{{{_labels(target=s.target, method=method, result=result)}}} {n}")
+    logs = sorted(stderr_logs.items())
+    family("mcp_pipe_stderr_lines_total", "counter", "Lines a child wrote to stderr")
+    for target, log in logs:
+        out.append(f"mcp_pipe_stderr_lines_total{{{_labels(target=target)}}} {log.lines}")
+    family("mcp_pipe_stderr_suppressed_total", "counter", "Stderr lines not shipped (over MCP_STDERR_RATE)")
+    for target, log in logs:
+        out.append(f"mcp_pipe_stderr_suppressed_total{{{_labels(target=target)}}} {log.suppressed}")
+    family("mcp_pipe_stderr_repeated_total", "counter", "Stderr lines folded into a repeat count")
+    for target, log in logs:
+        out.append(f"mcp_pipe_stderr_repeated_total{{{_labels(target=target)}}} {log.repeated}")
+    reconnecting = sorted(policies.items())
+    family("mcp_pipe_connected", "gauge", "Whether the target's WebSocket is connected")
+    for target, p in reconnecting:
+        out.append(f"mcp_pipe_connected{{{_labels(target=target)}}} {int(p.connected_at is not None)}")
+    family("mcp_pipe_reconnects_total", "counter", "WebSocket reconnection attempts")
+    for target, p in reconnecting:
+        out.append(f"mcp_pipe_reconnects_total{{{_labels(target=target)}}} {p.reconnects}")
+    family("mcp_pipe_reconnect_failures", "gauge", "Consecutive connection failures without a stable session")
+    for target, p in reconnecting:
+        out.append(f"mcp_pipe_reconnect_failures{{{_labels(target=target)}}} {p.failures}")
+    family("mcp_pipe_reconnect_backoff_seconds", "gauge", "Last reconnect delay")
+    for target, p in reconnecting:
+        out.append(f"mcp_pipe_reconnect_backoff_seconds{{{_labels(target=target)}}} {p.delay:.3f}")
+    family("mcp_pipe_circuit_open", "gauge", "Whether reconnects are spaced CIRCUIT_OPEN_BACKOFF apart")
+    for target, p in reconnecting:
+        out.append(f"mcp_pipe_circuit_open{{{_labels(target=target)}}} {int(p.circuit_open)}")
+    return "\n".join(out) + "\n"
+
+def render_stderr(query):
+    """Body of /stderr[?target=NAME][&lines=N]: the last lines of each child's stderr."""
+    try:
+        lines = max(0, int(query.get("lines", [STDERR_TAIL_LINES])[0]))
+    except ValueError:
+        return "400 Bad Request", "lines must be an integer\n"
+    targets = query.get("target") or sorted(stderr_logs)
+    missing = [t for t in targets if t not in stderr_logs]
+    if missing:
+        return "404 Not Found", f"no stderr captured for {', '.join(missing)}\n"
+    out = []
+    for target in targets:
+        log = stderr_logs[target]
+        out.append(f"==> {target} ({log.lines} lines, {log.suppressed} suppressed, {log.repeated} repeats) <==\n")
+        out.append(log.render(lines))
+    return "200 OK", "".join(out)
+
+async def handle_admin_request(reader, writer):
+    """Minimal HTTP/1.0 handler for the local metrics endpoint (/metrics, /stderr)."""
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass  # ignore headers
+        parts = request_line.split()
+        path, _, query = (parts[1].decode('latin-1') if len(parts) >= 2 else '/').partition('?')
+        if path == '/metrics':
+            status, body = "200 OK", render_prometheus()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == '/stderr':
+            status, body = render_stderr(parse_qs(query))
+            content_type = "text/plain; charset=utf-8"
+        else:
+            status, body, content_type = "404 Not Found", "not found\n", "text/plain"
+        payload = body.encode('utf-8')
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1') + payload)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def log_metrics_summary(interval):
+    """Log one traffic summary line per server every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        for server in list(registry.values()):
+            logger.info(server.metrics.summary())
+
+async def start_metrics():
+    """Start the metrics endpoint and summary logger if configured via env."""
+    tasks = []
+    port = os.environ.get("MCP_METRICS_PORT")
+    if port:
+        host = os.environ.get("MCP_METRICS_HOST", "127.0.0.1")
+        server = await asyncio.start_server(handle_admin_request, host, int(port))
+        logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+        tasks.append(asyncio.create_task(server.serve_forever()))
+    interval = float(os.environ.get("MCP_METRICS_LOG_INTERVAL", DEFAULT_METRICS_LOG_INTERVAL))
+    if interval > 0:
+        tasks.append(asyncio.create_task(log_metrics_summary(interval)))
+    return tasks
+
+class _InProcessStdin:
+    """stdin side of an InProcessServer: line-framed bytes in, one message per line."""
+
+    def __init__(self, host):
+        self.host = host
+        self._buffer = b''
+        self._closed = False
+
+    def write(self, data):
+        self._buffer += data
+        while b'\n' in self._buffer:
+            line, _, self._buffer = self._buffer.partition(b'\n')
+            self.host.submit(line)
+
+    def writelines(self, parts):
+        for part in parts:
+            self.write(part)
+
+    async def drain(self):
+        await self.host.wait_for_capacity()
+
+    def is_closing(self):
+        return self._closed
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self.host.submit(None)
+            except BrokenPipeError:
+                pass
+
+class _InProcessStdout:
+    """stdout side of an InProcessServer: serialized messages, b'' at exit."""
+
+    def __init__(self):
+        self.lines = asyncio.Queue()
+
+    async def readline(self):
+        return await self.lines.get()
+
+class InProcessServer:
+    """A FastMCP server object hosted inside mcp_pipe, shaped like asyncio.subprocess.Process.
+
+    The module is imported once per target and its `mcp` object is run on
+    its own event loop in a daemon thread, so blocking tool code only
+    stalls that server.
+    Messages travel over in-memory streams: each stdin line is parsed once
+    into a SessionMessage and each result serialized once, with no process
+    spawn and no pipe syscalls.
+    """
 
-async def connect_with_retry(uri, target):
-    """Connect to WebSocket server with retry mechanism for a given server target."""
-    reconnect_attempt = 0
-    backoff = INITIAL_BACKOFF
-    while True:  # Infinite reconnection
+    def __init__(self, target, spec):
+        self.target = target
+        self.spec = spec
+        self.pid = os.getpid()
+        self.returncode = None
+        self.stdin = _InProcessStdin(self)
+        self.stdout = _InProcessStdout()
+        self.stderr = None
+        self._pipe_loop = asyncio.get_running_loop()
+        self._server_loop = None
+        self._inbox = None
+        self._main_task = None
+        self._pending = 0
+        self._capacity = asyncio.Event()
+        self._capacity.set()
+        self._ready = asyncio.Event()
+        self._exited = asyncio.Event()
+
+    @classmethod
+    async def launch(cls, target, spec):
+        host = cls(target, spec)
+        thread = threading.Thread(target=host._run, name=f"mcp-inprocess-{target}", daemon=True)
+        thread.start()
+        # Wait until the server loop accepts input (or the import failed)
+        _, pending = await asyncio.wait({asyncio.ensure_future(host._ready.wait()),
+                                         asyncio.ensure_future(host._exited.wait())},
+                                        return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        return host
+
+    def _run(self):
+        code = 0
         try:
-            if reconnect_attempt > 0:
-                logger.info(f"[{target}] Waiting {backoff}s before reconnection attempt {reconnect_attempt}...")
-                await asyncio.sleep(backoff)
+            server = load_inprocess_server(self.target, self.spec)
+            asyncio.run(self._serve(server))
+        except asyncio.CancelledError:
+            code = -9
+        except BaseException as e:
+            logger.error(f"[{self.target}] In-process server failed: {e}")
+            code = 1
+        self._pipe_loop.call_soon_threadsafe(self._on_exit, code)
+
+    def _on_exit(self, code):
+        if self.returncode is None:
+            self.returncode = code
+        self.stdout.lines.put_nowait(b'')
+        self._capacity.set()
+        self._exited.set()
+
+    async def _serve(self, server):
+        import anyio
+        from mcp.shared.message import SessionMessage
+
+        if self.returncode is not None:
+            return  # killed while the module was importing
+        self._server_loop = asyncio.get_running_loop()
+        self._main_task = asyncio.current_task()
+        self._inbox = asyncio.Queue()
+        self._pipe_loop.call_soon_threadsafe(self._ready.set)
+
+        lowlevel = server._mcp_server
+        read_writer, read_stream = anyio.create_memory_object_stream(0)
+        write_stream, write_reader = anyio.create_memory_object_stream(0)
+
+        async def feed():
+            async with read_writer:
+                while True:
+                    line = await self._inbox.get()
+                    self._pipe_loop.call_soon_threadsafe(self._consumed)
+                    if line is None:
+                        return  # stdin closed: ends lowlevel.run()
+                    try:
+                        message = parse_jsonrpc_message(line)
+                    except Exception as e:
+                        await read_writer.send(e)
+                        continue
+                    await read_writer.send(SessionMessage(message))
+
+        async def emit():
+            async with write_reader:
+                async for session_message in write_reader:
+                    line = dump_jsonrpc_message(session_message.message) + b'\n'
+                    self._pipe_loop.call_soon_threadsafe(self.stdout.lines.put_nowait, line)
+
+        lifespan = getattr(server, "_lifespan_manager", None)  # fastmcp >= 2.14
+        async with (lifespan() if lifespan else contextlib.nullcontext()):
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(feed)
+                tg.start_soon(emit)
+                await lowlevel.run(read_stream, write_stream, lowlevel.create_initialization_options())
+                tg.cancel_scope.cancel()
+
+    def submit(self, line):
+        """Hand one message (or None for EOF) to the server loop."""
+        if self._server_loop is None or self.returncode is not None:
+            raise BrokenPipeError(f"in-process server {self.target} is not running")
+        self._pending += 1
+        if self._pending >= INPROCESS_MAX_PENDING:
+            self._capacity.clear()
+        self._server_loop.call_soon_threadsafe(self._inbox.put_nowait, line)
+
+    def _consumed(self):
+        self._pending -= 1
+        if self._pending < INPROCESS_MAX_PENDING:
+            self._capacity.set()
+
+    async def wait_for_capacity(self):
+        await self._capacity.wait()
+        if self.returncode is not None:
+            raise BrokenPipeError(f"in-process server {self.target} has exited")
+
+    def terminate(self):
+        if self._server_loop is None:
+            self.kill()  # still importing: nothing to shut down gracefully
+        else:
+            self.stdin.close()
+
+    def kill(self):
+        # A thread cannot be killed: cancel its loop and abandon it if tool code is blocking
+        if self._server_loop is not None and self._main_task is not None:
+            self._server_loop.call_soon_threadsafe(self._main_task.cancel)
+        self._on_exit(-9)
+
+    async def wait(self):
+        await self._exited.wait()
+        return self.returncode
+
+def parse_jsonrpc_message(data):
+    """Parse one JSON-RPC message into the MCP SDK's message type."""
+    from mcp import types
+    adapter = getattr(types, "jsonrpc_message_adapter", None)  # mcp >= 2
+    if adapter is not None:
+        return adapter.validate_json(data, by_name=False)
+    return types.JSONRPCMessage.model_validate_json(data)
+
+def dump_jsonrpc_message(message):
+    """Serialize an MCP SDK message the way its stdio transport does."""
+    from mcp import types
+    if hasattr(types, "jsonrpc_message_adapter"):  # mcp >= 2
+        return message.model_dump_json(by_alias=True, exclude_unset=True).encode('utf-8')
+    return message.model_dump_json(by_alias=True, exclude_none=True).encode('utf-8')
+
+# Server threads start together; one import at a time, so none sees another's half-run module
+_inprocess_import_lock = threading.Lock()
+
+def load_inprocess_server(target, spec):
+    """Import the module named by an in-process spec for target and return its FastMCP object.
+
+    Each target gets its own module object, so targets running the same
+    script or module never share a FastMCP across threads; a respawn of
+    the target reuses it.
+    """
+    kind, name = spec
+    module_name = "mcp_inprocess_" + re.sub(r'\W', '_', target)
+    with _inprocess_import_lock:
+        module = sys.modules.get(module_name)
+        if module is None:
+            locations = None
+            if kind == "module":
+                if os.getcwd() not in sys.path:
+                    sys.path.insert(0, os.getcwd())  # like `python -m`
+                found = importlib.util.find_spec(name)
+                if found is None or not found.has_location:
+                    raise RuntimeError(f"No module named '{name}'")
+                path, locations = found.origin, found.submodule_search_locations
+            else:
+                path = os.path.abspath(name)
+            module_spec = importlib.util.spec_from_file_location(module_name, path,
+                                                                 submodule_search_locations=locations)
+            module = importlib.util.module_from_spec(module_spec)
+            sys.modules[module_name] = module
+            try:
+                module_spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[module_name]
+                raise
+    server = getattr(module, INPROCESS_ATTRIBUTE, None)
+    if server is None or not hasattr(server, "_mcp_server"):
+        raise RuntimeError(f"{name} has no FastMCP object named '{INPROCESS_ATTRIBUTE}'")
+    return server
+
+class ForkedProcess:
+    """A server forked by the fork server, shaped like asyncio.subprocess.Process.
+
+    The child belongs to the template process, which reaps it and reports
+    its exit status; signals are sent to it directly.
+    """
+
+    def __init__(self, pid, stdin, stdout, stderr, exited):
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self._exited = exited
+
+    @property
+    def returncode(self):
+        return self._exited.result() if self._exited.done() else None
+
+    def send_signal(self, sig):
+        if self.returncode is not None:
+            raise ProcessLookupError(self.pid)  # reaped: the pid may belong to someone else now
+        os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    async def wait(self):
+        return await asyncio.shield(self._exited)
+
+class ForkServer:
+    """Client for mcp_forkserver.py, started once and shared by all servers.
+
+    The template imports fastmcp, pydantic, requests, bs4 ... once; every
+    Python server is then forked from it instead of paying interpreter start
+    and imports again. Requests and replies are single SOCK_SEQPACKET
+    messages; the child's pipe ends travel with the request as SCM_RIGHTS.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.sock = None
+        self.lock = asyncio.Lock()
+        self.replies = {}  # request id -> Future for {"pid": ...} / {"error": ...}
+        self.exits = {}    # pid -> Future for the child's returncode
+        self._ids = itertools.count(1)
+
+    @property
+    def running(self):
+        return self.sock is not None
+
+    async def ensure_started(self):
+        async with self.lock:
+            if self.running:
+                return
+            ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            cmd = [sys.executable, FORKSERVER_SCRIPT, str(theirs.fileno())]
+            if os.environ.get("MCP_FORKSERVER_PRELOAD"):
+                cmd.append(os.environ["MCP_FORKSERVER_PRELOAD"])
+            try:
+                self.process = await asyncio.create_subprocess_exec(*cmd, pass_fds=(theirs.fileno(),))
+            finally:
+                theirs.close()
+            ours.setblocking(False)
+            self.sock = ours
+            asyncio.get_running_loop().add_reader(ours.fileno(), self._on_readable)
+            logger.info(f"[forkserver] Started template process (pid {self.process.pid})")
+
+    def _on_readable(self):
+        try:
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._lost()
+            return
+        message = json.loads(data)
+        if "id" in message:
+            future = self.replies.pop(message["id"], None)
+            if "pid" in message:
+                self.exits[message["pid"]] = asyncio.get_running_loop().create_future()
+            if future is not None and not future.done():
+                future.set_result(message)
+        else:
+            future = self.exits.pop(message["pid"], None)
+            if future is not None and not future.done():
+                future.set_result(message["returncode"])
+
+    def _lost(self):
+        """The template died: its children can no longer be reaped by us, so kill them."""
+        asyncio.get_running_loop().remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        if self.exits:
+            logger.error(f"[forkserver] Template process exited; killing its {len(self.exits)} children")
+        for pid, future in self.exits.items():
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGKILL)
+            if not future.done():
+                future.set_result(-signal.SIGKILL)
+        self.exits.clear()
+        for future in self.replies.values():
+            if not future.done():
+                future.set_result({"error": "fork server exited"})
+        self.replies.clear()
+
+    async def spawn(self, kind, name, argv, env):
+        """Fork a child running `python -m name` (kind "module") or `python name` (kind "path")."""
+        await self.ensure_started()
+        loop = asyncio.get_running_loop()
+        request_id = next(self._ids)
+        reply = self.replies[request_id] = loop.create_future()
+        stdin_r, stdin_w = os.pipe()
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        request = {"id": request_id, "kind": kind, "name": name, "argv": argv, "env": env, "cwd": os.getcwd()}
+        try:
+            socket.send_fds(self.sock, [json.dumps(request).encode('utf-8')], [stdin_r, stdout_w, stderr_w])
+            message = await asyncio.wait_for(reply, FORKSERVER_SPAWN_TIMEOUT)
+            if "error" in message:
+                raise RuntimeError(f"fork server could not start {name}: {message['error']}")
+        except BaseException:
+            self.replies.pop(request_id, None)
+            for fd in (stdin_w, stdout_r, stderr_r):
+                os.close(fd)
+            raise
+        finally:
+            # The template holds its own copies now
+            for fd in (stdin_r, stdout_w, stderr_w):
+                os.close(fd)
+        pid = message["pid"]
+        stdout = asyncio.StreamReader(limit=STREAM_LIMIT)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stdout), os.fdopen(stdout_r, 'rb', 0))
+        stderr = asyncio.StreamReader(limit=STREAM_LIMIT)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stderr), os.fdopen(stderr_r, 'rb', 0))
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, os.fdopen(stdin_w, 'wb', 0))
+        stdin = asyncio.StreamWriter(transport, protocol, None, loop)
+        return ForkedProcess(pid, stdin, stdout, stderr, self.exits[pid])
+
+_forkserver = None
+
+def get_forkserver():
+    global _forkserver
+    if _forkserver is None:
+        _forkserver = ForkServer()
+    return _forkserver
+
+def forkserver_enabled():
+    return (os.environ.get("MCP_FORKSERVER", "").lower() in ("1", "true", "yes")
+            and hasattr(os, "fork") and hasattr(socket, "send_fds"))
+
+def resolve_forkserver_spec(target, cmd, entry):
+    """Return (kind, name, argv) if cmd can be forked from the template, else None.
+
+    Only `python -m module ...` and `python script.py ...` run by this
+    interpreter qualify ("python"/"python3" on PATH count as this interpreter,
+    as for the proxy); anything else keeps using a plain subprocess.
+    """
+    if not forkserver_enabled():
+        return None
+    if (entry or {}).get("forkserver") is False:
+        return None
+    command, args = cmd[0], cmd[1:]
+    if os.path.basename(command) not in ("python", "python3", f"python{sys.version_info[0]}.{sys.version_info[1]}"):
+        resolved = shutil.which(command)
+        if resolved is None or os.path.realpath(resolved) != os.path.realpath(sys.executable):
+            return None
+    if len(args) >= 2 and args[0] == "-m":
+        return ("module", args[1], [args[1], *args[2:]])
+    if args and args[0].endswith(".py"):
+        return ("path", args[0], list(args))
+    return None
+
+class ListCache:
+    """Results of a child's idempotent list requests.
+
+    Keys are (config hash, method, params), so an edited config entry never
+    sees results of the previous definition. The owner clears the cache and
+    sets version to the entry's config_hash() when the child restarts;
+    list_changed notifications drop one method.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.entries = {}  # (config hash, method, params json) -> result
+        self.pending = {}  # request id -> key awaiting the child's answer
+        self.hits = collections.Counter()    # method -> count
+        self.misses = collections.Counter()  # method -> count
+
+    def key(self, method, params):
+        return (self.version, method, json.dumps(params or {}, sort_keys=True))
+
+    def lookup(self, key):
+        result = self.entries.get(key)
+        if result is None:
+            self.misses[key[1]] += 1
+        else:
+            self.hits[key[1]] += 1
+        return result
+
+    def invalidate(self, method):
+        for key in [k for k in self.entries if k[1] == method]:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+        self.pending.clear()
+
+def server_entry(target):
+    """Return target's mcpServers entry, or None if target is not in the config.
+
+    Read once when a child starts; the helpers below take the result, so
+    nothing on the request path touches the config file.
+    """
+    cfg = load_config()
+    servers = (cfg.get("mcpServers") or {}) if isinstance(cfg, dict) else {}
+    if target not in servers:
+        return None
+    return servers[target] or {}
+
+def list_cache_enabled(entry):
+    """Opt in per server with `"cache": true`, or for all servers with MCP_LIST_CACHE=1.
+
+    Servers with an idle_timeout cache by default: the lists are what a
+    hibernating server answers with.
+    """
+    entry = entry or {}
+    if "cache" in entry:
+        return bool(entry["cache"])
+    if entry.get("idle_timeout"):
+        return True
+    return os.environ.get("MCP_LIST_CACHE", "").lower() in ("1", "true", "yes")
+
+def request_deadlines(entry):
+    """Return (default seconds, {tool: seconds}, max stalls) for requests to entry's server; 0 means no deadline.
+
+        "request_timeout": 60, "tool_timeouts": {"search": 120}, "max_stalls": 3
+    """
+    entry = entry or {}
+    default = entry.get("request_timeout", os.environ.get("MCP_REQUEST_TIMEOUT"))
+    per_tool = {str(tool): float(limit) for tool, limit in (entry.get("tool_timeouts") or {}).items()}
+    return float(default or 0), per_tool, int(entry.get("max_stalls", DEFAULT_MAX_STALLS))
+
+def admission_limits(entry):
+    """Return (max_inflight, max_queue) for entry's server; max_inflight 0 admits everything.
+
+    Up to max_inflight requests are with the child at once, up to max_queue
+    more wait in the pipe (default: max_inflight) and the rest are rejected.
+    """
+    entry = entry or {}
+    limit = int(entry.get("max_inflight") or 0)
+    return limit, int(entry.get("max_queue", limit) or 0)
+
+def idle_timeout(entry):
+    """Seconds without traffic after which the child hibernates (`"idle_timeout"`; 0 never)."""
+    return float((entry or {}).get("idle_timeout") or 0)
+
+def standby_enabled(entry):
+    """Keep a pre-spawned child ready to replace a crashed one (`"standby": true`)."""
+    return bool((entry or {}).get("standby"))
+
+def config_hash(target, entry):
+    """Short hash of the target's config entry (or script path for CLI targets)."""
+    if entry is None:
+        entry = {"script": target}
+    return hashlib.sha1(json.dumps(entry, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+class Supervisor:
+    """Terminates and reaps children in the background.
+
+    stop() hands its child over here and returns at once, so a restart or
+    config change never waits on a child that ignores SIGTERM; it is killed
+    after TERMINATE_TIMEOUT (or at once if the retiring task is cancelled).
+    """
+
+    def __init__(self):
+        self.exiting = {}  # task -> (target, process)
+        self.killed = 0
+
+    def retire(self, target, process):
+        task = asyncio.create_task(self._retire(target, process))
+        self.exiting[task] = (target, process)
+        task.add_done_callback(self.exiting.pop)
+        return task
+
+    async def _retire(self, target, process):
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), timeout=TERMINATE_TIMEOUT)
+        except ProcessLookupError:
+            return
+        except asyncio.TimeoutError:
+            logger.warning(f"[{target}] Server process ignored SIGTERM for {TERMINATE_TIMEOUT}s, killing it")
+            self.kill(process)
+            await process.wait()
+        except asyncio.CancelledError:
+            self.kill(process)
+            raise
+        logger.info(f"[{target}] Server process terminated")
+
+    def kill(self, process):
+        self.killed += 1
+        with contextlib.suppress(ProcessLookupError):
+            process.kill()
+
+    async def wait(self):
+        """Wait for every child handed over so far to exit."""
+        await asyncio.gather(*list(self.exiting), return_exceptions=True)
+
+supervisor = Supervisor()
+
+class ServerProcess:
+    """Child server process for one target, kept alive across WebSocket reconnects.
 
-            # Attempt to connect
-            await connect_to_server(uri, target)
+    stdout is pumped for the lifetime of the child and forwarded to whichever
+    WebSocket is currently attached. The child's first `initialize` result is
+    cached, so when a reconnecting endpoint repeats the MCP handshake it is
+    answered locally and the child keeps its session (and in-memory state).
 
+    Messages from the endpoint pass intercept() (answered locally), admit()
+    (admission control) and write() (the child's stdin queue); lines from
+    the child pass deliver(). A child that exits is replaced by respawn(),
+    and _reset_session() forgets what the previous child said.
+    """
+
+    registered = True  # listed in `registry` (and so on /metrics) under its target
+    can_hibernate = True
+    removed = False    # set by ServerFleet.remove before it closes the connection
+
+    def __init__(self, target):
+        self.target = target
+        self.process = None
+        self.websocket = None
+        self.attached_at = None  # set until the first response on a new connection
+        self._tasks = []
+        self.outbound = collections.deque()  # data lane: (message, queued_at)
+        self.control = collections.deque()   # control lane, written first
+        self.outbound_bytes = 0
+        self.outbound_ready = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.write_error = None
+        self.paused_at = None
+        self.queue_stats = {"peak_bytes": 0, "pauses": 0, "paused_seconds": 0.0,
+                            "local_pings": 0, "cancelled_in_queue": 0}
+        self.queue_wait = {"control": Histogram(), "data": Histogram()}
+        self.metrics = ServerMetrics(target)
+        self.list_cache = ListCache()
+        self.cache_enabled = False
+        self.batch_items = {}  # internal id -> (BatchReply, position, original id)
+        self._batch_ids = itertools.count(1)
+        self.standby = None          # pre-spawned replacement child
+        self.standby_stderr = None
+        self.standby_task = None
+        self.respawning = None       # task bringing a crashed child back
+        self.started_at = None
+        self.crashes = 0             # consecutive exits within STABLE_SESSION of starting
+        self.restarts = 0
+        self.idle_task = None
+        self.last_activity = time.monotonic()
+        self.hibernated = None       # {"lists": cached list results} while the child is stopped for idleness
+        self.hibernations = 0
+        self.wakes = 0
+        self.forwarded = {}          # request id -> (perf_counter when it went to the child, method, tool)
+        self.timed_out = {}          # ids answered with a timeout error (ordered set) -> None
+        self.timeouts = collections.Counter()  # (method, tool) -> count
+        self.stalls = 0              # timeouts since the child last produced output
+        self.last_output = 0.0       # perf_counter of the child's last line of output
+        self.stall_restarts = 0
+        self.admission = (0, 0)      # (max_inflight, max_queue) of the current connection
+        self.held = {}               # request id -> message waiting for an in-flight slot
+        self.held_ready = asyncio.Event()
+        self.rejected = 0
+        if self.registered:
+            registry[target] = self
+        self._reset_session()
+
+    def _reset_handshake(self):
+        self.init_protocol = None  # protocolVersion the child was initialized with
+        self.init_result = None
+        self.init_request = None   # the endpoint's initialize, replayed to a respawned child
+        self.pending_init_request = None
+        self.handshake_id = None   # id of that replay, whose reply is swallowed
+        self.pending_init_id = None
+        self.pending_init_protocol = None
+        self.swallow_initialized = False
+
+    def _reset_outbound(self):
+        self.outbound.clear()
+        self.control.clear()
+        self.outbound_bytes = 0
+        self.write_error = None
+        self.paused_at = None
+        self.writable.set()
+
+    def _reset_session(self):
+        """Forget everything learned from the previous child."""
+        self._reset_handshake()
+        self._reset_outbound()
+        self.entry = server_entry(self.target)  # config as of this child's start
+        self.list_cache.clear()
+        self.list_cache.version = config_hash(self.target, self.entry)
+        self.cache_enabled = list_cache_enabled(self.entry)
+        self.batch_items.clear()
+        self.forwarded = {}
+        self.held_ready.set()  # a new child has every admission slot free
+        self.timed_out.clear()
+        self.stalls = 0
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def spawn(self):
+        """Launch a child for this target (built from CLI arg or config). Returns (process, description)."""
+        entry = server_entry(self.target)
+        inprocess = resolve_inprocess_spec(self.target, entry)
+        if inprocess is not None:
+            return await InProcessServer.launch(self.target, inprocess), f"in-process {inprocess[1]}"
+        remote = resolve_remote_spec(self.target, entry)
+        if remote is not None:
+            return RemoteServer(self.target, *remote), f"native {remote[0]} client for {remote[1]}"
+        cmd, env = build_server_command(self.target)
+        forked = resolve_forkserver_spec(self.target, cmd, entry)
+        if forked is not None:
+            kind, name, argv = forked
+            process = await get_forkserver().spawn(kind, name, argv, env)
+            return process, f"{' '.join(cmd)} (forked, pid {process.pid})"
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            limit=STREAM_LIMIT
+        )
+        return process, ' '.join(cmd)
+
+    async def start(self):
+        """Start the child (promoting the warm standby if there is one) and its output pumps."""
+        standby, standby_stderr = self.standby, self.standby_stderr
+        self.standby = self.standby_stderr = None
+        await self.stop()
+        if standby is not None and standby.returncode is None:
+            self.process, description = standby, "warm standby"
+        else:
+            if standby_stderr is not None:
+                standby_stderr.cancel()
+                standby_stderr = None
+            self.process, description = await self.spawn()
+        self._reset_session()
+        self.started_at = time.monotonic()
+        self._tasks = [
+            asyncio.create_task(pipe_queue_to_process(self)),
+            asyncio.create_task(pipe_process_to_websocket(self)),
+        ]
+        if standby_stderr is not None:
+            self._tasks.append(standby_stderr)
+        elif self.process.stderr is not None:
+            self._tasks.append(asyncio.create_task(pipe_process_stderr_to_log(self.process, self.target)))
+        logger.info(f"[{self.target}] Started server process: {description}")
+        if standby_enabled(self.entry):
+            self.standby_task = asyncio.create_task(self.prepare_standby())
+        self.last_activity = time.monotonic()
+        timeout = idle_timeout(self.entry) if self.can_hibernate else 0
+        if timeout > 0:
+            self.idle_task = asyncio.create_task(self.watch_idle(timeout))
+
+    async def watch_idle(self, timeout):
+        """Hibernate the child once nothing has gone to or come from it for `timeout` seconds."""
+        while True:
+            remaining = self.last_activity + timeout - time.monotonic()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+                continue
+            if (self.metrics.in_flight or self.forwarded or self.outbound or self.control or self.respawning is not None
+                    or self.init_request is None):
+                self.last_activity = time.monotonic()  # busy, or never initialized: nothing to answer with
+                continue
+            await self.hibernate(timeout)
+            return
+
+    async def hibernate(self, timeout):
+        """Stop the idle child, keeping the handshake and list results to answer with.
+
+        The server stays connected: initialize, cached lists and pings are
+        answered from what the child said before, notifications are dropped,
+        and the first other request wakes it (see write()).
+        """
+        self.hibernated = {"lists": dict(self.list_cache.entries)}
+        self.hibernations += 1
+        logger.info(f"[{self.target}] No traffic for {timeout:g}s, hibernating the server process")
+        await self.stop()
+
+    async def wake(self):
+        """Respawn a hibernated child and initialize it with the endpoint's original request."""
+        try:
+            lists = self.hibernated["lists"]
+            self.hibernated = None
+            # The waking request (and any admitted during the spawn) is for the new child
+            admitted = self.forwarded
+            started = time.perf_counter()
+            await self.respawn()
+            self.forwarded = admitted
+            self.list_cache.entries.update(lists)
+            self.wakes += 1
+            logger.info(f"[{self.target}] Woke from hibernation in {(time.perf_counter() - started) * 1000:.0f} ms")
+        except Exception as e:
+            logger.error(f"[{self.target}] Failed to wake server process: {e}")
+        finally:
+            self.respawning = None
+
+    async def prepare_standby(self):
+        """Spawn the child that will replace this one if it crashes."""
+        try:
+            process, description = await self.spawn()
+        except Exception as e:
+            logger.warning(f"[{self.target}] Could not start warm standby: {e}")
+            return
+        if self.process is None:
+            supervisor.retire(self.target, process)  # stopped while the standby was starting
+            return
+        self.standby = process
+        if process.stderr is not None:
+            self.standby_stderr = asyncio.create_task(pipe_process_stderr_to_log(process, self.target))
+        logger.info(f"[{self.target}] Warm standby ready: {description}")
+
+    def child_exited(self, process):
+        """Called when a child's stdout closes; respawn it unless it was stopped on purpose.
+
+        The WebSocket stays up: requests the child had in flight get a JSON-RPC
+        error, the new child (the warm standby, with `"standby": true`) is sent
+        the endpoint's original initialize, and writes wait until it is up.
+        Respawns are immediate at first, then back off while it keeps crashing.
+        """
+        if process is self.process and self.respawning is None:
+            self.respawning = asyncio.create_task(self._recover(process))
+
+    async def _recover(self, process):
+        try:
+            returncode = await process.wait()
+            # Give stderr a moment to show the traceback
+            if self._tasks[2:]:
+                await asyncio.wait(self._tasks[2:], timeout=1)
+            if process is not self.process:
+                return
+            lived = time.monotonic() - self.started_at
+            self.crashes = self.crashes + 1 if lived < STABLE_SESSION else 1
+            delay = 0 if self.crashes == 1 else min(INITIAL_BACKOFF * 2 ** (self.crashes - 2), MAX_BACKOFF)
+            logger.error(f"[{self.target}] Server process exited with code {returncode} after {lived:.1f}s, "
+                         f"restarting{f' in {delay:.0f}s' if delay else ''}")
+            await self.fail_in_flight(f"Server process exited with code {returncode}")
+            if delay:
+                await asyncio.sleep(delay)
+            started = time.perf_counter()
+            await self.respawn()
+            self.restarts += 1
+            logger.info(f"[{self.target}] Respawned in {(time.perf_counter() - started) * 1000:.0f} ms")
         except Exception as e:
-            reconnect_attempt += 1
-            logger.warning(f"[{target}] Connection closed (attempt {reconnect_attempt}): {e}")
-            # Calculate wait time for next reconnection (exponential backoff)
-            backoff = min(backoff * 2, MAX_BACKOFF)
+            logger.error(f"[{self.target}] Failed to respawn server process: {e}")
+        finally:
+            self.respawning = None
+
+    async def fail_in_flight(self, reason):
+        await self.fail_requests(list(self.metrics.in_flight), reason)
+
+    async def fail_requests(self, request_ids, reason, code=-32603, data=None):
+        """Answer requests the child will never answer with a JSON-RPC error."""
+        for request_id in request_ids:
+            error = jsonrpc_error(request_id, code, reason)
+            if data is not None:
+                error["error"]["data"] = data
+            if self.held.pop(request_id, None) is not None or self.forwarded.pop(request_id, None) is not None:
+                self.held_ready.set()
+            entry = self.batch_items.pop(request_id, None)
+            if entry is not None:
+                batch, position, original_id = entry
+                self.metrics.response_sent(request_id, True, 0)
+                await batch.add(position, dict(error, id=original_id))
+            else:
+                await self.send(error)
+
+    async def respawn(self):
+        """Replace the crashed child, keeping the endpoint's session (cached initialize) intact."""
+        handshake = (self.init_request, self.init_protocol, self.init_result)
+        await self.start()
+        self.init_request, self.init_protocol, self.init_result = handshake
+        if self.init_request is not None:
+            self.replay_initialize(self.init_request)
+
+    def replay_initialize(self, request):
+        """Send the endpoint's initialize (and initialized) to a fresh child; the reply is swallowed."""
+        self.handshake_id = f"{INIT_ID_PREFIX}{next(self._batch_ids)}"
+        self.enqueue(json.dumps(dict(json.loads(request), id=self.handshake_id)).encode('utf-8'))
+        self.enqueue(json.dumps({"jsonrpc": "2.0", "method": "notifications/initialized"}).encode('utf-8'))
+
+    async def stop(self, wait=False):
+        """Hand the child (if running) to the supervisor and cancel its pumps.
+
+        With `wait` (shutting down) also wait until the child has exited.
+        """
+        current = asyncio.current_task()
+        for task in (self.respawning, self.standby_task, self.idle_task):
+            if task is not None and task is not current:
+                task.cancel()
+        self.idle_task = None
+        if self.standby is not None:
+            supervisor.retire(self.target, self.standby)
+            self.standby = None
+        if self.standby_stderr is not None:
+            self.standby_stderr.cancel()
+            self.standby_stderr = None
+        process, self.process = self.process, None
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if process is not None and process.returncode is None:
+            logger.info(f"[{self.target}] Terminating server process")
+            exiting = supervisor.retire(self.target, process)
+            if wait:
+                await exiting
+
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        """Wait up to timeout for requests already sent to the child to be answered."""
+        deadline = time.monotonic() + timeout
+        while self.metrics.in_flight and self.running and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.metrics.in_flight and self.running:
+            logger.warning(f"[{self.target}] Stopping with {len(self.metrics.in_flight)} request(s) in flight")
+
+    async def ensure_running(self):
+        if self.respawning is not None:
+            await asyncio.wait({self.respawning})
+        if self.hibernated is not None:
+            logger.info(f"[{self.target}] Server process is hibernating; it starts on the first request")
+        # Reuse the warm child from a previous connection if it is still alive
+        elif not self.running:
+            await self.start()
+        else:
+            logger.info(f"[{self.target}] Re-attaching running server process (pid {self.process.pid})")
+
+    async def serve(self, websocket):
+        """Pipe one WebSocket connection to the (warm) child until it closes."""
+        await self.ensure_running()
+        self.attach(websocket)
+        default, per_tool, max_stalls = request_deadlines(self.entry)
+        self.admission = admission_limits(self.entry)
+        helpers = []
+        if default > 0 or any(limit > 0 for limit in per_tool.values()):
+            helpers.append(asyncio.create_task(self.watch_deadlines(default, per_tool, max_stalls)))
+        if self.admission[0]:
+            helpers.append(asyncio.create_task(self.release_held()))
+        try:
+            await pipe_websocket_to_process(websocket, self)
+        finally:
+            for task in helpers:
+                task.cancel()
+            self.detach(websocket)
+
+    async def admit(self, message, peeked):
+        """Apply max_inflight / max_queue to one message from the endpoint (already in metrics.in_flight).
+
+        `peeked` is the message's peek_jsonrpc(). Returns True if it may go
+        to the child now (a request is then noted in `forwarded`); False if
+        it was held for a free slot, rejected with a retryable error, or
+        cancelled while held.
+        """
+        if peeked is None or peeked[1] is None:
+            return True
+        request_id, method, tool = peeked[:3]
+        limit, queue = self.admission
+        if method == "notifications/cancelled":
+            if self.held or self.forwarded:
+                try:
+                    cancelled = jsonrpc_id(request_params(json.loads(message)).get("requestId"))
+                except (ValueError, AttributeError):
+                    return True  # malformed: cancels nothing, the child ignores it
+                if self.held.pop(cancelled, None) is not None:
+                    self.metrics.in_flight.pop(cancelled, None)
+                    return False
+                if self.forwarded.pop(cancelled, None) is not None:
+                    self.held_ready.set()  # the child may never answer it: its slot is free
+            return True
+        if request_id is None:
+            return True
+        if limit and method not in CONTROL_METHODS and (self.held or len(self.forwarded) >= limit):
+            if len(self.held) < queue:
+                self.held[request_id] = message
+                return False
+            self.rejected += 1
+            retry_ms = self.retry_after_ms(limit)
+            await self.fail_requests([request_id], f"Server busy ({limit} requests in flight, {queue} queued), "
+                                                   f"retry after {retry_ms} ms",
+                                     SERVER_BUSY_CODE, {"retryable": True, "retryAfterMs": retry_ms})
+            return False
+        self.forwarded[request_id] = (time.perf_counter(), method, tool)
+        self.timed_out.pop(request_id, None)  # a new request reusing the id of one that timed out
+        return True
+
+    def retry_after_ms(self, limit):
+        """Rough wait until a slot frees up: mean latency times the queue ahead, per slot."""
+        total = self.metrics.total_latency()
+        mean = total.sum / total.count if total.count else 0.1
+        return max(int(mean * (len(self.held) + 1) / limit * 1000), 1)
+
+    async def release_held(self):
+        """Forward held requests, oldest first, as in-flight slots free up."""
+        limit = self.admission[0]
+        while True:
+            await self.held_ready.wait()
+            self.held_ready.clear()
+            while self.held and len(self.forwarded) < limit:
+                request_id = next(iter(self.held))
+                started, method, tool = self.metrics.in_flight.get(request_id, (None, None, None))
+                self.forwarded[request_id] = (time.perf_counter(), method, tool)
+                await self.write(self.held.pop(request_id))
+
+    async def watch_deadlines(self, default, per_tool, max_stalls):
+        """Time out requests the child has had for longer than their deadline.
+
+        The clock starts when a request is forwarded to the child, so time
+        spent held by admission control does not count.
+        """
+        limits = [limit for limit in (default, *per_tool.values()) if limit > 0]
+        if not limits:
+            return
+        interval = min(max(min(limits) / 4, 0.05), 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.perf_counter()
+            expired = []
+            for request_id, (started, method, tool) in self.forwarded.items():
+                limit = per_tool.get(tool, default) if tool else default
+                if limit > 0 and now - started > limit:
+                    expired.append((request_id, method, tool, limit))
+            for request_id, method, tool, limit in expired:
+                if request_id in self.forwarded:
+                    await self.time_out(request_id, method, tool, limit, max_stalls)
+
+    async def time_out(self, request_id, method, tool, limit, max_stalls):
+        """Fail one overdue request upstream, cancel it in the child and count the stall.
+
+        A request abandoned by an earlier connection is only cancelled. The
+        child's late reply is dropped. A timeout counts as a stall only if the
+        child has written nothing since the request was forwarded; after
+        max_stalls stalls in a row the child is killed, which respawns it.
+        """
+        forwarded_at = self.forwarded[request_id][0]
+        logger.warning(f"[{self.target}] {method}{f' {tool}' if tool else ''} (id {request_id}) "
+                       f"timed out after {limit:g}s")
+        self.timeouts[(method, tool)] += 1
+        owner = self.request_owner(request_id)
+        if request_id in self.metrics.in_flight:
+            await self.fail_requests([request_id], f"Request timed out after {limit:g}s", REQUEST_TIMEOUT_CODE)
+        else:
+            self.forwarded.pop(request_id, None)
+        self.held_ready.set()
+        self.timed_out[request_id] = None
+        if len(self.timed_out) > TIMED_OUT_MEMORY:
+            del self.timed_out[next(iter(self.timed_out))]
+        cancel = {"jsonrpc": "2.0", "method": "notifications/cancelled",
+                  "params": {"requestId": request_id, "reason": f"Timed out after {limit:g}s"}}
+        with contextlib.suppress(Exception):
+            await self.write(json.dumps(cancel).encode('utf-8'))
+        if owner is None or owner.last_output > forwarded_at:
+            return  # the child is answering other requests, only this one is lost
+        owner.stalls += 1
+        if max_stalls and owner.stalls >= max_stalls and owner.running and owner.respawning is None:
+            logger.error(f"[{self.target}] {owner.stalls} requests timed out with no output from the server "
+                         f"process, restarting it")
+            owner.stalls = 0
+            self.stall_restarts += 1
+            with contextlib.suppress(ProcessLookupError):
+                owner.process.kill()  # stdout EOF takes the crash path: respawn with the same session
+
+    def request_owner(self, request_id):
+        """The ServerProcess whose child is handling request_id."""
+        return self
+
+    def awaits_reply(self, request_id):
+        """True while request_id is owed a reply (not failed when a child exited)."""
+        return request_id in self.metrics.in_flight
+
+    def attach(self, websocket):
+        self.websocket = websocket
+        self.attached_at = time.perf_counter()
+        self.metrics.abandon_in_flight()
+        # Any handshake in flight belonged to the previous connection
+        self.pending_init_id = None
+        self.swallow_initialized = False
+        self.list_cache.pending.clear()
+        self.batch_items.clear()
+        self.held.clear()
+
+    def detach(self, websocket):
+        if self.websocket is websocket:
+            self.websocket = None
+            self.attached_at = None
+
+    async def write(self, message):
+        """Queue one message for the child, waiting first while its queue is saturated.
+
+        Above STDIN_HIGH_WATER queued bytes `writable` is cleared, which pauses
+        reading this server's WebSocket until the child has caught up to
+        STDIN_LOW_WATER. Control messages (CONTROL_METHODS and responses) have
+        their own lane that is written first and never held back (except by a
+        respawn in progress). A request for a hibernating child wakes it;
+        other messages are dropped. A child that has exited (or stopped
+        reading its stdin) before its output was drained is respawned now, so
+        the connection stays up; a request the crash path has already failed
+        is not sent to the new child.
+        """
+        if self.hibernated is not None and self.respawning is None:
+            peeked = peek_jsonrpc(message)
+            if peeked is None or peeked[0] is None or peeked[1] is None:
+                return  # notifications and replies are meaningless to the child that is not running
+            self.respawning = asyncio.create_task(self.wake())
+        elif self.respawning is None and self.process is not None \
+                and (not self.running or self.write_error is not None):
+            if self.running:
+                with contextlib.suppress(ProcessLookupError):
+                    self.process.kill()  # its stdin is gone: nothing more can be sent to it
+            self.child_exited(self.process)
+        if self.respawning is not None and self.respawning is not asyncio.current_task():
+            await asyncio.wait({self.respawning})
+            peeked = peek_jsonrpc(message)
+            if peeked is not None and peeked[0] is not None and peeked[1] is not None \
+                    and not self.awaits_reply(peeked[0]):
+                return  # answered with an error when the child exited
+        lane = message_lane(message)
+        if lane == "data":
+            await self.writable.wait()
+        self.enqueue(message, lane)
+
+    def enqueue(self, message, lane=None):
+        """Queue one message for the child's stdin without blocking."""
+        if self.write_error is not None:
+            raise self.write_error
+        if not self.running:
+            raise ConnectionResetError(f"server process for {self.target} is not running")
+        lane = lane or message_lane(message)
+        self.last_activity = time.monotonic()
+        if lane == "control" and self.outbound and b'notifications/cancelled' in message and self.cancel_queued(message):
+            return
+        (self.control if lane == "control" else self.outbound).append((message, time.perf_counter()))
+        self.outbound_bytes += len(message) + 1
+        self.queue_stats["peak_bytes"] = max(self.queue_stats["peak_bytes"], self.outbound_bytes)
+        self.outbound_ready.set()
+        if self.outbound_bytes >= STDIN_HIGH_WATER and self.writable.is_set():
+            self.writable.clear()
+            self.paused_at = time.perf_counter()
+            self.queue_stats["pauses"] += 1
+            logger.warning(f"[{self.target}] Child stdin saturated "
+                           f"({len(self.outbound) + len(self.control)} messages, {self.outbound_bytes} bytes queued), "
+                           f"pausing reads")
+
+    def cancel_queued(self, message):
+        """Drop a cancelled request that is still queued. True if found (the child never sees either)."""
+        try:
+            request_id = jsonrpc_id(request_params(json.loads(message)).get("requestId"))
+        except (ValueError, AttributeError):
+            return False
+        if request_id is None:
+            return False
+        for entry in self.outbound:
+            peeked = peek_jsonrpc(entry[0])
+            if peeked is not None and peeked[1] is not None and peeked[0] == request_id:
+                self.outbound.remove(entry)
+                self.outbound_bytes -= len(entry[0]) + 1
+                self.metrics.in_flight.pop(request_id, None)
+                self.queue_stats["cancelled_in_queue"] += 1
+                logger.debug(f"[{self.target}] Request {request_id} cancelled before reaching the child")
+                if not self.writable.is_set() and self.outbound_bytes <= STDIN_LOW_WATER:
+                    self.resume_writing()
+                return True
+        return False
+
+    def resume_writing(self):
+        if self.paused_at is not None:
+            paused = time.perf_counter() - self.paused_at
+            self.queue_stats["paused_seconds"] += paused
+            self.paused_at = None
+            logger.info(f"[{self.target}] Child stdin drained after {paused:.2f}s, resuming reads")
+        self.writable.set()
+
+    def outbound_metrics(self):
+        """Current and peak depth of the child's stdin queue."""
+        return {
+            "queued_messages": len(self.outbound) + len(self.control),
+            "queued_bytes": self.outbound_bytes,
+            **self.queue_stats,
+        }
+
+    async def intercept(self, message):
+        """Handle MCP handshake messages from the endpoint.
+
+        Returns True if the message was answered locally and must not reach the child.
+        A ping is answered here while the child has other work queued or in flight
+        (or is hibernating).
+        """
+        if b'"ping"' in message and (self.outbound or len(self.metrics.in_flight) > 1 or self.hibernated is not None):
+            try:
+                request = json.loads(message)
+            except ValueError:
+                request = None
+            if isinstance(request, dict) and request.get("method") == "ping" and "id" in request:
+                self.queue_stats["local_pings"] += 1
+                await self.send({"jsonrpc": "2.0", "id": request["id"], "result": {}})
+                return True
+        if self.swallow_initialized and b'notifications/initialized' in message:
+            self.swallow_initialized = False
+            return True
+        if self.cache_enabled and b'/list"' in message:
+            return await self.intercept_list(message)
+        if b'"initialize"' not in message:
+            return False
+        try:
+            request = json.loads(message)
+        except ValueError:
+            return False
+        if not isinstance(request, dict) or request.get("method") != "initialize":
+            return False
+        protocol = request_params(request).get("protocolVersion")
+        if self.init_result is not None and protocol == self.init_protocol:
+            logger.info(f"[{self.target}] Replaying cached initialize result to new connection")
+            self.swallow_initialized = True
+            await self.send({"jsonrpc": "2.0", "id": request.get("id"), "result": self.init_result})
+            return True
+        # First handshake (or a different protocol version): let the child answer it
+        self.pending_init_id = jsonrpc_id(request.get("id"))
+        self.pending_init_protocol = protocol
+        self.pending_init_request = message
+        return False
+
+    async def write_batch(self, message):
+        """Forward a JSON-RPC batch to the child one message at a time.
+
+        Elements get internal ids so their replies can be told apart from
+        anything else the child sends; deliver() collects them and one
+        array is sent back in request order.
+        """
+        try:
+            items = json.loads(message)
+        except ValueError:
+            await self.send(jsonrpc_error(None, -32700, "Parse error"))
+            return
+        if not isinstance(items, list) or not items:
+            await self.send(jsonrpc_error(None, -32600, "Invalid Request"))
+            return
+        websocket = self.websocket
+
+        async def send(responses):
+            if self.websocket is not websocket:
+                return  # the connection the batch came from is gone
+            try:
+                await websocket.send(json.dumps(responses))
+            except websockets.exceptions.ConnectionClosed:
+                logger.debug(f"[{self.target}] Dropping batch reply for closed connection")
+
+        batch = BatchReply(send)
+        lines = []
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(item.get("method", ""), str):
+                await batch.add(batch.expect(), jsonrpc_error(None, -32600, "Invalid Request"))
+                continue
+            if "id" in item and "method" in item:
+                internal_id = f"{BATCH_ID_PREFIX}{next(self._batch_ids)}"
+                self.batch_items[internal_id] = (batch, batch.expect(), item["id"])
+                item = dict(item, id=internal_id)
+            lines.append(json.dumps(item).encode('utf-8'))
+        await batch.seal()
+        # Queue every element before waiting on any reply so the child can work on them concurrently
+        for line in lines:
+            peeked = self.metrics.observe_inbound(line)
+            if await self.admit(line, peeked):
+                await self.write(line)
+
+    async def collect_batch_item(self, data):
+        """Return True if data answers a batch element (it is then held for the batch reply)."""
+        peeked = peek_jsonrpc(data)
+        if peeked is None or peeked[1] is not None or not isinstance(peeked[0], str):
+            return False
+        entry = self.batch_items.pop(peeked[0], None)
+        if entry is None:
+            return False
+        batch, position, original_id = entry
+        await batch.add(position, dict(json.loads(data), id=original_id))
+        return True
+
+    async def intercept_list(self, message):
+        """Answer a cacheable list request from the cache, or note it so the reply is cached.
+
+        Cached results last until the child restarts, its config entry
+        changes or it sends a list_changed notification.
+        """
+        try:
+            request = json.loads(message)
+        except ValueError:
+            return False
+        if (not isinstance(request, dict) or request.get("method") not in CACHEABLE_METHODS
+                or jsonrpc_id(request.get("id")) is None):
+            return False
+        key = self.list_cache.key(request["method"], request.get("params"))
+        result = self.list_cache.lookup(key)
+        if result is not None:
+            await self.send({"jsonrpc": "2.0", "id": request["id"], "result": result})
+            return True
+        self.list_cache.pending[request["id"]] = key
+        return False
+
+    def observe_response(self, data):
+        """Capture the child's answer to a forwarded initialize or cacheable list request."""
+        try:
+            response = json.loads(data)
+        except ValueError:
+            return
+        if not isinstance(response, dict):
+            return
+        if LIST_CHANGED.get(response.get("method")):
+            self.list_cache.invalidate(LIST_CHANGED[response["method"]])
+            return
+        response_id = jsonrpc_id(response.get("id"))
+        if "result" not in response:
+            self.list_cache.pending.pop(response_id, None)
+            return
+        if response_id is not None and response_id == self.pending_init_id:
+            self.init_result = response["result"]
+            self.init_protocol = self.pending_init_protocol
+            self.init_request = self.pending_init_request
+            self.pending_init_id = None
+        key = self.list_cache.pending.pop(response_id, None)
+        if key is not None:
+            self.list_cache.entries[key] = response["result"]
+
+    async def deliver(self, data):
+        """Forward one line of child output to the attached WebSocket."""
+        target = self.target
+        self.last_activity = time.monotonic()
+        self.stalls = 0
+        self.last_output = time.perf_counter()
+        peeked = peek_jsonrpc(data) if self.forwarded or self.timed_out else None
+        if peeked is not None and peeked[1] is None:
+            if self.forwarded.pop(peeked[0], None) is not None and peeked[0] not in self.metrics.in_flight:
+                log_frame(target, "dropped (abandoned by an earlier connection) >>", data)
+                if self.held:
+                    self.held_ready.set()
+                return
+            if peeked[0] in self.timed_out:
+                del self.timed_out[peeked[0]]
+                log_frame(target, "dropped (timed out) >>", data)
+                return
+        if self.handshake_id is not None and self.handshake_id.encode('utf-8') in data[:PEEK_HEAD_BYTES]:
+            self.handshake_id = None  # a respawned child answering our replayed initialize
+            return
+        if (self.pending_init_id is not None or self.list_cache.pending
+                or (self.list_cache.entries and b'list_changed' in data)):
+            self.observe_response(data)
+        self.metrics.observe_outbound(data, peeked)
+        if self.held:
+            self.held_ready.set()  # the reply may have freed an in-flight slot
+        if self.batch_items and await self.collect_batch_item(data):
+            return
+        websocket = self.websocket
+        if websocket is None:
+            # Reply to a request from a connection that is gone
+            log_frame(target, "dropped (disconnected) >>", data)
+            return
+        if self.attached_at is not None:
+            elapsed = (time.perf_counter() - self.attached_at) * 1000
+            logger.info(f"[{target}] First response {elapsed:.1f} ms after connect")
+            self.attached_at = None
+
+        # Send the child's UTF-8 bytes as a text frame as-is (no decode/re-encode)
+        log_frame(target, ">>", data)
+        try:
+            await websocket.send(data, text=True)
+        except websockets.exceptions.ConnectionClosed:
+            logger.debug(f"[{target}] Dropping output for closed connection")
+
+    async def send(self, payload):
+        """Send a locally generated JSON-RPC message to the attached WebSocket."""
+        if self.websocket is None:
+            return
+        text = json.dumps(payload)
+        self.metrics.response_sent(payload.get("id"), "error" in payload, len(text))
+        await self.websocket.send(text)
+
+class Replica(ServerProcess):
+    """One child of a ReplicaPool: output goes to the pool, which owns the WebSocket."""
+
+    registered = False
+    can_hibernate = False
+
+    def __init__(self, target, pool, index):
+        super().__init__(target)
+        self.pool = pool
+        self.index = index
+        self.outstanding = set()  # ids of requests routed here and not answered yet
+        self.dispatched = 0
+        self.steals = 0           # requests taken over from the replica round-robin would have picked
+
+    async def deliver(self, data):
+        self.stalls = 0
+        self.last_output = time.perf_counter()
+        await self.pool.on_replica_message(self, data)
+
+    async def fail_in_flight(self, reason):
+        failed = list(self.outstanding)
+        for request_id in failed:
+            self.pool.routes.pop(request_id, None)
+        self.outstanding.clear()
+        await self.pool.fail_requests(failed, reason)
+
+    async def respawn(self):
+        await self.pool.start_replica(self, initialize=True)
+
+    def awaits_reply(self, request_id):
+        return request_id in self.outstanding
+
+class ReplicaPool(ServerProcess):
+    """`"replicas": N` children for one target behind a single WebSocket.
+
+    initialize and notifications go to every replica (the first initialize
+    result is forwarded, the rest swallowed); each request goes to the
+    running replica with the fewest outstanding requests, tracked by
+    JSON-RPC id. A replica that is restarted while the pool keeps serving
+    is initialized with the original request before it gets traffic.
+    """
+
+    def __init__(self, target, count):
+        super().__init__(target)
+        self.replicas = [Replica(target, self, n) for n in range(count)]
+        self.routes = {}          # request id -> Replica handling it
+        self.broadcasts = {}      # initialize id -> [replicas yet to answer, forwarded]
+        self.child_requests = {}  # REPLICA_ID_PREFIX id -> (Replica, its own id)
+        self.init_request = None
+        self._rotation = itertools.count()
+        self._child_request_ids = itertools.count(1)
+
+    @property
+    def running(self):
+        return any(replica.running for replica in self.replicas)
+
+    async def start(self):
+        """Start every replica that is not running; with none running the pool starts afresh."""
+        fresh = not self.running
+        if fresh:
+            self._reset_session()
+            self.routes.clear()
+            self.broadcasts.clear()
+            self.child_requests.clear()
+        for replica in self.replicas:
+            if not replica.running and replica.respawning is None:
+                await self.start_replica(replica, initialize=not fresh)
+        logger.info(f"[{self.target}] {len(self.replicas)} replicas running")
+
+    async def start_replica(self, replica, initialize):
+        await replica.start()
+        for request_id in replica.outstanding:
+            self.routes.pop(request_id, None)
+        replica.outstanding.clear()
+        if initialize and self.init_request is not None:
+            replica.replay_initialize(self.init_request)
+
+    async def stop(self, wait=False):
+        await asyncio.gather(*(replica.stop(wait) for replica in self.replicas))
+
+    async def ensure_running(self):
+        if not all(replica.running for replica in self.replicas):
+            await self.start()
+        else:
+            logger.info(f"[{self.target}] Re-attaching {len(self.replicas)} running replicas")
+
+    def attach(self, websocket):
+        super().attach(websocket)
+        self.broadcasts.clear()
+        self.child_requests.clear()
+
+    def request_owner(self, request_id):
+        return self.routes.get(request_id)
+
+    def pick(self):
+        """Running replica with the fewest outstanding requests (ties rotate).
+
+        With none running, a crashed one: its write waits for the respawn.
+        """
+        candidates = ([replica for replica in self.replicas if replica.running]
+                      or [replica for replica in self.replicas if replica.process is not None])
+        if not candidates:
+            raise ConnectionResetError(f"no replica of {self.target} is running")
+        start = next(self._rotation) % len(candidates)
+        ordered = candidates[start:] + candidates[:start]
+        chosen = min(ordered, key=lambda replica: len(replica.outstanding))
+        if len(chosen.outstanding) < len(ordered[0].outstanding):
+            chosen.steals += 1
+        return chosen
+
+    async def write(self, message):
+        """Route one message from the endpoint to one replica, or to all of them."""
+        peeked = peek_jsonrpc(message)
+        request_id, method = peeked[:2] if peeked is not None else (None, None)
+        if method is None and isinstance(request_id, str) and request_id.startswith(REPLICA_ID_PREFIX):
+            # The endpoint's answer to a request a replica made
+            entry = self.child_requests.pop(request_id, None)
+            if entry is not None:
+                replica, original_id = entry
+                try:
+                    reply = dict(json.loads(message), id=original_id)
+                except (ValueError, TypeError):
+                    logger.warning(f"[{self.target}] Ignoring malformed reply to replica request {original_id}")
+                    return
+                await replica.write(json.dumps(reply).encode('utf-8'))
+            return
+        if method == "notifications/cancelled":
+            try:
+                cancelled_id = jsonrpc_id(request_params(json.loads(message)).get("requestId"))
+            except (ValueError, AttributeError):
+                return  # malformed: cancels nothing
+            owner = self.routes.get(cancelled_id)
+            if owner is not None:
+                dropped = owner.queue_stats["cancelled_in_queue"]
+                await owner.write(message)
+                if owner.queue_stats["cancelled_in_queue"] != dropped:
+                    # Still queued, so it will never be answered
+                    del self.routes[cancelled_id]
+                    owner.outstanding.discard(cancelled_id)
+                    self.metrics.in_flight.pop(cancelled_id, None)
+            return
+        if request_id is None and method is not None and b'"id"' in message and has_id(message):
+            # A request with an unusable id: one replica answers it (with an error), untracked
+            await self.pick().write(message)
+            return
+        if method == "initialize" or request_id is None:
+            replicas = [replica for replica in self.replicas if replica.running]
+            if method == "initialize":
+                self.init_request = message
+                self.broadcasts[request_id] = [set(replicas), False]
+            for replica in replicas:
+                await replica.write(message)
+            return
+        replica = self.pick()
+        self.routes[request_id] = replica
+        replica.outstanding.add(request_id)
+        replica.dispatched += 1
+        await replica.write(message)
+
+    async def on_replica_message(self, replica, data):
+        peeked = peek_jsonrpc(data)
+        if peeked is not None and peeked[0] is not None:
+            request_id, method = peeked[:2]
+            if method is not None:
+                # Replica-initiated request: make its id unique across replicas
+                internal_id = f"{REPLICA_ID_PREFIX}{next(self._child_request_ids)}"
+                self.child_requests[internal_id] = (replica, request_id)
+                data = json.dumps(dict(json.loads(data), id=internal_id)).encode('utf-8') + b'\n'
+            elif request_id == replica.handshake_id:
+                replica.handshake_id = None
+                return
+            elif request_id in self.broadcasts:
+                waiting = self.broadcasts[request_id]
+                waiting[0].discard(replica)
+                if not waiting[0]:
+                    del self.broadcasts[request_id]
+                if waiting[1]:
+                    return
+                waiting[1] = True
+            elif self.routes.get(request_id) is replica:
+                del self.routes[request_id]
+                replica.outstanding.discard(request_id)
+        await self.deliver(data)
+
+class GatewayChild(ServerProcess):
+    """A child hosted behind the gateway: output goes to the gateway, not a socket."""
+
+    can_hibernate = False
+
+    def __init__(self, target, gateway):
+        super().__init__(target)
+        self.gateway = gateway
+        self.ready = False  # gateway's own initialize handshake completed
+        self.lock = asyncio.Lock()
+        self.deadlines = (0.0, {}, DEFAULT_MAX_STALLS)  # request_deadlines() as of the last start
+
+    async def start(self):
+        self.ready = False
+        await super().start()
+        self.deadlines = request_deadlines(self.entry)
+        self.admission = admission_limits(self.entry)
+
+    async def deliver(self, data):
+        self.stalls = 0
+        self.last_output = time.perf_counter()
+        await self.gateway.on_child_message(self, data)
+
+    async def fail_in_flight(self, reason):
+        await self.gateway.fail_child_requests(self, reason)
 
-async def connect_to_server(uri, target):
-    """Connect to WebSocket server and pipe stdio for the given server target."""
+    async def respawn(self):
+        await self.start()
+        await self.gateway.ensure_ready(self)
+
+class Gateway:
+    """Serve every configured server over a single WebSocket connection.
+
+    The gateway initializes each child itself and presents one MCP server to
+    the endpoint: `tools/list` aggregates all children with tools renamed to
+    `<target>__<tool>`, and `tools/call` is routed by that name. JSON-RPC ids
+    are rewritten in both directions so ids from different children (or the
+    endpoint) never collide.
+
+    apply() swaps children in and out while connected and tells the endpoint
+    via `notifications/tools/list_changed`.
+    """
+
+    removed = False
+
+    def __init__(self, entries):
+        self.target = "gateway"
+        self.entries = dict(entries)  # target -> config entry each child was started from
+        self.children = {t: GatewayChild(t, self) for t in self.entries}
+        self.websocket = None
+        self.routes = {}    # namespaced tool name -> (child, original name)
+        self.pending = {}   # gateway id -> (child, upstream id, reply) or Future for internal calls
+        self.reverse = {}   # gateway id -> (child, child id) for child-initiated requests
+        self._ids = itertools.count(1)
+        self.protocol = DEFAULT_PROTOCOL_VERSION
+        self.deadline_tasks = set()
+
+    async def stop(self, wait=False):
+        await asyncio.gather(*(child.stop(wait) for child in self.children.values()))
+
+    async def apply(self, servers_cfg):
+        """Bring children in line with a new mcpServers config."""
+        wanted = enabled_servers(servers_cfg)
+        added, removed, changed = diff_servers(self.entries, wanted)
+        if not (added or removed or changed):
+            return
+        logger.info(f"[gateway] Config changed: added {added}, removed {removed}, restarted {changed}")
+        await asyncio.gather(*(self.remove_child(t) for t in removed + changed))
+        for target in added + changed:
+            self.children[target] = GatewayChild(target, self)
+        self.entries = wanted
+        self.routes = {name: route for name, route in self.routes.items()
+                       if self.children.get(route[0].target) is route[0]}
+        if self.websocket is not None:
+            await asyncio.gather(*(self.ensure_ready(self.children[t]) for t in added + changed),
+                                 return_exceptions=True)
+            await self.send({"jsonrpc": "2.0", "method": "notifications/tools/list_changed"})
+
+    async def remove_child(self, target):
+        """Let a child finish its in-flight calls, then stop it and fail whatever is left."""
+        child = self.children.pop(target)
+        await child.drain()
+        await child.stop()
+        await self.fail_child_requests(child, f"Server {target} was removed")
+        if registry.get(target) is child:
+            del registry[target]
+
+    async def fail_child_requests(self, child, reason):
+        child.forwarded.clear()
+        child.held_ready.set()
+        for gateway_id, entry in list(self.pending.items()):
+            if isinstance(entry, tuple) and entry[0] is child:
+                del self.pending[gateway_id]
+                child.metrics.response_sent(gateway_id, True, 0)
+                await entry[2](jsonrpc_error(entry[1], -32603, reason))
+
+    async def serve(self, websocket):
+        self.websocket = websocket
+        # Start children up front so the first tools/list does not pay spawn time
+        await asyncio.gather(*(self.ensure_ready(child) for child in self.children.values()),
+                             return_exceptions=True)
+        tasks = set()
+        try:
+            while True:
+                message = await websocket.recv(decode=False)
+                log_frame(self.target, "<<", message)
+                # Handle each message in its own task so a slow child never blocks the socket
+                task = asyncio.create_task(self.on_upstream_message(message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            self.websocket = None
+            # Replies still owed to this connection can no longer be delivered
+            for gateway_id, entry in list(self.pending.items()):
+                if not isinstance(entry, asyncio.Future):
+                    del self.pending[gateway_id]
+            self.reverse.clear()
+            for child in self.children.values():
+                child.metrics.abandon_in_flight()
+
+    async def send(self, payload):
+        if self.websocket is None:
+            return
+        try:
+            await self.websocket.send(json.dumps(payload))
+        except websockets.exceptions.ConnectionClosed:
+            logger.debug("[gateway] Dropping message for closed connection")
+
+    async def ensure_ready(self, child):
+        """Start the child if needed and run the gateway's handshake with it."""
+        if child.respawning is not None and child.respawning is not asyncio.current_task():
+            await asyncio.wait({child.respawning})  # it ends with this same handshake
+        async with child.lock:
+            if child.running and child.ready:
+                return
+            if not child.running:
+                await child.start()
+            result = await self.request(child, "initialize", {
+                "protocolVersion": self.protocol,
+                "capabilities": {},
+                "clientInfo": {"name": "mcp_pipe", "version": VERSION},
+            })
+            child.enqueue(json.dumps({"jsonrpc": "2.0", "method": "notifications/initialized"}).encode('utf-8'))
+            child.ready = True
+            server_name = (result.get("serverInfo") or {}).get("name", child.target)
+            logger.info(f"[gateway] Initialized {child.target} ({server_name})")
+
+    async def request(self, child, method, params, timeout=GATEWAY_REQUEST_TIMEOUT):
+        """Send an internal request to a child and wait for its result."""
+        key = None
+        if child.cache_enabled and method in CACHEABLE_METHODS:
+            key = child.list_cache.key(method, params)
+            cached = child.list_cache.lookup(key)
+            if cached is not None:
+                return cached
+        gateway_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[gateway_id] = future
+        try:
+            await child.write(json.dumps({"jsonrpc": "2.0", "id": gateway_id, "method": method, "params": params}).encode('utf-8'))
+            response = await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(gateway_id, None)
+        if "error" in response:
+            raise RuntimeError(f"{child.target} {method} failed: {response['error'].get('message')}")
+        result = response.get("result") or {}
+        if key is not None:
+            child.list_cache.entries[key] = result
+        return result
+
+    async def list_tools(self):
+        """Fetch tools from every child and rebuild the routing table."""
+        async def child_tools(child):
+            await self.ensure_ready(child)
+            tools, cursor = [], None
+            while True:
+                result = await self.request(child, "tools/list", {"cursor": cursor} if cursor else {})
+                tools.extend(result.get("tools") or [])
+                cursor = result.get("nextCursor")
+                if not cursor:
+                    return tools
+
+        children = list(self.children.values())
+        results = await asyncio.gather(*(child_tools(c) for c in children), return_exceptions=True)
+        routes, tools = {}, []
+        for child, result in zip(children, results):
+            if isinstance(result, Exception):
+                logger.warning(f"[gateway] Omitting tools of {child.target}: {result}")
+                continue
+            for tool in result:
+                name = f"{child.target}{GATEWAY_SEPARATOR}{tool['name']}"
+                routes[name] = (child, tool["name"])
+                tools.append(dict(tool, name=name))
+        self.routes = routes
+        return tools
+
+    async def on_upstream_message(self, message):
+        try:
+            msg = json.loads(message)
+        except ValueError:
+            await self.send(jsonrpc_error(None, -32700, "Parse error"))
+            return
+        if isinstance(msg, list) and msg:
+            await self.on_upstream_batch(msg)
+            return
+        await self.handle(msg, self.send)
+
+    async def on_upstream_batch(self, items):
+        """Handle every element of a batch concurrently and reply with one array."""
+        batch = BatchReply(self.send)
+        handlers = []
+        for item in items:
+            if isinstance(item, dict) and "id" in item and "method" in item:
+                handlers.append(self.handle(item, functools.partial(batch.add, batch.expect())))
+            elif isinstance(item, dict):
+                handlers.append(self.handle(item, self.send))  # notification or response: no reply
+            else:
+                await batch.add(batch.expect(), jsonrpc_error(None, -32600, "Invalid Request"))
+        await batch.seal()
+        await asyncio.gather(*handlers)
+
+    async def handle(self, msg, reply):
+        """Handle one message from the endpoint; reply(payload) sends its response."""
+        if not isinstance(msg, dict):
+            await reply(jsonrpc_error(None, -32600, "Invalid Request"))
+            return
+        method = msg.get("method")
+        request_id = msg.get("id")
+        if method is not None and (not isinstance(method, str) or
+                                   (request_id is not None and jsonrpc_id(request_id) is None)):
+            await reply(jsonrpc_error(None, -32600, "Invalid Request"))
+            return
+
+        try:
+            if method is None:
+                # Endpoint answering a request that a child initiated
+                entry = self.reverse.pop(request_id, None) if jsonrpc_id(request_id) is not None else None
+                if entry is not None:
+                    child, child_id = entry
+                    child.enqueue(json.dumps(dict(msg, id=child_id)).encode('utf-8'))
+                return
+            if not isinstance(msg.get("params") or {}, dict):
+                if request_id is not None:
+                    await reply(jsonrpc_error(request_id, -32602, "Invalid params: expected an object"))
+                return
+            if method == "initialize":
+                self.protocol = (msg.get("params") or {}).get("protocolVersion") or self.protocol
+                await reply({"jsonrpc": "2.0", "id": request_id, "result": {
+                    "protocolVersion": self.protocol,
+                    "capabilities": {"tools": {"listChanged": True}},
+                    "serverInfo": {"name": "mcp_pipe-gateway", "version": VERSION},
+                }})
+            elif method == "ping":
+                await reply({"jsonrpc": "2.0", "id": request_id, "result": {}})
+            elif method == "tools/list":
+                await reply({"jsonrpc": "2.0", "id": request_id, "result": {"tools": await self.list_tools()}})
+            elif method == "tools/call":
+                await self.call_tool(msg, reply)
+            elif method == "notifications/cancelled":
+                await self.forward_cancel(msg)
+            elif method.startswith("notifications/"):
+                pass  # initialized etc. are handled per child by the gateway
+            elif method in ("prompts/list", "resources/list", "resources/templates/list"):
+                key = {"prompts/list": "prompts", "resources/list": "resources"}.get(method, "resourceTemplates")
+                await reply({"jsonrpc": "2.0", "id": request_id, "result": {key: []}})
+            elif request_id is not None:
+                await reply(jsonrpc_error(request_id, -32601, f"Method not found: {method}"))
+        except Exception as e:
+            logger.error(f"[gateway] Error handling {method or 'a response'}: {e}")
+            if method is not None and request_id is not None:
+                await reply(jsonrpc_error(request_id, -32603, str(e)))
+
+    async def call_tool(self, msg, reply):
+        params = msg.get("params") or {}
+        name = params.get("name")
+        if not isinstance(name, str):
+            await reply(jsonrpc_error(msg.get("id"), -32602, "Invalid params: tools/call needs a tool name"))
+            return
+        if name not in self.routes:
+            await self.list_tools()  # tools may have been added since the last listing
+        if name not in self.routes:
+            await reply(jsonrpc_error(msg.get("id"), -32602, f"Unknown tool: {name}"))
+            return
+        child, tool_name = self.routes[name]
+        await self.ensure_ready(child)
+        if not await self.admit(child, msg, reply):
+            return
+        gateway_id = next(self._ids)
+        self.pending[gateway_id] = (child, msg.get("id"), reply)
+        forwarded = json.dumps(dict(msg, id=gateway_id, params=dict(params, name=tool_name))).encode('utf-8')
+        child.metrics.request_started(gateway_id, "tools/call", tool_name, len(forwarded))
+        child.forwarded[gateway_id] = (time.perf_counter(), "tools/call", tool_name)
+        await child.write(forwarded)
+        default, per_tool, max_stalls = child.deadlines
+        limit = per_tool.get(tool_name, default)
+        if limit > 0:
+            task = asyncio.create_task(self.expire(child, gateway_id, tool_name, limit, max_stalls))
+            self.deadline_tasks.add(task)
+            task.add_done_callback(self.deadline_tasks.discard)
+
+    async def admit(self, child, msg, reply):
+        """Wait for one of the child's `"max_inflight"` slots, oldest caller first.
+
+        Up to `"max_queue"` calls wait; beyond that the call is answered with
+        a retryable error and False is returned.
+        """
+        limit, queue = child.admission
+        if not limit or (not child.held and len(child.forwarded) < limit):
+            return True
+        if len(child.held) >= queue:
+            child.rejected += 1
+            retry_ms = child.retry_after_ms(limit)
+            error = jsonrpc_error(msg.get("id"), SERVER_BUSY_CODE, f"Server busy ({limit} requests in flight, "
+                                                                  f"{queue} queued), retry after {retry_ms} ms")
+            error["error"]["data"] = {"retryable": True, "retryAfterMs": retry_ms}
+            await reply(error)
+            return False
+        turn = object()
+        child.held[turn] = None
+        try:
+            while next(iter(child.held)) is not turn or len(child.forwarded) >= limit:
+                child.held_ready.clear()
+                await child.held_ready.wait()
+        finally:
+            del child.held[turn]
+            child.held_ready.set()  # the next caller may fit as well
+        return True
+
+    async def expire(self, child, gateway_id, tool, limit, max_stalls):
+        """Fail a tools/call the child has not answered within `limit` seconds and cancel it there."""
+        await asyncio.sleep(limit)
+        entry = self.pending.get(gateway_id)
+        if not isinstance(entry, tuple) or entry[0] is not child:
+            return  # answered, failed or abandoned by its connection
+        del self.pending[gateway_id]
+        forwarded_at = child.forwarded.pop(gateway_id, (0.0,))[0]
+        child.held_ready.set()
+        logger.warning(f"[gateway] {child.target} tools/call {tool} timed out after {limit:g}s")
+        child.timeouts[("tools/call", tool)] += 1
+        child.metrics.response_sent(gateway_id, True, 0)
+        await entry[2](jsonrpc_error(entry[1], REQUEST_TIMEOUT_CODE, f"Request timed out after {limit:g}s"))
+        cancel = {"jsonrpc": "2.0", "method": "notifications/cancelled",
+                  "params": {"requestId": gateway_id, "reason": f"Timed out after {limit:g}s"}}
+        with contextlib.suppress(Exception):
+            child.enqueue(json.dumps(cancel).encode('utf-8'))
+        if child.last_output > forwarded_at:
+            return  # the child is answering other calls, only this one is lost
+        child.stalls += 1
+        if max_stalls and child.stalls >= max_stalls and child.running and child.respawning is None:
+            logger.error(f"[gateway] {child.stalls} calls to {child.target} timed out with no output from it, "
+                         f"restarting it")
+            child.stalls = 0
+            child.stall_restarts += 1
+            with contextlib.suppress(ProcessLookupError):
+                child.process.kill()
+
+    async def forward_cancel(self, msg):
+        params = msg.get("params") or {}
+        for gateway_id, entry in self.pending.items():
+            if isinstance(entry, tuple) and entry[1] == params.get("requestId"):
+                child = entry[0]
+                if child.forwarded.pop(gateway_id, None) is not None:
+                    child.held_ready.set()  # the child may never answer it: its slot is free
+                cancel = dict(msg, params=dict(params, requestId=gateway_id))
+                child.enqueue(json.dumps(cancel).encode('utf-8'))
+                return
+
+    async def on_child_message(self, child, data):
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            logger.warning(f"[gateway] Non-JSON output from {child.target}: {data[:120]}")
+            return
+        if not isinstance(msg, dict):
+            return
+        if "method" not in msg:
+            # A response: route it back to whoever asked
+            if child.forwarded.pop(jsonrpc_id(msg.get("id")), None) is not None:
+                child.held_ready.set()
+            entry = self.pending.get(msg.get("id"))
+            if isinstance(entry, asyncio.Future):
+                if not entry.done():
+                    entry.set_result(msg)
+            elif entry is not None:
+                del self.pending[msg["id"]]
+                child.metrics.response_sent(msg["id"], "error" in msg, len(data))
+                await entry[2](dict(msg, id=entry[1]))
+            return
+        child.metrics.messages_out += 1
+        child.metrics.bytes_out += len(data)
+        if msg["method"] in LIST_CHANGED:
+            child.list_cache.invalidate(LIST_CHANGED[msg["method"]])
+        if "id" in msg:
+            # Child-initiated request (e.g. sampling): give it a gateway id
+            gateway_id = next(self._ids)
+            self.reverse[gateway_id] = (child, msg["id"])
+            msg = dict(msg, id=gateway_id)
+        await self.send(msg)
+
+class ServerFleet:
+    """One connect_with_retry task (and WebSocket) per enabled server, kept in step with the config."""
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.entries = {}  # target -> config entry its task was started from
+        self.servers = {}  # target -> ServerProcess
+        self.tasks = {}    # target -> connect_with_retry task
+
+    async def apply(self, servers_cfg):
+        """Start added servers, drain removed/disabled ones, restart changed ones."""
+        wanted = enabled_servers(servers_cfg)
+        added, removed, changed = diff_servers(self.entries, wanted)
+        if not (added or removed or changed):
+            return
+        if self.entries:
+            logger.info(f"Config changed: added {added}, removed {removed}, restarted {changed}")
+        await asyncio.gather(*(self.remove(t) for t in removed + changed))
+        for target in added + changed:
+            replicas = int(wanted[target].get("replicas") or 1)
+            server = ReplicaPool(target, replicas) if replicas > 1 else ServerProcess(target)
+            self.servers[target] = server
+            self.tasks[target] = asyncio.create_task(connect_with_retry(self.uri, server))
+        self.entries = wanted
+
+    async def remove(self, target):
+        server = self.servers.pop(target)
+        task = self.tasks.pop(target)
+        server.removed = True
+        await server.drain()
+        if server.websocket is not None:
+            await server.websocket.close(1001, "server removed from config")
+        await server.stop()  # before cancelling, which would make it wait for the exit
+        task.cancel()  # connect_with_retry stops the child on the way out
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        if registry.get(target) is server:
+            del registry[target]
+        logger.info(f"[{target}] Removed")
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate that sends messages shorter than `threshold` bytes uncompressed.
+
+    RFC 7692 flags compression per message (RSV1), so small JSON-RPC replies
+    can skip zlib while large tool results are still compressed.
+    """
+
+    threshold = 0
+
+    def encode(self, frame):
+        if frame.opcode in (Opcode.TEXT, Opcode.BINARY) and frame.fin and len(frame.data) < self.threshold:
+            return frame
+        return super().encode(frame)
+
+class ThresholdDeflateFactory(ClientPerMessageDeflateFactory):
+    """Offer permessage-deflate with a compression level and a minimum message size."""
+
+    def __init__(self, threshold=0, level=None):
+        super().__init__(compress_settings={"memLevel": 5, **({"level": level} if level is not None else {})})
+        self.threshold = threshold
+
+    def process_response_params(self, params, accepted_extensions):
+        negotiated = super().process_response_params(params, accepted_extensions)
+        extension = ThresholdPerMessageDeflate(
+            negotiated.remote_no_context_takeover,
+            negotiated.local_no_context_takeover,
+            negotiated.remote_max_window_bits,
+            negotiated.local_max_window_bits,
+            negotiated.compress_settings,
+        )
+        extension.threshold = self.threshold
+        return extension
+
+def websocket_options(target):
+    """Keyword arguments for websockets.connect() from the config's "websocket" objects.
+
+    A top-level "websocket" object applies to every connection (and to the
+    gateway); a server entry's own "websocket" object overrides it key by key:
+
+        "websocket": {"compression": true, "compression_threshold": 1024, "compression_level": 6,
+                      "max_size": 16777216, "max_queue": 16, "write_limit": 65536,
+                      "ping_interval": 20, "ping_timeout": 20}
+    """
+    cfg = load_config()
+    if not isinstance(cfg, dict):
+        return {}
+    options = dict(cfg.get("websocket") or {})
+    options.update((server_entry(target) or {}).get("websocket") or {})
+    kwargs = {}
+    for key, value in options.items():
+        if key in WEBSOCKET_OPTIONS:
+            kwargs[key] = value
+        elif key not in ("compression", "compression_threshold", "compression_level"):
+            logger.warning(f"[{target}] Ignoring unknown websocket option '{key}'")
+    compression = options.get("compression", True)
+    threshold = options.get("compression_threshold") or 0
+    level = options.get("compression_level")
+    if compression in (False, None, "none"):
+        kwargs["compression"] = None
+    elif threshold or level is not None:
+        kwargs["compression"] = None  # our factory replaces the default deflate offer
+        kwargs["extensions"] = [ThresholdDeflateFactory(threshold, level)]
+    return kwargs
+
+class CapturingConnection(ClientConnection):
+    """Client connection that records every frame it receives or sends to `capture`."""
+
+    capture_target = None
+
+    async def recv(self, decode=None):
+        message = await super().recv(decode)
+        capture.record(self.capture_target, "in", message)
+        return message
+
+    async def send(self, message, *, text=None):
+        if isinstance(message, (str, bytes, bytearray, memoryview)):
+            capture.record(self.capture_target, "out", message)
+        await super().send(message, text=text)
+
+async def connect_to_server(uri, server, on_connected=None):
+    """Connect to WebSocket server and serve it from the given server or gateway."""
+    target = server.target
     try:
         logger.info(f"[{target}] Connecting to WebSocket server...")
-        async with websockets.connect(uri) as websocket:
+        options = websocket_options(target)
+        if capture is not None:
+            options["create_connection"] = CapturingConnection
+        async with websockets.connect(uri, **options) as websocket:
             logger.info(f"[{target}] Successfully connected to WebSocket server")
-
-            # Start server process (built from CLI arg or config)
-            cmd, env = build_server_command(target)
-            process = subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding='utf-8',
-                text=True,
-                env=env
-            )
-            logger.info(f"[{target}] Started server process: {' '.join(cmd)}")
-            
-            # Create two tasks: read from WebSocket and write to process, read from process and write to WebSocket
-            await asyncio.gather(
-                pipe_websocket_to_process(websocket, process, target),
-                pipe_process_to_websocket(process, websocket, target),
-                pipe_process_stderr_to_terminal(process, target)
-            )
+            if capture is not None:
+                websocket.capture_target = target
+                capture.event(target, "connect")
+            if on_connected is not None:
+                on_connected()
+            await server.serve(websocket)
     except websockets.exceptions.ConnectionClosed as e:
-        logger.error(f"[{target}] WebSocket connection closed: {e}")
+        # Closing the connection of a server removed from the config is not a failure
+        logger.log(logging.INFO if server.removed else logging.ERROR, f"[{target}] WebSocket connection closed: {e}")
         raise  # Re-throw exception to trigger reconnection
     except Exception as e:
         logger.error(f"[{target}] Connection error: {e}")
         raise  # Re-throw exception
-    finally:
-        # Ensure the child process is properly terminated
-        if 'process' in locals():
-            logger.info(f"[{target}] Terminating server process")
-            try:
-                process.terminate()
-                process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                process.kill()
-            logger.info(f"[{target}] Server process terminated")
 
-async def pipe_websocket_to_process(websocket, process, target):
+async def pipe_websocket_to_process(websocket, server):
     """Read data from WebSocket and write to process stdin"""
+    target = server.target
     try:
         while True:
-            # Read message from WebSocket
-            message = await websocket.recv()
-            logger.debug(f"[{target}] << {message[:120]}...")
-            
-            # Write to process stdin (in text mode)
-            if isinstance(message, bytes):
-                message = message.decode('utf-8')
-            process.stdin.write(message + '\n')
-            process.stdin.flush()
+            # Read message from WebSocket as raw bytes; text frames are not decoded
+            message = await websocket.recv(decode=False)
+            log_frame(target, "<<", message)
+
+            if is_batch(message):
+                await server.write_batch(message)
+                continue
+            peeked = server.metrics.observe_inbound(message)
+            if await server.intercept(message):
+                continue
+            if await server.admit(message, peeked):
+                await server.write(message)
     except Exception as e:
-        logger.error(f"[{target}] Error in WebSocket to process pipe: {e}")
+        if not server.removed:
+            logger.error(f"[{target}] Error in WebSocket to process pipe: {e}")
         raise  # Re-throw exception to trigger reconnection
-    finally:
-        # Close process stdin
-        if not process.stdin.closed:
-            process.stdin.close()
 
-async def pipe_process_to_websocket(process, websocket, target):
-    """Read data from process stdout and send to WebSocket"""
+async def pipe_queue_to_process(server):
+    """Drain the server's outbound queue into process stdin"""
+    target = server.target
+    stdin = server.process.stdin
+    try:
+        while True:
+            while not (server.control or server.outbound):
+                server.outbound_ready.clear()
+                await server.outbound_ready.wait()
+            lane = "control" if server.control else "data"
+            message, queued_at = (server.control or server.outbound).popleft()
+            server.queue_wait[lane].observe(time.perf_counter() - queued_at)
+            stdin.writelines((message, b'\n'))
+            # drain() waits only when the pipe buffer is full, i.e. the child is not reading
+            await stdin.drain()
+            server.outbound_bytes -= len(message) + 1
+            if not server.writable.is_set() and server.outbound_bytes <= STDIN_LOW_WATER:
+                server.resume_writing()
+    except (BrokenPipeError, ConnectionResetError) as e:
+        logger.error(f"[{target}] Error writing to process stdin: {e}")
+        server.write_error = e
+        server.writable.set()  # wake waiting readers so they see the error
+
+async def pipe_process_to_websocket(server):
+    """Read data from process stdout and hand it to the server's delivery path"""
+    target = server.target
+    process = server.process
     try:
         while True:
             # Read data from process stdout
-            data = await asyncio.to_thread(process.stdout.readline)
+            try:
+                data = await process.stdout.readline()
+            except ValueError as e:
+                # A line over STREAM_LIMIT: the stream cannot be resynchronised, handle it like a crash
+                logger.error(f"[{target}] Server process wrote a line over {STREAM_LIMIT} bytes, restarting it: {e}")
+                break
             
             if not data:  # If no data, the process may have ended
                 logger.info(f"[{target}] Process has ended output")
-                break
-                
-            # Send data to WebSocket
-            logger.debug(f"[{target}] >> {data[:120]}...")
-            # In text mode, data is already a string, no need to decode
-            await websocket.send(data)
+                server.child_exited(process)
+                return
+
+            await server.deliver(data)
     except Exception as e:
-        logger.error(f"[{target}] Error in process to WebSocket pipe: {e}")
-        raise  # Re-throw exception to trigger reconnection
+        logger.error(f"[{target}] Error in process to WebSocket pipe, restarting the server process: {e}")
+    # Nobody reads this child's output any more: kill it so the crash path fails its requests and respawns it
+    if process.returncode is None:
+        with contextlib.suppress(ProcessLookupError):
+            process.kill()
+    server.child_exited(process)
 
-async def pipe_process_stderr_to_terminal(process, target):
-    """Read data from process stderr and print to terminal"""
+async def pipe_process_stderr_to_log(process, target):
+    """Read process stderr into the target's StderrLog (shipped in batches by stderr_sink)"""
+    log = stderr_log(target)
+    partial = b''
     try:
         while True:
-            # Read data from process stderr
-            data = await asyncio.to_thread(process.stderr.readline)
+            # Read whatever stderr has buffered; a chatty child costs one wakeup per chunk, not per line
+            data = await process.stderr.read(STDERR_READ_SIZE)
             
             if not data:  # If no data, the process may have ended
+                if partial:
+                    log.add([partial])
+                log.settle()
+                stderr_sink.flush()  # show a crash traceback before the exit is logged
                 logger.info(f"[{target}] Process has ended stderr output")
                 break
                 
-            # Print stderr data to terminal (in text mode, data is already a string)
-            sys.stderr.write(data)
-            sys.stderr.flush()
+            lines = (partial + data).split(b'\n')
+            partial = lines.pop()
+            if len(partial) > STDERR_MAX_LINE:
+                lines.append(partial)
+                partial = b''
+            log.add(lines)
     except Exception as e:
         logger.error(f"[{target}] Error in process stderr pipe: {e}")
-        raise  # Re-throw exception to trigger reconnection
+        raise
+    finally:
+        log.settle()
+
+def raise_fd_limit():
+    """Raise the open-file soft limit to the hard limit.
+
+    Each hosted server holds a socket plus three pipes, so a few hundred
+    servers exceed the common default soft limit of 1024 descriptors.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError) as e:
+            logger.warning(f"Could not raise open file limit from {soft}: {e}")
+
+def use_pidfd_child_watcher():
+    """Reap children via pidfd instead of one waitpid() thread per child.
+
+    Python 3.12+ already does this by default; on 3.8-3.11 the default
+    ThreadedChildWatcher parks a thread for every running server.
+    Must be called from inside the running event loop.
+    """
+    if sys.version_info >= (3, 12) or not hasattr(os, "pidfd_open"):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:  # kernel without pidfd support
+        return
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(asyncio.get_running_loop())
+    asyncio.set_child_watcher(watcher)
 
 def signal_handler(sig, frame):
     """Handle interrupt signals"""
     logger.info("Received interrupt signal, shutting down...")
     sys.exit(0)
 
+def config_path():
+    return os.environ.get("MCP_CONFIG") or os.path.join(os.getcwd(), "mcp_config.json")
+
+def config_signature(path):
+    """(mtime, size) of the config file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+# path -> (signature, parsed config); the file is parsed once per version
+_config_cache = {}
+
 def load_config():
-    """Load JSON config from $MCP_CONFIG or ./mcp_config.json. Return dict or {}."""
-    path = os.environ.get("MCP_CONFIG") or os.path.join(os.getcwd(), "mcp_config.json")
-    if not os.path.exists(path):
+    """Load JSON config from $MCP_CONFIG or ./mcp_config.json. Return dict or {}.
+
+    A file that fails to parse (e.g. half-written by an editor) yields the
+    last version that did, so a running fleet is never torn down by a typo.
+    """
+    path = config_path()
+    signature = config_signature(path)
+    if signature is None:
         return {}
+    cached = _config_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
     try:
         with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+            cfg = json.load(f)
     except Exception as e:
         logger.warning(f"Failed to load config {path}: {e}")
-        return {}
+        return cached[1] if cached is not None else {}
+    _config_cache[path] = (signature, cfg)
+    return cfg
+
+def enabled_servers(servers_cfg):
+    """Map target -> entry for the enabled mcpServers, without the `disabled` flag."""
+    enabled = {}
+    for name, entry in (servers_cfg or {}).items():
+        entry = entry or {}
+        if not entry.get("disabled"):
+            enabled[name] = {k: v for k, v in entry.items() if k != "disabled"}
+    return enabled
 
+def diff_servers(current, wanted):
+    """Return (added, removed, changed) targets between two enabled_servers() maps."""
+    added = [t for t in wanted if t not in current]
+    removed = [t for t in current if t not in wanted]
+    changed = [t for t in wanted if t in current and wanted[t] != current[t]]
+    return added, removed, changed
+
+async def watch_config(apply, interval):
+    """Poll the config file and pass each new mcpServers section to apply()."""
+    path = config_path()
+    signature = config_signature(path)
+    while True:
+        await asyncio.sleep(interval)
+        current = config_signature(path)
+        if current == signature:
+            continue
+        signature = current
+        if current is None:
+            logger.warning(f"Config {path} disappeared; keeping current servers")
+            continue
+        cfg = load_config()
+        try:
+            await apply((cfg.get("mcpServers") or {}) if isinstance(cfg, dict) else {})
+        except Exception as e:
+            logger.error(f"Failed to apply config {path}: {e}")
+
+def resolve_inprocess_spec(target, entry):
+    """Return ("module", name) or ("path", script) if target should run in-process, else None.
+
+    Opt in per server with `"inprocess": true` on a stdio entry whose args are
+    `["-m", "module"]` or `["script.py", ...]`, or set MCP_INPROCESS=1 to host
+    script-path targets in-process. In-process servers share the pipe's
+    environment, so entries with their own `env` keep using a subprocess.
+    """
+    if entry is not None:
+        if not entry.get("inprocess"):
+            return None
+        if entry.get("env"):
+            logger.warning(f"[{target}] 'inprocess' ignored: entries with 'env' need their own process")
+            return None
+        args = entry.get("args") or []
+        if len(args) >= 2 and args[0] == "-m":
+            return ("module", args[1])
+        if args and args[0].endswith(".py"):
+            return ("path", args[0])
+        logger.warning(f"[{target}] 'inprocess' needs args ['-m', module] or ['script.py']; using a subprocess")
+        return None
+    if os.environ.get("MCP_INPROCESS", "").lower() in ("1", "true", "yes") and target.endswith(".py"):
+        return ("path", target)
+    return None
+
+def resolve_remote_spec(target, entry):
+    """Return (transport, url, headers) if target is an "sse"/"http" entry served natively, else None.
+
+    Set `"proxy": true` on the entry to keep running `python -m mcp_proxy`
+    as a child instead (the fallback when httpx is not installed).
+    """
+    if not entry or entry.get("proxy") or entry.get("disabled") or not entry.get("url"):
+        return None
+    typ = (entry.get("type") or entry.get("transportType") or "stdio").lower()
+    if typ not in ("sse", "http", "streamablehttp"):
+        return None
+    if importlib.util.find_spec("httpx") is None:
+        logger.warning(f"[{target}] httpx is not installed; using python -m mcp_proxy")
+        return None
+    headers = {str(k): str(v) for k, v in (entry.get("headers") or {}).items()}
+    return ("sse" if typ == "sse" else "http"), entry["url"], headers
 
 def build_server_command(target=None):
     """Build [cmd,...] and env for the server process for a given target.
@@ -250,26 +3246,68 @@ if __name__ == "__main__":
         sys.exit(1)
     
     # Determine target: default to all if no arg; single target otherwise
+    gateway_mode = os.environ.get('MCP_GATEWAY', '').lower() in ('1', 'true', 'yes')
+    if len(sys.argv) >= 2 and sys.argv[1] == '--gateway':
+        gateway_mode = True
+        del sys.argv[1]
     target_arg = sys.argv[1] if len(sys.argv) >= 2 else None
 
+    raise_fd_limit()
+    if os.environ.get("MCP_CAPTURE"):
+        capture = Capture(os.environ["MCP_CAPTURE"])
+        signal.signal(signal.SIGTERM, signal_handler)  # shut down through asyncio.run so the tail is flushed
+        logger.warning(f"Capturing WebSocket traffic to {os.path.abspath(capture.directory)} (frames include tool arguments and results)")
+
+    if os.environ.get("MCP_STDERR_LOG"):
+        stderr_sink = StderrSink(os.environ["MCP_STDERR_LOG"])
+        logger.info(f"Writing child stderr to {os.path.abspath(stderr_sink.path)}")
+
     async def _main():
+        use_pidfd_child_watcher()
+        await start_metrics()
+        flushers = [asyncio.create_task(stderr_sink.flush_periodically())]
+        if capture is not None:
+            flushers.append(asyncio.create_task(capture.flush_periodically()))
+        try:
+            await _serve()
+        finally:
+            # Each flusher writes out its last batch when cancelled
+            for task in flushers:
+                task.cancel()
+            await asyncio.gather(*flushers, return_exceptions=True)
+
+    async def _serve():
+        if forkserver_enabled():
+            await get_forkserver().ensure_started()  # preload while the first connections open
         if not target_arg:
             cfg = load_config()
             servers_cfg = (cfg.get("mcpServers") or {})
-            all_servers = list(servers_cfg.keys())
-            enabled = [name for name, entry in servers_cfg.items() if not (entry or {}).get("disabled")]
-            skipped = [name for name in all_servers if name not in enabled]
+            enabled = enabled_servers(servers_cfg)
+            skipped = [name for name in servers_cfg if name not in enabled]
             if skipped:
                 logger.info(f"Skipping disabled servers: {', '.join(skipped)}")
             if not enabled:
                 raise RuntimeError("No enabled mcpServers found in config")
+            watch_interval = float(os.environ.get("MCP_CONFIG_WATCH_INTERVAL", DEFAULT_CONFIG_WATCH_INTERVAL))
+            if gateway_mode:
+                logger.info(f"Starting gateway for servers: {', '.join(enabled)}")
+                gateway = Gateway(enabled)
+                runners = [connect_with_retry(endpoint_url, gateway)]
+                if watch_interval > 0:
+                    runners.append(watch_config(gateway.apply, watch_interval))
+                await asyncio.gather(*runners)
+                return
             logger.info(f"Starting servers: {', '.join(enabled)}")
-            tasks = [asyncio.create_task(connect_with_retry(endpoint_url, t)) for t in enabled]
-            # Run all forever; if any crashes it will auto-retry inside
-            await asyncio.gather(*tasks)
+            fleet = ServerFleet(endpoint_url)
+            await fleet.apply(servers_cfg)
+            # Run all forever; each server auto-retries inside, config changes are applied as they land
+            if watch_interval > 0:
+                await watch_config(fleet.apply, watch_interval)
+            else:
+                await asyncio.Event().wait()
         else:
             if os.path.exists(target_arg):
-                await connect_with_retry(endpoint_url, target_arg)
+                await connect_with_retry(endpoint_url, ServerProcess(target_arg))
             else:
                 logger.error("Argument must be a local Python script path. To run configured servers, run without arguments.")
                 sys.exit(1)
@@ -0,0 +1,358 @@
+"""
+Native SSE / streamable-HTTP client for mcp_pipe.py: a remote MCP server shaped like a child process.
+
+mcp_pipe.py uses RemoteServer in place of a `python -m mcp_proxy` child for
+config entries with "type": "sse" or "http" (unless "proxy": true). The pipe
+writes JSON-RPC lines to its stdin and reads lines from its stdout, exactly
+as with a subprocess:
+
+    process = RemoteServer(target, "http", "https://example.com/mcp", {"Authorization": "..."})
+    process.stdin.write(b'{"jsonrpc": "2.0", "id": 1, "method": "initialize", ...}\\n')
+    line = await process.stdout.readline()   # b'' once the session has ended
+
+Requires httpx, imported when the first RemoteServer is created.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+from urllib.parse import urljoin
+
+logger = logging.getLogger('MCP_PIPE')
+
+# Pooled connections, messages queued or being POSTed before stdin waits
+HTTP_MAX_CONNECTIONS = 32
+HTTP_MAX_PENDING = 64
+HTTP_CONNECT_TIMEOUT = 10  # seconds; reads are unbounded (tool calls and event streams run long)
+
+
+async def sse_events(response):
+    """Yield (event, data) for each event of a text/event-stream httpx response."""
+    event, data = "message", []
+    async for line in response.aiter_lines():
+        if not line:
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+        elif not line.startswith(":"):
+            field, _, value = line.partition(":")
+            if value.startswith(" "):
+                value = value[1:]
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+
+
+def message_id(value):
+    """A usable JSON-RPC id (str or int), else None."""
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        return None
+    return value
+
+
+def peek_message(line):
+    """Return (id, method, params) of one JSON-RPC message; None / {} for whatever is missing or unusable."""
+    try:
+        message = json.loads(line)
+    except ValueError:
+        return None, None, {}
+    if not isinstance(message, dict):
+        return None, None, {}  # a batch
+    method, params = message.get("method"), message.get("params")
+    return (message_id(message.get("id")), method if isinstance(method, str) else None,
+            params if isinstance(params, dict) else {})
+
+
+class _Stdin:
+    """Line-framed bytes in, one message per line to RemoteServer.submit()."""
+
+    def __init__(self, host):
+        self.host = host
+        self._buffer = b''
+        self._closed = False
+
+    def write(self, data):
+        self._buffer += data
+        while b'\n' in self._buffer:
+            line, _, self._buffer = self._buffer.partition(b'\n')
+            self.host.submit(line)
+
+    def writelines(self, parts):
+        for part in parts:
+            self.write(part)
+
+    async def drain(self):
+        await self.host.wait_for_capacity()
+
+    def is_closing(self):
+        return self._closed
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self.host.submit(None)
+            except BrokenPipeError:
+                pass
+
+
+class _Stdout:
+    """Serialized messages from the server, b'' once the session has ended."""
+
+    def __init__(self):
+        self.lines = asyncio.Queue()
+
+    async def readline(self):
+        return await self.lines.get()
+
+
+class RemoteServer:
+    """An SSE or streamable-HTTP MCP server spoken to natively, shaped like asyncio.subprocess.Process.
+
+    Every stdin line is POSTed from the pipe's own event loop over a pooled
+    keep-alive httpx client and whatever the server sends back (JSON bodies,
+    SSE streams) becomes stdout lines. Streamable HTTP carries the initialize
+    response's Mcp-Session-Id and listens for server messages on a GET
+    stream; legacy SSE POSTs to the endpoint its event stream announces.
+    Losing the session ends the "process", so the pipe respawns it and
+    replays initialize.
+    """
+
+    def __init__(self, target, transport, url, headers):
+        import httpx
+
+        self.target = target
+        self.transport = transport  # "sse" or "http"
+        self.url = url
+        self.pid = os.getpid()
+        self.returncode = None
+        self.stdin = _Stdin(self)
+        self.stdout = _Stdout()
+        self.stderr = None
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            timeout=httpx.Timeout(HTTP_CONNECT_TIMEOUT, read=None, pool=None),
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+        )
+        self.post_url = url if transport == "http" else None
+        self.session_id = None
+        self.protocol_version = None
+        self._ready = asyncio.Event()  # set once the SSE stream has announced where to POST
+        self._outbox = asyncio.Queue()  # stdin lines, POSTed in order by _send_in_order()
+        self._accepted = {}  # request id -> Event set once the server has answered the POST's headers
+        self._tasks = set()
+        self._pending = 0
+        self._capacity = asyncio.Event()
+        self._capacity.set()
+        self._exited = asyncio.Event()
+        if transport == "http":
+            self._ready.set()
+        else:
+            self._spawn(self._listen_sse())
+        self._spawn(self._send_in_order())
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def submit(self, line):
+        """Queue one message for the server (or shut down on None)."""
+        if self.returncode is not None:
+            raise BrokenPipeError(f"remote server {self.target} session has ended")
+        if line is None:
+            self.terminate()
+            return
+        self._pending += 1
+        if self._pending >= HTTP_MAX_PENDING:
+            self._capacity.clear()
+        self._outbox.put_nowait(bytes(line))
+
+    async def _send_in_order(self):
+        """POST queued messages in stdin order.
+
+        The next POST starts once a request's body has been sent (its reply
+        may take as long as the tool call), or once any other message has
+        been answered: initialize carries the session id later messages
+        need, and a notification such as initialized must not be overtaken
+        by what follows it. A cancellation is POSTed once the server has
+        accepted the request it cancels (separate connections are read in
+        no particular order), without holding up the messages behind it.
+        """
+        await self._ready.wait()
+        while True:
+            line = await self._outbox.get()
+            request_id, method, params = peek_message(line)
+            sent = asyncio.Event()
+            after = None
+            if method == "notifications/cancelled":
+                after = self._accepted.get(message_id(params.get("requestId")))
+            elif request_id is not None and method is not None and method != "initialize":
+                self._accepted[request_id] = asyncio.Event()
+            self._spawn(self._post(line, request_id, method, sent, after))
+            if after is None:
+                await sent.wait()
+
+    async def _post(self, line, request_id, method, sent, after=None):
+        initialize = method == "initialize"
+        request = request_id is not None and method is not None and not initialize
+        accepted = self._accepted.get(request_id) if request else None
+
+        async def trace(event, info):
+            if request and event.endswith("send_request_body.complete"):
+                sent.set()
+
+        try:
+            if after is not None:
+                await after.wait()
+            if self.returncode is not None:
+                return
+            headers = {"Content-Type": "application/json", "Accept": "application/json, text/event-stream"}
+            headers.update(self._session_headers())
+            async with self.client.stream("POST", self.post_url, content=line, headers=headers,
+                                          extensions={"trace": trace}) as response:
+                if response.status_code == 404 and self.session_id:
+                    self._exit(1, "Remote session expired (HTTP 404)")
+                    return
+                response.raise_for_status()
+                if accepted is not None:
+                    accepted.set()
+                if initialize:
+                    self.session_id = response.headers.get("mcp-session-id")
+                content_type = response.headers.get("content-type", "")
+                if self.transport == "sse":
+                    await response.aread()  # replies arrive on the event stream
+                elif content_type.startswith("text/event-stream"):
+                    async for event, data in sse_events(response):
+                        if event == "message":
+                            self._emit(data, initialize)
+                elif content_type.startswith("application/json"):
+                    self._emit(await response.aread(), initialize)
+                else:
+                    await response.aread()
+            if initialize and self.transport == "http":
+                self._spawn(self._listen_http())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if initialize:
+                self._exit(1, f"initialize failed: {e!r}")
+            elif request:
+                self._emit(json.dumps({"jsonrpc": "2.0", "id": request_id,
+                                       "error": {"code": -32603, "message": f"{self.transport} transport error: {e!r}"}}))
+            else:
+                logger.warning(f"[{self.target}] Could not deliver message to remote server: {e!r}")
+        finally:
+            sent.set()
+            if accepted is not None:
+                accepted.set()
+                if self._accepted.get(request_id) is accepted:
+                    del self._accepted[request_id]
+            self._pending -= 1
+            if self._pending < HTTP_MAX_PENDING:
+                self._capacity.set()
+
+    def _session_headers(self):
+        headers = {}
+        if self.session_id:
+            headers["Mcp-Session-Id"] = self.session_id
+        if self.protocol_version:
+            headers["MCP-Protocol-Version"] = self.protocol_version
+        return headers
+
+    def _emit(self, data, initialize=False):
+        """Queue a JSON-RPC body (one message or a batch) as stdout lines."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        data = data.strip()
+        if not data:
+            return
+        if initialize or data[:1] == b'[' or b'\n' in data:
+            try:
+                message = json.loads(data)
+            except ValueError:
+                logger.warning(f"[{self.target}] Ignoring non-JSON message from remote server: {data[:120]!r}")
+                return
+            messages = message if isinstance(message, list) else [message]
+            if initialize:
+                for msg in messages:
+                    version = (msg.get("result") or {}).get("protocolVersion") if isinstance(msg, dict) else None
+                    self.protocol_version = version or self.protocol_version
+            for msg in messages:
+                self.stdout.lines.put_nowait(json.dumps(msg, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+            return
+        self.stdout.lines.put_nowait(data + b'\n')
+
+    async def _listen_sse(self):
+        """Legacy SSE: read the event stream that announces the POST endpoint and carries every reply."""
+        try:
+            async with self.client.stream("GET", self.url, headers={"Accept": "text/event-stream"}) as response:
+                response.raise_for_status()
+                async for event, data in sse_events(response):
+                    if event == "endpoint":
+                        self.post_url = urljoin(self.url, data.strip())
+                        self._ready.set()
+                    elif event == "message":
+                        self._emit(data)
+            self._exit(1, "SSE stream closed by the server")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._exit(1, f"SSE stream failed: {e!r}")
+
+    async def _listen_http(self):
+        """Streamable HTTP: optional GET stream for requests and notifications the server starts."""
+        headers = {"Accept": "text/event-stream", **self._session_headers()}
+        try:
+            async with self.client.stream("GET", self.url, headers=headers) as response:
+                if response.status_code != 200 or not response.headers.get("content-type", "").startswith("text/event-stream"):
+                    return  # e.g. 405: the server offers no such stream
+                async for event, data in sse_events(response):
+                    if event == "message":
+                        self._emit(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"[{self.target}] Server message stream ended: {e!r}")
+
+    def _exit(self, code, reason=None):
+        if self.returncode is not None:
+            return
+        if reason:
+            logger.error(f"[{self.target}] {reason}")
+        self.returncode = code
+        current = asyncio.current_task()
+        for task in list(self._tasks):
+            if task is not current:
+                task.cancel()
+        self.stdout.lines.put_nowait(b'')
+        self._ready.set()
+        self._capacity.set()
+        self._closing = asyncio.get_running_loop().create_task(self._close(end_session=code == 0))
+
+    async def _close(self, end_session):
+        try:
+            if end_session and self.session_id:
+                with contextlib.suppress(Exception):
+                    await self.client.delete(self.url, headers=self._session_headers(), timeout=HTTP_CONNECT_TIMEOUT)
+            await self.client.aclose()
+        finally:
+            self._exited.set()
+
+    async def wait_for_capacity(self):
+        await self._capacity.wait()
+        if self.returncode is not None:
+            raise BrokenPipeError(f"remote server {self.target} session has ended")
+
+    def terminate(self):
+        self._exit(0)
+
+    def kill(self):
+        self._exit(-9)
+
+    async def wait(self):
+        await self._exited.wait()
+        return self.returncode
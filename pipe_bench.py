@@ -0,0 +1,1572 @@
+"""
+Benchmark for mcp_pipe.py: messages/sec and per-message latency.
+
+Runs a local WebSocket endpoint, starts `mcp_pipe.py` against it with a
+generated config of echo servers, and drives JSON-RPC requests through
+the pipe. The pipe is run as a separate process, so any revision of
+mcp_pipe.py can be measured (e.g. `git show HEAD~1:mcp_pipe.py > old.py`).
+
+Usage:
+    python pipe_bench.py                              # calculator + vnexpress payloads
+    python pipe_bench.py --payload vnexpress --messages 5000
+    python pipe_bench.py --payload articles --messages 300       # 1 MB tool results
+    python pipe_bench.py --pipe /tmp/old_mcp_pipe.py
+    python pipe_bench.py --servers 200 --messages 100 --check   # stress: all servers stream
+    python pipe_bench.py --server calculator.py --reconnects 3  # real server, warm reconnects
+    python pipe_bench.py --servers 4 --slow 1 --check           # latency next to a slow child
+    python pipe_bench.py --server calculator.py --servers 4 --inprocess --check   # in-process hosting, one script
+    python pipe_bench.py --servers 20 --restarts 4              # recovery after endpoint restarts
+    python pipe_bench.py --servers 10 --restarts 2 --outage 0.5 --check   # first retries are jittered
+    python pipe_bench.py --server calculator.py --batch 50      # JSON-RPC batches of 50 calls
+    python pipe_bench.py --gateway --servers 3 --messages 500 --check   # one socket, tools routed by prefix
+    python pipe_bench.py --server calculator.py --servers 8 --startup --forkserver   # time to first tools/list
+    python pipe_bench.py --payload vnexpress --ws-option compression=false   # wire bytes/CPU without deflate
+    python pipe_bench.py --concurrency 8 --service-time 0.01 --replicas 4    # 4 children behind one socket
+    python pipe_bench.py --concurrency 16 --service-time 0.01 --ping-interval 0.05   # pings during a burst
+    python pipe_bench.py --servers 4 --teardown 3 --healthy 2 --check   # restart a child that ignores SIGTERM
+    python pipe_bench.py --crash-every 500 --concurrency 4 --check   # children crash; the socket stays up
+    python pipe_bench.py --remote http --concurrency 4           # native streamable-HTTP client (--proxy: mcp_proxy)
+    python pipe_bench.py --server calculator.py --hibernate 2 --reconnects 2   # idle_timeout memory / cold call
+    python pipe_bench.py --endpoint 8765 --concurrency 4 --reconnects 2 --duration 60   # fake endpoint only;
+        MCP_ENDPOINT=ws://127.0.0.1:8765/ python mcp_pipe.py                 # run your own pipe/config against it
+    python pipe_bench.py --hang-every 100 --set request_timeout=0.5 --concurrency 4 --check   # unanswered calls time out
+    python pipe_bench.py --concurrency 64 --service-time 0.01 --set max_inflight=4 --set max_queue=4 --check   # overload: bounded p99
+    python pipe_bench.py --concurrency 8 --service-time 2 --set max_inflight=2 --set max_queue=2 --messages 8 --reconnects 1 --abandon --check   # abandoned calls free their slots
+    python pipe_bench.py --servers 4 --stderr-lines 20          # chatty children: pipe CPU for stderr
+    python pipe_bench.py --replay captures/calc.jsonl --target calc            # MCP_CAPTURE file, original pacing
+    python pipe_bench.py --replay captures/calc.jsonl --server calculator.py --speed 10
+    python pipe_bench.py --replay captures/calc.jsonl --target calc --speed 0 --concurrency 8   # max throughput
+"""
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import itertools
+import json
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+from websockets.asyncio.server import ServerConnection
+
+# Error responses are recognised by an "error" key this close to the start
+PEEK_ERROR_BYTES = 128
+
+# Representative tool-result sizes in bytes
+PAYLOADS = {
+    "calculator": 64,        # {"success": true, "result": 42}
+    "vnexpress": 16 * 1024,  # news list with titles, descriptions and links
+    "articles": 1024 * 1024,  # long article list / full article bodies
+}
+
+RESPONSE_ID = re.compile(r'"id"\s*:\s*("[^"]*"|-?\d+)')
+
+# Seconds a --slow child sleeps before reading each message
+SLOW_DELAY = 0.05
+
+# --check bounds for the other servers during --teardown: p99, and the worst
+# request (reaping the stubborn child on the event loop stalls it for seconds)
+TEARDOWN_P99 = 0.01
+TEARDOWN_MAX = 0.05
+
+# Seconds a replayed session waits for its last responses
+REPLAY_DRAIN_TIMEOUT = 30
+
+
+def sample_text(size):
+    """Deterministic news-like text of `size` characters (compresses like real tool output)."""
+    rng = random.Random(size)
+    words = ["tin", "tuc", "thoi", "su", "kinh", "te", "the", "gioi", "Viet", "Nam", "Ha", "Noi",
+             "https://vnexpress.net/", "title", "description", "2024", "nguoi", "dan", "chinh", "phu",
+             "bao", "cao", "thi", "truong", "gia", "vang", "tang", "giam", "trong", "ngay"]
+    text = []
+    length = 0
+    while length < size:
+        word = rng.choice(words) + (str(rng.randrange(100000)) if rng.random() < 0.2 else "")
+        text.append(word)
+        length += len(word) + 1
+    return " ".join(text)[:size]
+
+
+def run_echo_server(payload_size, delay=0.0, name="echo", crash_after=0, hang_every=0, stderr_lines=0):
+    """Minimal stdio MCP-like server: answer every request with a fixed-size result.
+
+    A non-zero `delay` makes the server sleep before reading each message,
+    simulating a child that is slow to drain its stdin. With `crash_after`
+    it exits with status 1 on reading its crash_after-th tools/call. With
+    `hang_every` every hang_every-th tools/call is never answered. Each
+    tools/call also logs `stderr_lines` lines to stderr, like a chatty scraper.
+    tools/list offers "echo" and "whoami", which answers with the server's `name`.
+    """
+    calls = 0
+    # Serialize the (possibly 1 MB) result once; only the id changes per reply
+    body = json.dumps({"content": [{"type": "text", "text": sample_text(payload_size)}]}).encode("utf-8")
+    whoami = json.dumps({"content": [{"type": "text", "text": name}]}).encode("utf-8")
+    tools = json.dumps({"tools": [{"name": tool, "inputSchema": {"type": "object"}}
+                                  for tool in ("echo", "whoami")]}).encode("utf-8")
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    while True:
+        if delay:
+            time.sleep(delay)
+        line = stdin.readline()
+        if not line:
+            break
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            continue
+        if "id" not in msg:
+            continue
+        if msg.get("method") == "tools/call":
+            calls += 1
+            if calls == crash_after:
+                os._exit(1)
+            if hang_every and calls % hang_every == 0:
+                continue
+            for i in range(stderr_lines):
+                sys.stderr.write(f"INFO {name}: fetched item {calls}.{i}\n")
+                sys.stderr.flush()
+        if msg.get("method") == "initialize":
+            result = json.dumps({"protocolVersion": msg["params"]["protocolVersion"], "capabilities": {},
+                                 "serverInfo": {"name": name, "version": "0"}}).encode("utf-8")
+        elif msg.get("method") == "tools/list":
+            result = tools
+        elif msg.get("method") == "tools/call" and msg["params"].get("name") == "whoami":
+            result = whoami
+        else:
+            result = body
+        stdout.write(b'{"jsonrpc": "2.0", "id": %s, "result": %s}\n'
+                     % (json.dumps(msg["id"]).encode("utf-8"), result))
+        stdout.flush()
+
+
+def run_remote_server(transport, port, payload_size):
+    """FastMCP server over `transport` ("http" or "sse") on 127.0.0.1:port whose calculator tool echoes a fixed text."""
+    from fastmcp import FastMCP
+
+    mcp = FastMCP("remote-echo")
+    text = sample_text(payload_size)
+
+    @mcp.tool()
+    def calculator(python_expression: str) -> str:
+        return text
+
+    mcp.run(transport=transport, host="127.0.0.1", port=port, show_banner=False, log_level="warning")
+
+
+async def wait_for_port(port, timeout=30):
+    """Wait until something accepts TCP connections on 127.0.0.1:port."""
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def response_id(frame):
+    """Read the id of a response without parsing a large result."""
+    match = RESPONSE_ID.search(frame[:128])
+    return json.loads(match.group(1)) if match else None
+
+
+def process_cpu_seconds(pid):
+    """User+system CPU time of a running process (Linux /proc), or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and all its descendants (Linux /proc), or None."""
+    try:
+        parents = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+        tree, frontier = {pid}, [pid]
+        while frontier:
+            parent = frontier.pop()
+            children = [p for p, pp in parents.items() if pp == parent]
+            tree.update(children)
+            frontier.extend(children)
+        total = 0
+        for p in tree:
+            try:
+                with open(f"/proc/{p}/statm") as f:
+                    total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            except (OSError, IndexError, ValueError):
+                continue
+        return total
+    except OSError:
+        return None
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def handshake(websocket):
+    """Run the MCP initialize handshake.
+
+    Returns (perf_counter time of the response, server name).
+    """
+    await websocket.send(json.dumps({
+        "jsonrpc": "2.0", "id": "init", "method": "initialize",
+        "params": {"protocolVersion": "2025-06-18", "capabilities": {},
+                   "clientInfo": {"name": "pipe_bench", "version": "0"}},
+    }))
+    async for frame in websocket:
+        response = json.loads(frame)
+        if response.get("id") == "init":
+            break
+    answered = time.perf_counter()
+    await websocket.send(json.dumps({"jsonrpc": "2.0", "method": "notifications/initialized"}))
+    return answered, ((response.get("result") or {}).get("serverInfo") or {}).get("name", "")
+
+
+async def flood(websocket, messages, misordered):
+    """Send `messages` 4 KB requests without waiting for replies (slow-child load).
+
+    The child answers in order, so replies that overtake an earlier request's
+    are appended to `misordered`.
+    """
+    async def discard():
+        last = -1
+        try:
+            async for frame in websocket:
+                frame_id = response_id(frame)
+                if isinstance(frame_id, str) and frame_id.startswith("flood-"):
+                    n = int(frame_id[len("flood-"):])
+                    if n < last:
+                        misordered.append(frame_id)
+                    last = max(last, n)
+        except websockets.exceptions.ConnectionClosed:
+            pass  # the pipe is stopped at the end of the case
+
+    reader = asyncio.create_task(discard())
+    padding = "p" * 4096
+    for i in range(messages):
+        await websocket.send(json.dumps({
+            "jsonrpc": "2.0", "id": f"flood-{i}", "method": "tools/call",
+            "params": {"name": "calculator", "arguments": {"python_expression": "1", "pad": padding}},
+        }))
+    await reader
+
+
+async def drive_connection(websocket, messages, concurrency, latencies, ping_interval=0, ping_latencies=None,
+                           errors=None, calls=None, served=None, abandon=False, first_id=0):
+    """Send `messages` tools/call requests with at most `concurrency` in flight.
+
+    Requests cycle through `calls`, a list of (tool, arguments), default a
+    calculator call. With `ping_interval`, a ping is also sent that often
+    and its round trip appended to `ping_latencies`. Ids answered with an
+    error are appended to `errors` (if given), the latencies of the others
+    also to `served`. Ids count up from `first_id`. With `abandon`, it
+    returns once the last request is sent, leaving up to `concurrency`
+    unanswered. Returns (first_response,
+    last_response) perf_counter timestamps.
+    """
+    sent_at = {}
+    pings_sent = {}
+    window = asyncio.Semaphore(concurrency)
+    done = asyncio.Event()
+    received = 0
+    first = None
+
+    async def reader():
+        nonlocal received, first
+        try:
+            async for frame in websocket:
+                frame_id = response_id(frame)
+                if frame_id in pings_sent:
+                    ping_latencies.append(time.perf_counter() - pings_sent.pop(frame_id))
+                    continue
+                started = sent_at.pop(frame_id, None)
+                if started is None:
+                    continue
+                now = time.perf_counter()
+                latencies.append(now - started)
+                if '"error"' in frame[:PEEK_ERROR_BYTES]:
+                    if errors is not None:
+                        errors.append(frame_id)
+                elif served is not None:
+                    served.append(now - started)
+                if first is None:
+                    first = now
+                received += 1
+                window.release()
+                if received == messages:
+                    return
+        finally:
+            # Also reached on disconnect, so the sender and a failed case can unwind
+            done.set()
+            window.release()
+
+    async def pinger():
+        for n in itertools.count():
+            await asyncio.sleep(ping_interval)
+            pings_sent[f"ping-{n}"] = time.perf_counter()
+            await websocket.send(json.dumps({"jsonrpc": "2.0", "id": f"ping-{n}", "method": "ping"}))
+
+    reader_task = asyncio.create_task(reader())
+    pinger_task = asyncio.create_task(pinger()) if ping_interval else None
+    for i in range(messages):
+        await window.acquire()
+        if done.is_set():
+            break
+        if calls:
+            tool, arguments = calls[i % len(calls)]
+        else:
+            tool, arguments = "calculator", {"python_expression": f"{i}+1"}
+        request_id = first_id + i
+        sent_at[request_id] = time.perf_counter()
+        await websocket.send(json.dumps({
+            "jsonrpc": "2.0", "id": request_id, "method": "tools/call", "params": {"name": tool, "arguments": arguments},
+        }))
+    if not abandon:
+        await done.wait()
+    reader_task.cancel()
+    if pinger_task is not None:
+        pinger_task.cancel()
+    return first, time.perf_counter()
+
+
+async def drive_batches(websocket, messages, batch, latencies):
+    """Send `messages` tools/call requests as JSON-RPC batches of `batch`, one batch at a time.
+
+    Each request's latency is its batch's round trip. Returns (first_response,
+    last_response) perf_counter timestamps.
+    """
+    first = None
+    for start in range(0, messages, batch):
+        ids = list(range(start, min(start + batch, messages)))
+        sent = time.perf_counter()
+        await websocket.send(json.dumps([{
+            "jsonrpc": "2.0", "id": i, "method": "tools/call",
+            "params": {"name": "calculator", "arguments": {"python_expression": f"{i}+1"}},
+        } for i in ids]))
+        async for frame in websocket:
+            if frame[:1] == "[":
+                break
+        now = time.perf_counter()
+        if [r.get("id") for r in json.loads(frame)] != ids:
+            raise RuntimeError("batch reply out of order or incomplete")
+        first = first or now
+        latencies.extend([now - sent] * len(ids))
+    return first, time.perf_counter()
+
+
+async def run_case(pipe_path, servers, messages, concurrency, payload_size,
+                   server_script=None, reconnects=0, slow=0, compression="deflate", inprocess=False,
+                   batch=0, ws_options=None, replicas=1, service_time=0.0, ping_interval=0, ping_latencies=None,
+                   crash_every=0, errors=None, standby=False, entry=None, hang_every=0, entry_options=None,
+                   stderr_lines=0, misordered=None, dropped=None, served=None, abandon=False):
+    """Run one benchmark case.
+
+    Returns (msgs_per_sec, latencies, spans, first_connects, reconnect_latencies,
+    pipe_cpu, rss, wire_bytes); first_connects and reconnect_latencies are connect-to-initialize-
+    response times in seconds, pipe_cpu is the pipe's CPU seconds and rss the
+    resident memory of the pipe plus its children at the end, wire_bytes the
+    bytes the endpoint received from the pipe. `ws_options` is written into
+    every config entry's "websocket" object. Each echo server takes
+    `service_time` seconds per request and runs as `replicas` children.
+    With `ping_interval`, ping round trips are appended to `ping_latencies`.
+    With `crash_every`, each echo server exits after that many calls (and is
+    expected to be respawned, from a warm standby with `standby`); ids
+    answered with an error go to `errors`. With `hang_every`, every
+    hang_every-th call is never answered by the echo server, which also
+    writes `stderr_lines` stderr lines per call. Latencies of calls answered
+    with a result also go to `served`; with `abandon`, every connection the
+    endpoint closes is closed with up to `concurrency` calls unanswered (ids
+    are not reused across connections, so those keep their slots until the
+    child answers). `entry`
+    replaces the echo server's stdio config entry (e.g. an "http" server)
+    and `entry_options` are added to it. `slow` extra
+    servers are flooded concurrently and excluded from the results; their
+    out-of-order replies go to `misordered`. Connections the pipe closes
+    during the handshake (e.g. 1011 from a server that failed to start)
+    are counted in `dropped`.
+    """
+    latencies = []
+    spans = []
+    first_connects = []
+    reconnect_latencies = []
+    sessions = servers * (reconnects + 1)
+    connections = 0
+    slow_connections = 0
+    finished = 0
+    wire_bytes = 0
+    all_connected = asyncio.Event()
+    all_done = asyncio.Event()
+
+    def check_all_connected():
+        # Start every workload together so the servers have to stream concurrently
+        if min(connections, servers) + slow_connections == servers + slow:
+            all_connected.set()
+
+    async def handler(websocket):
+        nonlocal connections, slow_connections, finished
+        accepted = time.perf_counter()
+        try:
+            answered, name = await handshake(websocket)
+        except websockets.exceptions.ConnectionClosed as e:
+            if dropped is not None:
+                dropped.append(e)
+            return
+        if name.startswith("slow"):
+            slow_connections += 1
+            check_all_connected()
+            await all_connected.wait()
+            await flood(websocket, messages, misordered if misordered is not None else [])
+            return
+        connections += 1
+        index = connections
+        (first_connects if index <= servers else reconnect_latencies).append(answered - accepted)
+        if index <= servers:
+            check_all_connected()
+            await all_connected.wait()
+        if batch:
+            spans.append(await drive_batches(websocket, messages, batch, latencies))
+        else:
+            spans.append(await drive_connection(websocket, messages, concurrency, latencies,
+                                                ping_interval, ping_latencies, errors, served=served,
+                                                abandon=abandon and index <= servers * reconnects,
+                                                first_id=(index - 1) * messages if abandon else 0))
+        finished += 1
+        if finished == sessions:
+            all_done.set()
+        if index <= servers * reconnects:
+            await websocket.close()  # the pipe reconnects and starts the next session
+            return
+        await websocket.wait_closed()
+
+    if server_script:
+        command = [sys.executable, os.path.abspath(server_script)]
+    else:
+        command = [sys.executable, os.path.abspath(__file__), "--echo", str(payload_size)]
+        if service_time:
+            command += ["--delay", str(service_time)]
+        if crash_every:
+            command += ["--crash-after", str(crash_every)]
+        if hang_every:
+            command += ["--hang-every", str(hang_every)]
+        if stderr_lines:
+            command += ["--stderr-lines", str(stderr_lines)]
+
+    class CountingConnection(ServerConnection):
+        def data_received(self, data):
+            nonlocal wire_bytes
+            wire_bytes += len(data)
+            super().data_received(data)
+
+    compression = None if compression == "none" else compression
+    async with websockets.serve(handler, "127.0.0.1", 0, max_size=None, compression=compression,
+                                create_connection=CountingConnection) as server:
+        port = server.sockets[0].getsockname()[1]
+        with tempfile.TemporaryDirectory() as tmp:
+            config_path = os.path.join(tmp, "mcp_config.json")
+            with open(config_path, "w", encoding="utf-8") as f:
+                config = {f"echo-{n}": dict(entry) if entry else {"type": "stdio", "command": command[0],
+                                                                  "args": command[1:], "inprocess": inprocess}
+                          for n in range(servers)}
+                for n in range(slow):
+                    config[f"slow-{n}"] = {
+                        "type": "stdio",
+                        "command": sys.executable,
+                        "args": [os.path.abspath(__file__), "--echo", str(payload_size),
+                                 "--delay", str(SLOW_DELAY), "--name", f"slow-{n}"],
+                    }
+                for name in list(config)[:servers]:
+                    config[name].update(entry_options or {})
+                    if replicas > 1:
+                        config[name]["replicas"] = replicas
+                    if standby:
+                        config[name]["standby"] = True
+                if ws_options:
+                    for server_entry in config.values():
+                        server_entry["websocket"] = ws_options
+                json.dump({"mcpServers": config}, f)
+            env = dict(os.environ, MCP_ENDPOINT=f"ws://127.0.0.1:{port}/", MCP_CONFIG=config_path)
+            pipe = await asyncio.create_subprocess_exec(
+                sys.executable, pipe_path, env=env, cwd=tmp,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+            )
+            try:
+                started = time.perf_counter()
+                await all_done.wait()
+                elapsed = time.perf_counter() - started
+            finally:
+                all_connected.set()
+                pipe_cpu = process_cpu_seconds(pipe.pid)
+                rss = process_tree_rss(pipe.pid)
+                pipe.terminate()
+                await pipe.wait()
+    # Throughput counts from first connection to last response (includes child startup)
+    total = sessions * messages
+    return total / elapsed, latencies, spans, first_connects, reconnect_latencies, pipe_cpu, rss, wire_bytes
+
+
+async def run_restarts(pipe_path, servers, restarts, outage, healthy):
+    """Restart the local endpoint `restarts` times with every server connected.
+
+    Each restart keeps the endpoint down for `outage` seconds after `healthy`
+    seconds of service. Returns one list per restart with the seconds from the
+    endpoint coming back to each server's reconnection, or None for a restart
+    that not every server recovered from within 10 minutes.
+    """
+    accepted = []  # perf_counter time of every accepted connection
+
+    async def handler(websocket):
+        accepted.append(time.perf_counter())
+        try:
+            await handshake(websocket)
+        except websockets.exceptions.ConnectionClosed:
+            return  # endpoint restarted mid-handshake
+        await websocket.wait_closed()
+
+    async def wait_for_connections(count, deadline):
+        while len(accepted) < count and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        return len(accepted) >= count
+
+    server = await websockets.serve(handler, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    recoveries = []
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "mcp_config.json")
+        with open(config_path, "w", encoding="utf-8") as f:
+            command = [sys.executable, os.path.abspath(__file__), "--echo", "64"]
+            json.dump({"mcpServers": {f"echo-{n}": {"command": command[0], "args": command[1:]}
+                                      for n in range(servers)}}, f)
+        # A session as long as the healthy period counts as stable, where the pipe supports it
+        env = dict(os.environ, MCP_ENDPOINT=f"ws://127.0.0.1:{port}/", MCP_CONFIG=config_path,
+                   MCP_RECONNECT_STABLE_AFTER=str(healthy / 2))
+        pipe = await asyncio.create_subprocess_exec(
+            sys.executable, pipe_path, env=env, cwd=tmp,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            await wait_for_connections(servers, time.perf_counter() + 60)
+            for _ in range(restarts):
+                await asyncio.sleep(healthy)
+                server.close()
+                await server.wait_closed()
+                await asyncio.sleep(outage)
+                before = len(accepted)
+                restarted = time.perf_counter()
+                server = await websockets.serve(handler, "127.0.0.1", port)
+                if await wait_for_connections(before + servers, restarted + 600):
+                    recoveries.append([t - restarted for t in accepted[before:before + servers]])
+                else:
+                    recoveries.append(None)
+                    break
+        finally:
+            server.close()
+            pipe.terminate()
+            await pipe.wait()
+    return recoveries
+
+
+async def run_startup(pipe_path, servers, server_script):
+    """Start the pipe with `servers` copies of a server and time each one's first tools/list.
+
+    Returns seconds from launching the pipe to each server's tools/list
+    response, so interpreter start, imports and the handshake are included.
+    """
+    answered = []
+    all_answered = asyncio.Event()
+
+    async def handler(websocket):
+        await handshake(websocket)
+        await websocket.send(json.dumps({"jsonrpc": "2.0", "id": "tools", "method": "tools/list", "params": {}}))
+        async for frame in websocket:
+            if response_id(frame) == "tools":
+                break
+        answered.append(time.perf_counter() - launched)
+        if len(answered) == servers:
+            all_answered.set()
+        await websocket.wait_closed()
+
+    if server_script:
+        command = [sys.executable, os.path.abspath(server_script)]
+    else:
+        command = [sys.executable, os.path.abspath(__file__), "--echo", "64"]
+    async with websockets.serve(handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        with tempfile.TemporaryDirectory() as tmp:
+            config_path = os.path.join(tmp, "mcp_config.json")
+            with open(config_path, "w", encoding="utf-8") as f:
+                json.dump({"mcpServers": {f"server-{n}": {"command": command[0], "args": command[1:]}
+                                          for n in range(servers)}}, f)
+            env = dict(os.environ, MCP_ENDPOINT=f"ws://127.0.0.1:{port}/", MCP_CONFIG=config_path)
+            launched = time.perf_counter()
+            pipe = await asyncio.create_subprocess_exec(
+                sys.executable, pipe_path, env=env, cwd=tmp,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+            )
+            try:
+                await all_answered.wait()
+            finally:
+                pipe.terminate()
+                await pipe.wait()
+    return answered
+
+
+async def run_gateway(pipe_path, servers, messages):
+    """Drive `servers` echo servers through the pipe's gateway (`--gateway`) on one connection.
+
+    Checks initialize, the namespaced tools/list, that a tools/call reaches
+    the server its name's prefix names, an unknown tool, a batch and
+    malformed messages (answered with an error, or ignored, without
+    closing the connection). Returns (failures, latencies): a line per
+    failed check and the round trips of `messages` tools/call requests.
+    """
+    failures = []
+    latencies = []
+    finished = asyncio.Event()
+
+    def expect(ok, what, reply):
+        if not ok:
+            failures.append(f"{what}: {json.dumps(reply)[:200]}")
+
+    def call(request_id, tool, arguments=None):
+        return {"jsonrpc": "2.0", "id": request_id, "method": "tools/call",
+                "params": {"name": tool, "arguments": arguments or {}}}
+
+    async def handler(websocket):
+        async def rpc(payload):
+            """Send one message (or batch) and return the next reply, skipping notifications."""
+            await websocket.send(json.dumps(payload))
+            while True:
+                reply = json.loads(await websocket.recv())
+                if isinstance(reply, list) or "method" not in reply:
+                    return reply
+
+        try:
+            reply = await rpc({"jsonrpc": "2.0", "id": "init", "method": "initialize",
+                               "params": {"protocolVersion": "2025-06-18", "capabilities": {},
+                                          "clientInfo": {"name": "pipe_bench", "version": "0"}}})
+            name = ((reply.get("result") or {}).get("serverInfo") or {}).get("name")
+            expect(name == "mcp_pipe-gateway", "initialize", reply)
+            await websocket.send(json.dumps({"jsonrpc": "2.0", "method": "notifications/initialized"}))
+            reply = await rpc({"jsonrpc": "2.0", "id": "list", "method": "tools/list", "params": {}})
+            listed = sorted(tool["name"] for tool in (reply.get("result") or {}).get("tools", []))
+            expect(listed == sorted(f"echo-{n}__{tool}" for n in range(servers) for tool in ("echo", "whoami")),
+                   "tools/list is not every server's tools under <server>__", reply)
+            for n in range(servers):
+                reply = await rpc(call(f"who-{n}", f"echo-{n}__whoami"))
+                text = ((reply.get("result") or {}).get("content") or [{}])[0].get("text")
+                expect(reply.get("id") == f"who-{n}" and text == f"echo-{n}", f"echo-{n}__whoami routed elsewhere",
+                       reply)
+            reply = await rpc(call("unknown", "nosuch__echo"))
+            expect((reply.get("error") or {}).get("code") == -32602, "unknown tool", reply)
+            reply = await rpc([call("b1", "echo-0__echo"), {"jsonrpc": "2.0", "id": "b2", "method": "ping"},
+                               {"jsonrpc": "2.0", "method": "notifications/initialized"},
+                               call("b3", "nosuch__echo")])
+            replies = {item.get("id"): item for item in reply} if isinstance(reply, list) else {}
+            expect(sorted(replies) == ["b1", "b2", "b3"] and "result" in replies["b1"] and "result" in replies["b2"]
+                   and "error" in replies["b3"], "batch", reply)
+            reply = await rpc({"jsonrpc": "2.0", "id": [1], "method": "ping"})
+            expect((reply.get("error") or {}).get("code") == -32600, "request with an unusable id", reply)
+            reply = await rpc({"jsonrpc": "2.0", "id": "params", "method": "tools/call", "params": [1]})
+            expect((reply.get("error") or {}).get("code") == -32602, "params that are not an object", reply)
+            await websocket.send(json.dumps({"jsonrpc": "2.0", "id": [1], "result": {}}))  # a response: no reply
+            reply = await rpc({"jsonrpc": "2.0", "id": "alive", "method": "ping"})
+            expect(reply.get("id") == "alive" and "result" in reply, "ping after a malformed response", reply)
+            for i in range(messages):
+                sent = time.perf_counter()
+                reply = await rpc(call(i, f"echo-{i % servers}__echo"))
+                latencies.append(time.perf_counter() - sent)
+                expect(reply.get("id") == i and "result" in reply, f"call {i}", reply)
+        except websockets.exceptions.ConnectionClosed as e:
+            failures.append(f"connection closed by the pipe: {e}")
+        finished.set()
+        await websocket.wait_closed()
+
+    command = [sys.executable, os.path.abspath(__file__), "--echo", "64"]
+    async with websockets.serve(handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        with tempfile.TemporaryDirectory() as tmp:
+            config_path = os.path.join(tmp, "mcp_config.json")
+            with open(config_path, "w", encoding="utf-8") as f:
+                json.dump({"mcpServers": {f"echo-{n}": {"command": command[0],
+                                                        "args": command[1:] + ["--name", f"echo-{n}"]}
+                                          for n in range(servers)}}, f)
+            env = dict(os.environ, MCP_ENDPOINT=f"ws://127.0.0.1:{port}/", MCP_CONFIG=config_path)
+            pipe = await asyncio.create_subprocess_exec(
+                sys.executable, pipe_path, "--gateway", env=env, cwd=tmp,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+            )
+            try:
+                await finished.wait()
+            finally:
+                pipe.terminate()
+                await pipe.wait()
+    return failures, latencies
+
+
+async def run_teardown(pipe_path, servers, restarts, interval):
+    """Restart a server that ignores SIGTERM `restarts` times while `servers` echo servers stream.
+
+    Each restart is a config edit (new env) picked up by hot reload, one
+    every `interval` seconds. Returns (latencies of the other servers'
+    requests before the first edit, their latencies from then on, seconds
+    from each config edit to the stubborn server's new connection).
+    """
+    latencies = []
+    recoveries = []
+    connections = 0
+    stubborn_connected = asyncio.Queue()
+    all_connected = asyncio.Event()
+    stop = asyncio.Event()
+
+    async def handler(websocket):
+        nonlocal connections
+        try:
+            _, name = await handshake(websocket)
+            if name == "stubborn":
+                stubborn_connected.put_nowait(time.perf_counter())
+            else:
+                connections += 1
+                if connections == servers:
+                    all_connected.set()
+                await all_connected.wait()
+                for i in itertools.count():
+                    if stop.is_set():
+                        break
+                    sent = time.perf_counter()
+                    await websocket.send(json.dumps({
+                        "jsonrpc": "2.0", "id": i, "method": "tools/call",
+                        "params": {"name": "calculator", "arguments": {"python_expression": f"{i}+1"}},
+                    }))
+                    async for frame in websocket:
+                        if response_id(frame) == i:
+                            break
+                    latencies.append(time.perf_counter() - sent)
+                    await asyncio.sleep(0.001)
+            await websocket.wait_closed()
+        except websockets.exceptions.ConnectionClosed:
+            pass  # the pipe is stopped at the end of the run
+
+    echo = [sys.executable, os.path.abspath(__file__), "--echo", "64"]
+
+    def write_config(generation):
+        config = {f"echo-{n}": {"command": echo[0], "args": echo[1:]} for n in range(servers)}
+        config["stubborn"] = {"command": echo[0], "args": echo[1:] + ["--name", "stubborn", "--ignore-term"],
+                              "env": {"GENERATION": str(generation)}}
+        tmp_path = config_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"mcpServers": config}, f)
+        os.replace(tmp_path, config_path)
+
+    async with websockets.serve(handler, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        with tempfile.TemporaryDirectory() as tmp:
+            config_path = os.path.join(tmp, "mcp_config.json")
+            write_config(0)
+            env = dict(os.environ, MCP_ENDPOINT=f"ws://127.0.0.1:{port}/", MCP_CONFIG=config_path,
+                       MCP_CONFIG_WATCH_INTERVAL="0.1")
+            pipe = await asyncio.create_subprocess_exec(
+                sys.executable, pipe_path, env=env, cwd=tmp,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+            )
+            try:
+                await all_connected.wait()
+                await stubborn_connected.get()
+                quiet = None
+                for generation in range(1, restarts + 1):
+                    await asyncio.sleep(interval)
+                    if quiet is None:
+                        quiet = len(latencies)
+                    edited = time.perf_counter()
+                    write_config(generation)
+                    recoveries.append(await stubborn_connected.get() - edited)
+                stop.set()
+            finally:
+                pipe.terminate()
+                await pipe.wait()
+    return latencies[:quiet], latencies[quiet:], recoveries
+
+
+def jsonrpc_messages(frame):
+    """The JSON-RPC messages in a frame (a batch holds several); [] if it is not JSON."""
+    try:
+        message = json.loads(frame)
+    except ValueError:
+        return []
+    messages = message if isinstance(message, list) else [message]
+    return [m for m in messages if isinstance(m, dict)]
+
+
+def request_key(message):
+    """Report label of a request: its method, plus the tool name for tools/call."""
+    method = message.get("method", "?")
+    if method == "tools/call":
+        return f"tools/call {(message.get('params') or {}).get('name')}"
+    return method
+
+
+def load_capture(path):
+    """Read an MCP_CAPTURE file.
+
+    Returns (sessions, recorded, client_replies): each session is the list
+    of (seconds since its connect, direction, frame) of one recorded
+    connection, recorded maps a request_key() to the request -> response
+    times seen in production, and client_replies maps a method the server
+    called to the endpoint's recorded answer.
+    """
+    sessions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("event") == "connect" or not sessions:
+                sessions.append((record["t"], []))
+            if "frame" in record:
+                sessions[-1][1].append((record["t"] - sessions[-1][0], record["dir"], record["frame"]))
+    sessions = [frames for _, frames in sessions if any(d == "in" for _, d, _ in frames)]
+
+    recorded = collections.defaultdict(list)
+    client_replies = {}
+    for frames in sessions:
+        requests = {"in": {}, "out": {}}  # requests by the endpoint ("in") and by the server ("out")
+        for offset, direction, frame in frames:
+            for message in jsonrpc_messages(frame):
+                if "method" in message:
+                    if "id" in message:
+                        requests[direction][message["id"]] = (offset, message)
+                    continue
+                request = requests["out" if direction == "in" else "in"].pop(message.get("id"), None)
+                if request is None:
+                    continue
+                if direction == "out":
+                    recorded[request_key(request[1])].append(offset - request[0])
+                else:
+                    client_replies[request[1]["method"]] = message
+    return sessions, recorded, client_replies
+
+
+async def replay_session(websocket, frames, speed, concurrency, client_replies, results):
+    """Send a recorded session's endpoint -> pipe frames and time each request.
+
+    With `speed` > 0 frames go out at their recorded offsets divided by
+    `speed`; with 0 as fast as at most `concurrency` requests in flight
+    allow. Recorded ids are reused, responses the endpoint sent to the
+    server are left out and the server's own requests are answered with the
+    recorded reply for that method. Every request waits for the initialize
+    response, and paced frames after it keep their recorded distance from
+    it. `results` maps a request_key() to {"latencies", "errors",
+    "cancelled", "unanswered"}. Returns seconds from the first frame to the
+    last response.
+    """
+    pending = {}  # id -> (sent perf_counter, key)
+    slot_free = asyncio.Event()
+    drained = asyncio.Event()
+    initialized = asyncio.Event()
+    init_id = None
+    init_answered = None
+    sending = True
+
+    async def reader():
+        nonlocal init_answered
+        async for frame in websocket:
+            for message in jsonrpc_messages(frame):
+                if "method" in message:
+                    if "id" in message:
+                        reply = client_replies.get(message["method"]) or {
+                            "error": {"code": -32601, "message": "Method not found in capture"}}
+                        answer = {"jsonrpc": "2.0", "id": message["id"]}
+                        answer.update((k, v) for k, v in reply.items() if k in ("result", "error"))
+                        await websocket.send(json.dumps(answer))
+                    continue
+                request_id = message.get("id")
+                entry = pending.pop(request_id, None)
+                if entry is None:
+                    continue
+                sent, key = entry
+                results[key]["latencies"].append(time.perf_counter() - sent)
+                if "error" in message:
+                    results[key]["errors"] += 1
+                if request_id == init_id:
+                    init_answered = time.perf_counter()
+                    initialized.set()
+                slot_free.set()
+                if not pending and not sending:
+                    drained.set()
+
+    reader_task = asyncio.create_task(reader())
+    started = first = time.perf_counter()
+    try:
+        for offset, direction, frame in frames:
+            messages = jsonrpc_messages(frame)
+            if direction != "in" or not any("method" in m for m in messages):
+                continue
+            if speed:
+                await asyncio.sleep(max(0.0, started + offset / speed - time.perf_counter()))
+            if init_id is not None and not initialized.is_set():
+                await initialized.wait()
+                if speed:
+                    # Keep the recorded gaps after the handshake even if the server starts slower or faster
+                    recorded = next((o for o, d, f in frames if d == "out" and response_id(f) == init_id), None)
+                    if recorded is not None:
+                        started = init_answered - recorded / speed
+            while not speed and len(pending) >= concurrency:
+                slot_free.clear()
+                await slot_free.wait()
+            now = time.perf_counter()
+            for message in messages:
+                if "method" not in message:
+                    continue
+                if "id" in message:
+                    pending[message["id"]] = (now, request_key(message))
+                    if message["method"] == "initialize":
+                        init_id = message["id"]
+                elif message["method"] == "notifications/cancelled":
+                    entry = pending.pop((message.get("params") or {}).get("requestId"), None)
+                    if entry is not None:
+                        results[entry[1]]["cancelled"] += 1
+            await websocket.send(frame)
+        sending = False
+        if pending:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(drained.wait(), REPLAY_DRAIN_TIMEOUT)
+        for _, key in pending.values():
+            results[key]["unanswered"] += 1
+        return time.perf_counter() - first
+    finally:
+        reader_task.cancel()
+
+
+async def run_replay(pipe_path, sessions, target, entry, cwd, speed, concurrency, client_replies, ws_config=None):
+    """Replay recorded sessions through the pipe against one configured server.
+
+    Each session gets its own WebSocket connection, closed afterwards so the
+    pipe reconnects for the next. The pipe runs with `cwd` as its working
+    directory, so relative paths in `entry` resolve as in production.
+    Returns (results as in replay_session(), seconds spent replaying).
+    """
+    results = collections.defaultdict(lambda: {"latencies": [], "errors": 0, "cancelled": 0, "unanswered": 0})
+    remaining = collections.deque(sessions)
+    replayed = 0.0
+    finished = asyncio.Event()
+
+    async def handler(websocket):
+        nonlocal replayed
+        if not remaining:
+            await websocket.wait_closed()
+            return
+        frames = remaining.popleft()
+        replayed += await replay_session(websocket, frames, speed, concurrency, client_replies, results)
+        if not remaining:
+            finished.set()
+        await websocket.close()
+
+    async with websockets.serve(handler, "127.0.0.1", 0, max_size=None) as server:
+        port = server.sockets[0].getsockname()[1]
+        with tempfile.TemporaryDirectory() as tmp:
+            config_path = os.path.join(tmp, "mcp_config.json")
+            with open(config_path, "w", encoding="utf-8") as f:
+                json.dump({"mcpServers": {target: entry}, **({"websocket": ws_config} if ws_config else {})}, f)
+            env = dict(os.environ, MCP_ENDPOINT=f"ws://127.0.0.1:{port}/", MCP_CONFIG=config_path)
+            env.pop("MCP_CAPTURE", None)  # do not record the replay over the capture
+            pipe = await asyncio.create_subprocess_exec(
+                sys.executable, pipe_path, env=env, cwd=cwd,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+            )
+            try:
+                await finished.wait()
+            finally:
+                pipe.terminate()
+                await pipe.wait()
+    return results, replayed
+
+
+def replay(args):
+    """--replay: drive a capture through the pipe and print latency per method next to the recorded one."""
+    sessions, recorded, client_replies = load_capture(args.replay)
+    if not sessions:
+        print(f"{args.replay}: no frames from the endpoint to replay")
+        sys.exit(1)
+    target = args.target or os.path.splitext(os.path.basename(args.replay))[0]
+    ws_config = None
+    if args.server:
+        entry = {"command": sys.executable, "args": [os.path.abspath(args.server)]}
+        cwd = os.getcwd()
+    else:
+        config_path = os.path.abspath(os.environ.get("MCP_CONFIG") or "mcp_config.json")
+        try:
+            with open(config_path, encoding="utf-8") as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Cannot read {config_path}: {e}")
+            sys.exit(1)
+        entry = (config.get("mcpServers") or {}).get(target)
+        if entry is None:
+            print(f"No server '{target}' in {config_path}; pass --target NAME or --server SCRIPT")
+            sys.exit(1)
+        ws_config = config.get("websocket")
+        cwd = os.path.dirname(config_path)
+
+    try:
+        results, elapsed = asyncio.run(asyncio.wait_for(
+            run_replay(args.pipe, sessions, target, entry, cwd, args.speed, args.concurrency,
+                       client_replies, ws_config),
+            timeout=args.timeout,
+        ))
+    except asyncio.TimeoutError:
+        print(f"replay: timed out after {args.timeout:.0f}s")
+        sys.exit(1)
+
+    pacing = f"{args.speed:g}x pacing" if args.speed else f"max throughput, concurrency {args.concurrency}"
+    answered = sum(len(r["latencies"]) for r in results.values())
+    print(f"replay of {args.replay} against {target} ({len(sessions)} sessions, {pacing}): "
+          f"{answered} responses in {elapsed:.2f} s ({answered / elapsed:.0f} req/s)")
+    print(f"{'request':<32} {'count':>6} {'errors':>6} {'lost':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}"
+          f"   {'recorded p50':>12} {'p99':>9}")
+    everything = {"latencies": [], "errors": 0, "cancelled": 0, "unanswered": 0}
+    all_recorded = []
+    rows = sorted(results.items(), key=lambda item: -len(item[1]["latencies"]))
+    for key, result in rows + [("all", everything)]:
+        if key == "all":
+            before = all_recorded
+        else:
+            for field in everything:
+                everything[field] += result[field]
+            before = recorded.get(key, [])
+            all_recorded.extend(before)
+        latencies = result["latencies"]
+        print(f"{key[:32]:<32} {len(latencies):>6} {result['errors']:>6} "
+              f"{result['cancelled'] + result['unanswered']:>5} "
+              f"{percentile(latencies, 50) * 1e3:>9.3f} {percentile(latencies, 90) * 1e3:>9.3f} "
+              f"{percentile(latencies, 99) * 1e3:>9.3f}   "
+              + (f"{percentile(before, 50) * 1e3:>12.3f} {percentile(before, 99) * 1e3:>9.3f}" if before else
+                 f"{'-':>12} {'-':>9}"))
+
+
+async def run_endpoint(host, port, messages, concurrency, calls, reconnects, duration, servers):
+    """Stand in for the remote MCP endpoint: serve whatever pipes connect to ws://host:port/.
+
+    Every connection gets the initialize handshake and a tools/list, then
+    `messages` tools/call requests (cycling through those `calls` the server
+    lists) with `concurrency` in flight. The endpoint closes each server's
+    first `reconnects` connections after their workload to time the pipe's
+    reconnect. Connections are told apart by serverInfo name; copies of one
+    server get "#2", "#3", ... in connection order. Runs for `duration`
+    seconds (0: until interrupted) and fills `servers`, a dict of name ->
+    {"sessions", "latencies", "errors", "busy", "connects", "reconnects",
+    "gaps", "closed_at", "connected"}.
+    """
+
+    async def handler(websocket):
+        accepted = time.perf_counter()
+        answered, name = await handshake(websocket)
+        name = name or "server"
+        slot = name
+        for n in itertools.count(2):
+            if not servers.get(slot, {}).get("connected"):
+                break
+            slot = f"{name}#{n}"
+        server = servers.setdefault(slot, {"sessions": 0, "latencies": [], "errors": [], "busy": 0.0, "connects": [],
+                                           "reconnects": [], "gaps": [], "closed_at": None, "connected": False})
+        server["connected"] = True
+        server["sessions"] += 1
+        if server["closed_at"] is None:
+            server["connects"].append(answered - accepted)
+        else:
+            server["reconnects"].append(answered - accepted)
+            server["gaps"].append(accepted - server["closed_at"])
+        try:
+            await websocket.send(json.dumps({"jsonrpc": "2.0", "id": "tools", "method": "tools/list", "params": {}}))
+            async for frame in websocket:
+                if response_id(frame) == "tools":
+                    break
+            listed = (json.loads(frame).get("result") or {}).get("tools")
+            offered = calls
+            if calls and listed is not None:
+                names = {tool.get("name") for tool in listed}
+                offered = [call for call in calls if call[0] in names]
+            if offered or not calls:
+                first, last = await drive_connection(websocket, messages, concurrency, server["latencies"],
+                                                     errors=server["errors"], calls=offered)
+                if first is not None:
+                    server["busy"] += last - first
+                print(f"[{slot}] session {server['sessions']}: {messages} calls done", file=sys.stderr)
+            else:
+                print(f"[{slot}] lists none of the --call tools; idle", file=sys.stderr)
+            if server["sessions"] <= reconnects:
+                await websocket.close()  # the pipe reconnects and starts the next session
+            else:
+                await websocket.wait_closed()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            server["connected"] = False
+            server["closed_at"] = time.perf_counter()
+
+    async with websockets.serve(handler, host, port, max_size=None):
+        print(f"Fake MCP endpoint on ws://{host}:{port}/ - run e.g.\n"
+              f"    MCP_ENDPOINT=ws://{host}:{port}/ python mcp_pipe.py", file=sys.stderr)
+        if duration:
+            await asyncio.sleep(duration)
+        else:
+            await asyncio.Event().wait()
+
+
+def report_endpoint(servers, elapsed):
+    """Print per-server throughput, latency, reconnect timings and fairness of an --endpoint run."""
+    total = sum(len(server["latencies"]) for server in servers.values())
+    print(f"endpoint: {len(servers)} servers, {total} responses in {elapsed:.1f} s ({total / elapsed:.0f} req/s)")
+    print(f"{'server':<24} {'sessions':>8} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}"
+          f" {'connect ms':>10} {'reconnect ms':>12} {'gap s':>7}")
+    rates = []
+    for name, server in sorted(servers.items()):
+        latencies = server["latencies"]
+        rate = len(latencies) / server["busy"] if server["busy"] else 0.0
+        if latencies:
+            rates.append(rate)
+        reconnect = (f"{percentile(server['reconnects'], 50) * 1e3:>12.1f}" if server["reconnects"] else f"{'-':>12}")
+        gap = f"{percentile(server['gaps'], 50):>7.2f}" if server["gaps"] else f"{'-':>7}"
+        connect = f"{percentile(server['connects'], 50) * 1e3:>10.1f}" if server["connects"] else f"{'-':>10}"
+        print(f"{name[:24]:<24} {server['sessions']:>8} {len(latencies):>8} {len(server['errors']):>6} {rate:>8.0f} "
+              f"{percentile(latencies, 50) * 1e3:>8.3f} {percentile(latencies, 99) * 1e3:>8.3f} "
+              f"{connect} {reconnect} {gap}")
+    if len(rates) > 1:
+        print(f"fairness over per-server req/s: Jain {jain_index(rates):.3f}, slowest/fastest "
+              f"{min(rates) / max(rates):.2f}")
+
+
+def jain_index(values):
+    """Jain's fairness index: 1.0 when all values are equal, 1/n when one gets everything."""
+    if not any(values):
+        return 1.0
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+async def run_hibernate(pipe_path, server_script, idle, rounds):
+    """Let one server hibernate `rounds` times and time the call that wakes it.
+
+    Returns a list of dicts per round: RSS of the pipe and its children with
+    the child warm and hibernating, latency of a warm call, of tools/list
+    and a reconnect's initialize while hibernating, and of the waking call.
+    """
+    results = []
+    connected = asyncio.Queue()
+
+    async def handler(websocket):
+        accepted = time.perf_counter()
+        answered, _ = await handshake(websocket)
+        await connected.put((websocket, answered - accepted))
+        with contextlib.suppress(websockets.exceptions.ConnectionClosed):
+            await websocket.wait_closed()
+
+    async def call(websocket, request_id, method="tools/call"):
+        params = {"name": "calculator", "arguments": {"python_expression": "1+1"}} if method == "tools/call" else {}
+        sent = time.perf_counter()
+        await websocket.send(json.dumps({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}))
+        async for frame in websocket:
+            if response_id(frame) == request_id:
+                if '"error"' in frame[:PEEK_ERROR_BYTES]:
+                    raise RuntimeError(f"{method} failed: {frame[:200]}")
+                return time.perf_counter() - sent
+
+    if server_script:
+        command = [sys.executable, os.path.abspath(server_script)]
+    else:
+        command = [sys.executable, os.path.abspath(__file__), "--echo", "64"]
+    async with websockets.serve(handler, "127.0.0.1", 0, max_size=None) as server:
+        port = server.sockets[0].getsockname()[1]
+        with tempfile.TemporaryDirectory() as tmp:
+            config_path = os.path.join(tmp, "mcp_config.json")
+            with open(config_path, "w", encoding="utf-8") as f:
+                json.dump({"mcpServers": {"idle": {"command": command[0], "args": command[1:],
+                                                   "idle_timeout": idle}}}, f)
+            env = dict(os.environ, MCP_ENDPOINT=f"ws://127.0.0.1:{port}/", MCP_CONFIG=config_path)
+            pipe = await asyncio.create_subprocess_exec(
+                sys.executable, pipe_path, env=env, cwd=tmp,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+            )
+            try:
+                websocket, _ = await connected.get()
+                await call(websocket, "list-0", "tools/list")
+                for n in range(rounds):
+                    for i in range(20):
+                        warm = await call(websocket, f"warm-{n}-{i}")
+                    warm_rss = process_tree_rss(pipe.pid)
+                    await asyncio.sleep(idle + 1)
+                    idle_rss = process_tree_rss(pipe.pid)
+                    listed = await call(websocket, f"list-{n + 1}", "tools/list")
+                    await websocket.close()  # a reconnect is answered from the snapshot too
+                    websocket, reconnect = await connected.get()
+                    cold = await call(websocket, f"cold-{n}")
+                    results.append({"warm_rss": warm_rss, "idle_rss": idle_rss, "warm": warm, "list": listed,
+                                    "reconnect": reconnect, "cold": cold})
+            finally:
+                pipe.terminate()
+                await pipe.wait()
+    return results
+
+
+def peak_in_window(times, window):
+    """Most events within any `window` seconds."""
+    times = sorted(times)
+    peak = start = 0
+    for end in range(len(times)):
+        while times[end] - times[start] > window:
+            start += 1
+        peak = max(peak, end - start + 1)
+    return peak
+
+
+def peak_overlap(spans):
+    """Largest number of servers whose first..last response windows overlap."""
+    events = sorted([(start, 1) for start, _ in spans] + [(end, -1) for _, end in spans])
+    peak = current = 0
+    for _, delta in events:
+        current += delta
+        peak = max(peak, current)
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mcp_pipe.py throughput and latency")
+    parser.add_argument("--pipe", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "mcp_pipe.py"),
+                        help="mcp_pipe.py revision to benchmark")
+    parser.add_argument("--payload", action="append",
+                        help="payload preset (calculator, vnexpress) or size in bytes; repeatable")
+    parser.add_argument("--servers", type=int, default=1, help="number of echo servers")
+    parser.add_argument("--messages", type=int, default=2000, help="requests per server")
+    parser.add_argument("--concurrency", type=int, default=1, help="in-flight requests per server")
+    parser.add_argument("--batch", type=int, default=0,
+                        help="send requests as JSON-RPC batches of this size, one batch in flight")
+    parser.add_argument("--server", metavar="SCRIPT",
+                        help="benchmark a real server script (e.g. calculator.py) instead of the echo server")
+    parser.add_argument("--reconnects", type=int, default=0,
+                        help="close and re-accept each connection this many times")
+    parser.add_argument("--slow", type=int, default=0,
+                        help="extra servers that read stdin slowly and are flooded during the run")
+    parser.add_argument("--inprocess", action="store_true",
+                        help="host --server in-process instead of as a subprocess")
+    parser.add_argument("--compression", choices=["deflate", "none"], default="deflate",
+                        help="permessage-deflate offered by the local endpoint")
+    parser.add_argument("--ws-option", action="append", default=[], metavar="KEY=VALUE",
+                        help='per-server "websocket" config option, VALUE as JSON (e.g. compression=false); repeatable')
+    parser.add_argument("--replicas", type=int, default=1, help='"replicas" for every benchmarked server')
+    parser.add_argument("--service-time", type=float, default=0.0,
+                        help="seconds each echo server spends on a request")
+    parser.add_argument("--ping-interval", type=float, default=0,
+                        help="also send a ping this often (seconds) during the run and report its round trip")
+    parser.add_argument("--crash-every", type=int, default=0, metavar="N",
+                        help="echo servers exit after every N calls; reports errors and reconnects")
+    parser.add_argument("--standby", action="store_true", help='run every server with "standby": true')
+    parser.add_argument("--hang-every", type=int, default=0, metavar="N",
+                        help="echo servers never answer every N-th call; use with --set request_timeout=...")
+    parser.add_argument("--abandon", action="store_true",
+                        help="with --reconnects, close each connection with its last calls unanswered")
+    parser.add_argument("--stderr-lines", type=int, default=0, metavar="N",
+                        help="echo servers write N stderr lines per call (see MCP_STDERR_RATE)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra config entry key for every benchmarked server, VALUE as JSON; repeatable")
+    parser.add_argument("--remote", choices=["http", "sse"],
+                        help="benchmark a local FastMCP server over streamable HTTP / SSE instead of stdio echo servers")
+    parser.add_argument("--proxy", action="store_true",
+                        help='with --remote, set "proxy": true (python -m mcp_proxy child instead of the native client)')
+    parser.add_argument("--restarts", type=int, default=0,
+                        help="instead of throughput, restart the endpoint this many times and time recovery")
+    parser.add_argument("--outage", type=float, default=3, help="seconds the endpoint is down per restart")
+    parser.add_argument("--healthy", type=float, default=10, help="seconds of service between restarts")
+    parser.add_argument("--gateway", action="store_true",
+                        help="run the pipe as a gateway over --servers echo servers and check its routing")
+    parser.add_argument("--startup", action="store_true",
+                        help="instead of throughput, time each server's first tools/list after pipe launch")
+    parser.add_argument("--forkserver", action="store_true",
+                        help="run the pipe with MCP_FORKSERVER=1 (fork servers from a preloaded template)")
+    parser.add_argument("--teardown", type=int, default=0, metavar="N",
+                        help="instead of throughput, restart a server that ignores SIGTERM N times while "
+                             "--servers others stream, and report their latency")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="instead of throughput, replay an MCP_CAPTURE file and report latency per method")
+    parser.add_argument("--target", metavar="NAME",
+                        help="--replay against this mcp_config.json server (default: the capture's file name)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="--replay pacing: 1 = as recorded, N = N times faster, 0 = max throughput "
+                             "with --concurrency requests in flight")
+    parser.add_argument("--endpoint", metavar="[HOST:]PORT",
+                        help="only run a fake MCP endpoint for pipes started separately (MCP_ENDPOINT=ws://HOST:PORT/) "
+                             "and drive --messages calls per connection")
+    parser.add_argument("--call", action="append", default=[], metavar="TOOL=JSON",
+                        help='--endpoint tools/call to send, e.g. calculator=\'{"python_expression": "1+1"}\'; repeatable')
+    parser.add_argument("--duration", type=float, default=0,
+                        help="--endpoint: seconds to run before reporting (default: until Ctrl-C)")
+    parser.add_argument("--hibernate", type=float, default=0, metavar="SECONDS",
+                        help='instead of throughput, run one server with "idle_timeout": SECONDS, let it hibernate '
+                             '--reconnects + 1 times and report memory and the waking call')
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before a case is failed")
+    parser.add_argument("--check", action="store_true",
+                        help="exit non-zero unless every server streamed concurrently and the mode's "
+                             "bounds (--slow, --teardown, --restarts, max_inflight) hold")
+    parser.add_argument("--echo", type=int, metavar="BYTES", help=argparse.SUPPRESS)
+    parser.add_argument("--delay", type=float, default=0.0, help=argparse.SUPPRESS)
+    parser.add_argument("--name", default="echo", help=argparse.SUPPRESS)
+    parser.add_argument("--ignore-term", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--crash-after", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--serve-remote", metavar="PORT", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.pipe = os.path.abspath(args.pipe)
+
+    if args.serve_remote:
+        run_remote_server(args.remote, args.serve_remote, args.echo or PAYLOADS["calculator"])
+        return
+    if args.echo is not None:
+        if args.ignore_term:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        run_echo_server(args.echo, args.delay, args.name, args.crash_after, args.hang_every, args.stderr_lines)
+        return
+    if args.forkserver:
+        os.environ["MCP_FORKSERVER"] = "1"
+    ws_options = {}
+    for option in args.ws_option:
+        key, _, value = option.partition("=")
+        try:
+            ws_options[key] = json.loads(value)
+        except ValueError:
+            ws_options[key] = value
+    entry_options = {}
+    for option in args.set:
+        key, _, value = option.partition("=")
+        try:
+            entry_options[key] = json.loads(value)
+        except ValueError:
+            entry_options[key] = value
+
+    if args.replay:
+        replay(args)
+        return
+
+    if args.endpoint:
+        host, _, port = args.endpoint.rpartition(":")
+        calls = []
+        for spec in args.call:
+            tool, _, arguments = spec.partition("=")
+            calls.append((tool, json.loads(arguments) if arguments else {}))
+        servers = {}
+        started = time.perf_counter()
+        try:
+            asyncio.run(run_endpoint(host or "127.0.0.1", int(port), args.messages, args.concurrency, calls,
+                                     args.reconnects, args.duration, servers))
+        except KeyboardInterrupt:
+            pass
+        report_endpoint(servers, time.perf_counter() - started)
+        return
+
+    if args.startup:
+        try:
+            answered = asyncio.run(asyncio.wait_for(
+                run_startup(args.pipe, args.servers, args.server), timeout=args.timeout))
+        except asyncio.TimeoutError:
+            print(f"startup: timed out after {args.timeout:.0f}s")
+            sys.exit(1)
+        print(f"launch -> first tools/list ({args.servers} servers): "
+              f"first {min(answered):.2f} s  p50 {percentile(answered, 50):.2f} s  "
+              f"last {max(answered):.2f} s")
+        return
+
+    if args.gateway:
+        failures, latencies = asyncio.run(asyncio.wait_for(
+            run_gateway(args.pipe, args.servers, args.messages), timeout=args.timeout))
+        print(f"gateway ({args.servers} servers, {len(latencies)} tools/call): "
+              f"p50 {percentile(latencies, 50) * 1e3:.3f} ms  p99 {percentile(latencies, 99) * 1e3:.3f} ms")
+        for failure in failures:
+            print(f"gateway: {failure}")
+        if args.check and failures:
+            sys.exit(1)
+        return
+
+    if args.hibernate:
+        rounds = asyncio.run(asyncio.wait_for(
+            run_hibernate(args.pipe, args.server, args.hibernate, args.reconnects + 1), timeout=args.timeout))
+        for n, r in enumerate(rounds, 1):
+            print(f"round {n}: RSS warm {r['warm_rss'] / 2**20:.1f} MB, hibernating {r['idle_rss'] / 2**20:.1f} MB  "
+                  f"warm call {r['warm'] * 1e3:.2f} ms  tools/list {r['list'] * 1e3:.2f} ms  "
+                  f"reconnect {r['reconnect'] * 1e3:.2f} ms  cold call {r['cold'] * 1e3:.0f} ms")
+        return
+
+    if args.teardown:
+        quiet, latencies, recoveries = asyncio.run(asyncio.wait_for(
+            run_teardown(args.pipe, args.servers, args.teardown, args.healthy), timeout=args.timeout))
+        for label, values in (("before the first edit", quiet), ("during restarts", latencies)):
+            print(f"other servers ({args.servers}) {label}, {len(values)} requests: "
+                  f"p50 {percentile(values, 50) * 1e3:.3f} ms  p99 {percentile(values, 99) * 1e3:.3f} ms  "
+                  f"max {max(values, default=0) * 1e3:.3f} ms")
+        print(f"stubborn server back after config edit: "
+              + "  ".join(f"{r:.2f} s" for r in recoveries))
+        if args.check and (not latencies or percentile(latencies, 99) > TEARDOWN_P99
+                           or max(latencies) > TEARDOWN_MAX or len(recoveries) < args.teardown):
+            print(f"teardown: other servers silent or above p99 {TEARDOWN_P99 * 1e3:.0f} ms / "
+                  f"max {TEARDOWN_MAX * 1e3:.0f} ms during restarts, or the stubborn server did not come back")
+            sys.exit(1)
+        return
+
+    if args.restarts:
+        recoveries = asyncio.run(run_restarts(args.pipe, args.servers, args.restarts, args.outage, args.healthy))
+        for n, recovery in enumerate(recoveries, 1):
+            if recovery is None:
+                print(f"restart {n}: not all servers reconnected")
+                continue
+            print(f"restart {n}: all {args.servers} back after {max(recovery):6.2f} s  "
+                  f"p50 {percentile(recovery, 50):6.2f} s  "
+                  f"peak reconnects within 100 ms {peak_in_window(recovery, 0.1)}")
+        if args.check and (len(recoveries) < args.restarts or None in recoveries):
+            sys.exit(1)
+        # Reconnect delays are jittered from the first attempt on, so the servers must not all come back together
+        lockstep = [n for n, recovery in enumerate(recoveries, 1)
+                    if recovery is not None and args.servers >= 4 and peak_in_window(recovery, 0.1) == args.servers]
+        if lockstep:
+            print(f"restarts {', '.join(map(str, lockstep))}: every server reconnected within 100 ms (no jitter)")
+            if args.check:
+                sys.exit(1)
+        return
+
+    failed = False
+    # A real server answers with its own payload, so only one case applies
+    cases = args.payload or (["calculator"] if args.server else ["calculator", "vnexpress"])
+    for name in cases:
+        size = PAYLOADS[name] if name in PAYLOADS else int(name)
+        ping_latencies = []
+        errors = []
+        misordered = []
+        dropped = []
+        served = []
+        entry = remote = None
+        if args.remote:
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+            remote = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--remote", args.remote,
+                                       "--serve-remote", str(port), "--echo", str(size)])
+            asyncio.run(wait_for_port(port))
+            path = "/mcp" if args.remote == "http" else "/sse"
+            entry = {"type": args.remote, "url": f"http://127.0.0.1:{port}{path}", "proxy": args.proxy}
+
+        def case(slow):
+            return asyncio.run(asyncio.wait_for(
+                run_case(args.pipe, args.servers, args.messages, args.concurrency, size,
+                         args.server, args.reconnects, slow, args.compression, args.inprocess,
+                         args.batch, ws_options, args.replicas, args.service_time,
+                         args.ping_interval, ping_latencies, args.crash_every, errors, args.standby, entry,
+                         args.hang_every, entry_options, args.stderr_lines, misordered, dropped, served,
+                         args.abandon),
+                timeout=args.timeout,
+            ))
+
+        try:
+            if args.slow and args.check:
+                # The same case without the slow servers: the throughput they must not take away
+                alone_rate = case(0)[0]
+                ping_latencies.clear()
+                errors.clear()
+                served.clear()
+            rate, latencies, spans, first_connects, reconnect_latencies, pipe_cpu, rss, wire_bytes = case(args.slow)
+        except asyncio.TimeoutError:
+            print(f"{name:>12} ({size} B): timed out after {args.timeout:.0f}s")
+            failed = True
+            continue
+        finally:
+            if remote is not None:
+                remote.terminate()
+                remote.wait()
+        print(f"{name:>12} ({size} B): {rate:10.0f} msg/s  "
+              f"p50 {percentile(latencies, 50) * 1e3:7.3f} ms  "
+              f"p99 {percentile(latencies, 99) * 1e3:7.3f} ms")
+        if args.crash_every:
+            print(f"{'':>12}  child crashes every {args.crash_every} calls: {len(errors)} requests failed, "
+                  f"{len(reconnect_latencies)} extra WebSocket connections, max latency {max(latencies) * 1e3:.1f} ms")
+            if reconnect_latencies and not args.reconnects:
+                failed = True  # a crash must not cost the endpoint its connection
+        elif errors:
+            print(f"{'':>12}  {len(errors)} requests answered with an error, max latency {max(latencies) * 1e3:.1f} ms")
+        if args.hang_every and args.replicas == 1:
+            # Only the calls the server never answers may fail: a healthy child is not restarted as stalled
+            hangs = args.servers * (args.messages * (args.reconnects + 1) // args.hang_every)
+            print(f"{'':>12}  {hangs} calls left unanswered by the server, {len(errors)} failed")
+            if args.check and len(errors) != hangs:
+                failed = True
+        if dropped:
+            print(f"{'':>12}  {len(dropped)} connections closed by the pipe during the handshake ({dropped[0]})")
+            failed = True
+        if args.slow:
+            # A child that is slow to read its stdin must delay nobody else by as much as one of its reads
+            within = percentile(latencies, 99) < SLOW_DELAY
+            print(f"{'':>12}  next to {args.slow} slow server(s): p99 {'within' if within else 'ABOVE'} "
+                  f"{SLOW_DELAY * 1e3:.0f} ms, {len(misordered)} slow-server replies out of order")
+            if args.check:
+                print(f"{'':>12}  throughput without the slow server(s) {alone_rate:.0f} msg/s")
+            if not within or misordered or (args.check and rate < alone_rate / 4):
+                failed = True
+        if entry_options.get("max_inflight"):
+            # An admitted call waits behind at most max_inflight + max_queue others; the rest must be shed
+            slots = entry_options["max_inflight"] + entry_options.get("max_queue", entry_options["max_inflight"])
+            bound = 2 * slots * args.service_time + 0.1
+            within = bool(served) and percentile(served, 99) <= bound
+            print(f"{'':>12}  admission: {len(served)} calls served, p99 {percentile(served, 99) * 1e3:.1f} ms "
+                  f"{'within' if within else 'ABOVE'} {bound * 1e3:.0f} ms; {len(errors)} calls rejected")
+            if not within:
+                failed = True
+            # Beyond the slots calls must be shed; within them only slots still held by abandoned calls shed any
+            if args.concurrency > slots and not errors:
+                failed = True
+            if args.concurrency <= slots and errors and not args.abandon:
+                failed = True
+        if ping_latencies:
+            print(f"{'':>12}  ping round trip p50 {percentile(ping_latencies, 50) * 1e3:.3f} ms  "
+                  f"p99 {percentile(ping_latencies, 99) * 1e3:.3f} ms  ({len(ping_latencies)} pings)")
+        total = args.messages * args.servers * (args.reconnects + 1)
+        if pipe_cpu is not None:
+            per_message = pipe_cpu / total
+            print(f"{'':>12}  pipe CPU {pipe_cpu:.2f} s ({per_message * 1e6:.0f} us/msg)")
+        print(f"{'':>12}  wire bytes from pipe {wire_bytes / total:.0f} B/msg")
+        if rss is not None:
+            print(f"{'':>12}  RSS pipe + children {rss / 2**20:.0f} MB")
+        print(f"{'':>12}  connect -> first response: first connect p50 "
+              f"{percentile(first_connects, 50) * 1e3:.1f} ms")
+        if reconnect_latencies:
+            print(f"{'':>12}  connect -> first response: reconnect p50 "
+                  f"{percentile(reconnect_latencies, 50) * 1e3:.1f} ms  "
+                  f"max {max(reconnect_latencies) * 1e3:.1f} ms")
+        if args.servers > 1:
+            peak = peak_overlap(spans)
+            rates = [args.messages / (last - first) for first, last in spans if first is not None and last > first]
+            print(f"{'':>12}  servers streamed {len(spans)}/{args.servers}, peak concurrent {peak}, "
+                  f"fairness (Jain over per-server msg/s) {jain_index(rates):.3f}")
+            failed = failed or peak < args.servers
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()